@@ -1,8 +1,16 @@
 # agents.py
 # Multi-agent system: Agent classes and routing
 
-from services import generate_response, get_context_from_perplexity
+from services import generate_response_async, generate_response_stream, classify_and_respond_async
+from services import FALLBACK_CONTEXT, FALLBACK_RESPONSE, FUSED_MODE, VALID_INTENTS
+from intent_classifier import fast_classifier
+from pipeline import ChatPipeline
+from cache import response_cache
+from deadline import DeadlineExceeded
+from speculation import speculator
+import metrics
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +21,24 @@ class Agent:
         self.name = name
         self.role = role
     
-    def process(self, customer_message: str, context: str) -> str:
-        """Process customer message and return response"""
-        response = generate_response(self.role, customer_message, context)
+    async def process(self, customer_message: str, context: str, history: str = "", deadline=None) -> str:
+        """
+        Process customer message and return response.
+        history: earlier turns of the conversation ("" for a first message)
+        deadline: the request's deadline.Deadline (None for no time limit)
+        Raises DeadlineExceeded if the response can't be generated in time.
+        """
+        with metrics.AGENT_SECONDS.time(agent=self.name):
+            response = await generate_response_async(self.role, customer_message, context, history, deadline)
         logger.info(f"{self.name} processed message")
         return response
+    
+    async def process_stream(self, customer_message: str, context: str, history: str = ""):
+        """Process customer message, yielding the response as it is generated"""
+        with metrics.AGENT_SECONDS.time(agent=self.name):
+            async for token in generate_response_stream(self.role, customer_message, context, history):
+                yield token
+        logger.info(f"{self.name} streamed message")
 
 
 class BillingAgent(Agent):
@@ -34,9 +55,9 @@ class BillingAgent(Agent):
     def __init__(self):
         super().__init__("BillingAgent", "billing")
     
-    def process(self, customer_message: str, context: str) -> str:
+    async def process(self, customer_message: str, context: str, history: str = "", deadline=None) -> str:
         """Process billing inquiries"""
-        response = super().process(customer_message, context)
+        response = await super().process(customer_message, context, history, deadline)
         logger.info("BillingAgent: Processed billing inquiry")
         return response
 
@@ -55,9 +76,9 @@ class SalesAgent(Agent):
     def __init__(self):
         super().__init__("SalesAgent", "sales")
     
-    def process(self, customer_message: str, context: str) -> str:
+    async def process(self, customer_message: str, context: str, history: str = "", deadline=None) -> str:
         """Process sales inquiries"""
-        response = super().process(customer_message, context)
+        response = await super().process(customer_message, context, history, deadline)
         logger.info("SalesAgent: Processed sales inquiry")
         return response
 
@@ -76,9 +97,9 @@ class TechSupportAgent(Agent):
     def __init__(self):
         super().__init__("TechSupportAgent", "technical_support")
     
-    def process(self, customer_message: str, context: str) -> str:
+    async def process(self, customer_message: str, context: str, history: str = "", deadline=None) -> str:
         """Process technical support inquiries"""
-        response = super().process(customer_message, context)
+        response = await super().process(customer_message, context, history, deadline)
         logger.info("TechSupportAgent: Processed technical support inquiry")
         return response
 
@@ -89,30 +110,183 @@ class GeneralAgent(Agent):
         super().__init__("GeneralAgent", "other")
 
 
+AGENT_CLASSES = {
+    "billing": BillingAgent,
+    "sales": SalesAgent,
+    "technical_support": TechSupportAgent,
+    "other": GeneralAgent,
+}
+
+
 class AgentRouter:
-    """Routes customer messages to appropriate agent"""
+    """Routes customer messages to appropriate agent; agents are created on first use"""
     def __init__(self):
-        self.agents = {
-            "billing": BillingAgent(),
-            "sales": SalesAgent(),
-            "technical_support": TechSupportAgent(),
-            "other": GeneralAgent(),
-        }
-        logger.info("AgentRouter initialized with all agents")
+        self.agents = {}
+        self._lock = threading.Lock()
+        logger.info("AgentRouter initialized")
+    
+    def agent(self, intent: str) -> Agent:
+        """Agent for intent (GeneralAgent for anything unrecognized)"""
+        if intent not in AGENT_CLASSES:
+            intent = "other"
+        agent = self.agents.get(intent)
+        if agent is None:
+            with self._lock:
+                agent = self.agents.get(intent)
+                if agent is None:
+                    agent = self.agents[intent] = AGENT_CLASSES[intent]()
+        return agent
+    
+    def warm_up(self):
+        """Create every agent ahead of the first request"""
+        for intent in AGENT_CLASSES:
+            self.agent(intent)
     
-    def route(self, intent: str, customer_message: str) -> tuple:
+    async def route(self, pipeline: ChatPipeline) -> tuple:
         """
         Route customer message to appropriate agent.
+        Reuses the intent and context already resolved on the pipeline, and
+        short-circuits on a response-cache hit. Messages with conversation
+        history bypass the cache, since the answer depends on earlier turns.
+        The agent gets what's left of pipeline.deadline; if that runs out, a
+        cached answer or the fallback response is sent instead.
+        With speculative routing on, the predicted agent starts generating
+        while classification runs; its response is used if the prediction
+        was right and cancelled otherwise. In fused mode, a message that needs
+        Gemini to classify it is classified and answered in one call, falling
+        back to the separate stages if that reply can't be used.
         Returns: (agent_name, response)
         """
+        if FUSED_MODE and self._fusable(pipeline):
+            routed = await self._route_fused(pipeline)
+            if routed is not None:
+                return routed
+        
         # Get the agent
-        agent = self.agents.get(intent, self.agents["other"])
+        speculation = speculator.start(self, pipeline)
+        try:
+            intent = await pipeline.classify()
+        except BaseException:
+            await speculator.discard(speculation, pipeline, "abandoned")
+            raise
+        agent = self.agent(intent)
+        if speculation is not None and self.agent(speculation.intent) is not agent:
+            await speculator.discard(speculation, pipeline)
+            speculation = None
         
-        # Get context
-        context = get_context_from_perplexity(customer_message)
+        # Check the response cache
+        cached = None if pipeline.history else response_cache.lookup(intent, pipeline.customer_message)
+        if cached is not None:
+            await speculator.discard(speculation, pipeline, "cached")
+            pipeline.use_cached(cached)
+            logger.info(f"Routed to {cached['agent_name']} (cached)")
+            return cached["agent_name"], cached["response"]
         
-        # Get response from agent
-        response = agent.process(customer_message, context)
+        # Get context, and the response from the agent within what's left of the request deadline
+        try:
+            if speculation is not None:
+                response = await speculator.commit(speculation, pipeline)
+                context = pipeline.context
+            else:
+                context = await pipeline.retrieve_context()
+                response = await agent.process(pipeline.customer_message, context, pipeline.history, pipeline.deadline)
+        except DeadlineExceeded:
+            return self._past_deadline(pipeline, intent, agent)
+        if response != FALLBACK_RESPONSE and not pipeline.history:
+            response_cache.store(intent, pipeline.customer_message, agent.name, response, context)
         
         logger.info(f"Routed to {agent.name}")
         return agent.name, response
+    
+    def _fusable(self, pipeline: ChatPipeline) -> bool:
+        """
+        Whether the fused call saves anything: not when the intent is known
+        already (sticky session), the local classifier is confident, or the
+        response cache has an answer to the message.
+        """
+        if pipeline.intent is not None:
+            return False
+        label, confidence, source = fast_classifier.predict(pipeline.customer_message)
+        if source != "none" and confidence >= fast_classifier.threshold:
+            return False
+        if pipeline.history:
+            return True
+        return not any(response_cache.contains(intent, pipeline.customer_message) for intent in VALID_INTENTS)
+    
+    async def _route_fused(self, pipeline: ChatPipeline):
+        """
+        Classify, summarize context and respond in one Gemini call. Context
+        retrieval is cancelled (it restarts if the multi-call path takes over).
+        Returns: (agent_name, response), or None to route the usual way
+        """
+        pipeline.cancel_context()
+        try:
+            fused = await classify_and_respond_async(pipeline.customer_message, pipeline.history, pipeline.deadline)
+        except DeadlineExceeded:
+            pipeline.intent, pipeline.intent_source = "other", "fallback"
+            routed = self._past_deadline(pipeline, pipeline.intent, self.agent(pipeline.intent))
+            # Context retrieval was cancelled above, so unless the cache supplied some there is none
+            if pipeline.context is None:
+                pipeline.context = FALLBACK_CONTEXT
+            return routed
+        if fused is None:
+            return None
+        pipeline.intent, pipeline.intent_source = fused["intent"], "fused"
+        if pipeline.context is None:
+            pipeline.context = fused["context"]
+        agent = self.agent(pipeline.intent)
+        if fused["response"] != FALLBACK_RESPONSE and not pipeline.history:
+            response_cache.store(pipeline.intent, pipeline.customer_message, agent.name, fused["response"],
+                                 pipeline.context)
+        logger.info(f"Routed to {agent.name} (fused)")
+        return agent.name, fused["response"]
+    
+    def _past_deadline(self, pipeline: ChatPipeline, intent: str, agent: Agent) -> tuple:
+        """
+        Answer for a request whose response couldn't be generated in time: a
+        cached answer to the same question (even mid-conversation), else the
+        fallback apology.
+        Returns: (agent_name, response)
+        """
+        cached = response_cache.lookup(intent, pipeline.customer_message)
+        if cached is not None:
+            pipeline.use_cached(cached)
+            metrics.FALLBACKS.inc(stage="generate", fallback="deadline_cached")
+            logger.warning(f"Deadline reached, answering from cache for {cached['agent_name']}")
+            return cached["agent_name"], cached["response"]
+        metrics.FALLBACKS.inc(stage="generate", fallback="deadline")
+        logger.warning(f"Deadline reached before {agent.name} answered, sending fallback response")
+        return agent.name, FALLBACK_RESPONSE
+    
+    async def route_stream(self, pipeline: ChatPipeline) -> tuple:
+        """
+        Streaming variant of route. Returns once the agent is picked, so the
+        caller knows the intent before the first token.
+        Returns: (agent_name, async iterator of response text chunks)
+        """
+        intent = await pipeline.classify()
+        agent = self.agent(intent)
+        
+        cached = None if pipeline.history else response_cache.lookup(intent, pipeline.customer_message)
+        if cached is not None:
+            pipeline.use_cached(cached)
+            logger.info(f"Routed to {cached['agent_name']} (cached)")
+            return cached["agent_name"], _replay(cached["response"])
+        
+        context = await pipeline.retrieve_context()
+        logger.info(f"Routed to {agent.name} (streaming)")
+        return agent.name, self._stream_and_cache(agent, intent, pipeline.customer_message, context, pipeline.history)
+    
+    async def _stream_and_cache(self, agent: Agent, intent: str, customer_message: str, context: str,
+                                history: str = ""):
+        parts = []
+        async for token in agent.process_stream(customer_message, context, history):
+            parts.append(token)
+            yield token
+        response = "".join(parts)
+        if response != FALLBACK_RESPONSE and not history:
+            response_cache.store(intent, customer_message, agent.name, response, context)
+
+
+async def _replay(response: str):
+    yield response
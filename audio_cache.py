@@ -0,0 +1,284 @@
+# audio_cache.py
+# Content-addressed on-disk cache of synthesized speech
+#
+# Audio is stored under AUDIO_CACHE_DIR as <key[:2]>/<key>.mp3, where key is the
+# SHA-256 of (model, voice, text), so a phrase synthesized once - a greeting,
+# "restart your device", the escalation notice - is never paid for again.
+# Files are written to a temporary name and renamed into place, so readers
+# (including other worker processes) never see partial audio. An SQLite index
+# next to the files records each entry's size and last use; once the total
+# passes AUDIO_CACHE_MAX_MB the least recently used files are deleted.
+#
+# Pre-synthesize the phrases that come up most in the interaction log:
+#
+#     python audio_cache.py --top 200 --min-count 3
+#     python audio_cache.py --dry-run          # list them without synthesizing
+
+from collections import Counter
+from starlette.responses import FileResponse
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "1") == "1"
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", "512"))
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_audio_lru ON audio (accessed_at);
+"""
+
+
+class AudioFileResponse(FileResponse):
+    """
+    FileResponse that hands the file to the server when it implements the
+    ASGI pathsend extension, which sends it with sendfile() without the
+    bytes passing through Python; otherwise it is streamed in chunks.
+    """
+    async def __call__(self, scope, receive, send):
+        if "http.response.pathsend" not in scope.get("extensions", {}):
+            return await super().__call__(scope, receive, send)
+        stat_result = await asyncio.to_thread(os.stat, self.path)
+        self.set_stat_headers(stat_result)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+
+
+class AudioCache:
+    """
+    Synthesized audio on disk, keyed by content, with a size-bounded LRU.
+    Concurrent async requests for the same uncached audio share one
+    synthesis (within a worker; workers share stored files, not in-flight calls).
+    """
+    EVICT_EVERY = 16
+    # Reads refresh an entry's LRU position at most this often
+    TOUCH_INTERVAL_S = 1.0
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: float = AUDIO_CACHE_MAX_MB * 1024 * 1024,
+                 enabled: bool = AUDIO_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection to the index, opened (and the directory created) on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=5,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        """Returns: hex SHA-256 of the model, voice and whitespace-normalized text"""
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{model}\0{voice}\0{normalized}".encode()).hexdigest()
+
+    @staticmethod
+    def is_key(key: str) -> bool:
+        return bool(_KEY_RE.match(key))
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def locate(self, key: str):
+        """
+        Returns: path of the cached file for key, or None on a miss.
+        Refreshes the entry's LRU position.
+        """
+        if not self.enabled:
+            return None
+        conn = self._connect()
+        row = conn.execute("SELECT accessed_at FROM audio WHERE key = ?", (key,)).fetchone()
+        path = self.path(key)
+        if row is None or not os.path.exists(path):
+            if row is not None:
+                conn.execute("DELETE FROM audio WHERE key = ?", (key,))
+            self._count("misses")
+            return None
+        now = time.time()
+        if now - row[0] >= self.TOUCH_INTERVAL_S:
+            conn.execute("UPDATE audio SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return path
+
+    def read(self, key: str):
+        """Returns: cached audio bytes, or None on a miss"""
+        path = self.locate(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another worker since locate()
+            return None
+
+    def put(self, key: str, audio: bytes):
+        """Store audio under key, evicting least recently used files past max_bytes"""
+        if not self.enabled:
+            return
+        conn = self._connect()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, path)
+        conn.execute(
+            "INSERT OR REPLACE INTO audio (key, size, accessed_at) VALUES (?, ?, ?)", (key, len(audio), time.time())
+        )
+        self._count("stores")
+        if next(self._writes) % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete least recently used files until the cache fits in max_bytes.
+        Returns: files deleted
+        """
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM audio").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM audio ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM audio WHERE key = ?", (key,))
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        self._count("evictions", evicted)
+        logger.info(f"Evicted {evicted} audio files, {total / 1024 / 1024:.1f} MB cached")
+        return evicted
+
+    async def coalesce(self, key: str, synthesize):
+        """
+        Run synthesize() (a coroutine function) once for all concurrent
+        callers asking for the same uncached key.
+        Returns: synthesize()'s result
+        """
+        flight = (asyncio.get_running_loop(), key)
+        task = self._in_flight.get(flight)
+        if task is None:
+            task = asyncio.ensure_future(synthesize())
+            self._in_flight[flight] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(flight, None))
+        else:
+            self._count("coalesced")
+        # Shield so one cancelled caller (e.g. past its deadline) does not abort the shared synthesis
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Counters plus entry count and size from the index (disk IO: call it off the event loop)"""
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        entries, size = (0, 0)
+        if self.enabled:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio").fetchone()
+        return {
+            **counters,
+            "entries": entries,
+            "mb": round(size / 1024 / 1024, 2),
+            "in_flight": len(self._in_flight),
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared instance used by services.py and main.py
+audio_cache = AudioCache()
+
+
+def frequent_phrases(entries, top: int, min_count: int) -> list:
+    """
+    The texts most often sent to speech synthesis: whole responses (/voice)
+    and their sentences (/voice/stream), split the same way voice.py does.
+    Returns: [(text, count)], most frequent first
+    """
+    from voice import SentenceChunker
+    counts = Counter()
+    for entry in entries:
+        response = (entry.get("response") or "").strip()
+        if not response:
+            continue
+        counts[response] += 1
+        chunker = SentenceChunker()
+        sentences = chunker.feed(response) + chunker.flush()
+        if len(sentences) > 1:
+            counts.update(sentences)
+    return [(text, count) for text, count in counts.most_common(top) if count >= min_count]
+
+
+async def warm(phrases: list, concurrency: int) -> dict:
+    """Synthesize phrases that aren't cached yet. Returns: {"cached": n, "synthesized": n, "failed": n}"""
+    from services import text_to_speech_async, ELEVENLABS_VOICE, ELEVENLABS_MODEL
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {"cached": 0, "synthesized": 0, "failed": 0}
+
+    async def one(text: str):
+        if os.path.exists(audio_cache.path(AudioCache.key(text, ELEVENLABS_VOICE, ELEVENLABS_MODEL))):
+            results["cached"] += 1
+            return
+        async with semaphore:
+            result = await text_to_speech_async(text)
+        results["synthesized" if result["success"] else "failed"] += 1
+
+    await asyncio.gather(*(one(text) for text, _ in phrases))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-synthesize the most frequent phrases in the interaction log")
+    parser.add_argument("--top", type=int, default=200, help="phrases to consider, most frequent first")
+    parser.add_argument("--min-count", type=int, default=3, help="skip phrases seen fewer times")
+    parser.add_argument("--since", help="only interactions from this ISO timestamp on")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", help="list the phrases without synthesizing")
+    args = parser.parse_args()
+
+    from providers import load_env
+    load_env()
+    from log_store import InteractionLogStore
+    store = InteractionLogStore()
+    phrases = frequent_phrases(store.export(since=args.since), args.top, args.min_count)
+    store.close()
+    if args.dry_run:
+        for text, count in phrases:
+            print(f"{count:>6}  {text[:100]}")
+    else:
+        print(f"Warming {len(phrases)} phrases into {AUDIO_CACHE_DIR}: {asyncio.run(warm(phrases, args.concurrency))}")
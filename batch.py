@@ -0,0 +1,115 @@
+# batch.py
+# Bulk ticket triage: batched classification, deduplication, bounded-concurrency generation
+
+from services import classify_intents_batch_async
+from pipeline import ChatPipeline
+from cache import normalize_message
+from limits import Overloaded
+from sessions import ANONYMOUS_CUSTOMER
+import limits
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Batch runs at the lowest upstream priority; shed calls back off and retry this many times
+BATCH_SHED_RETRIES = int(os.getenv("BATCH_SHED_RETRIES", "3"))
+
+
+async def _retry_when_shed(call):
+    """Await call(), backing off for Retry-After whenever the limiter sheds it"""
+    for attempt in range(BATCH_SHED_RETRIES + 1):
+        try:
+            return await call()
+        except Overloaded as e:
+            if attempt == BATCH_SHED_RETRIES:
+                raise
+            logger.info(f"Batch call shed by {e.provider}, retrying in {e.retry_after_s:g}s")
+            await asyncio.sleep(e.retry_after_s)
+
+
+async def triage_batch(tickets: list, router, on_complete=None, concurrency: int = BATCH_CONCURRENCY):
+    """
+    Run many tickets through the chat pipeline.
+    tickets: list of {"message": str, "customer_id": str}
+    on_complete: optional callback(pipeline) for each finished ticket (e.g. logging)
+
+    Identical messages (after normalization) are answered once. Intents for
+    all unique messages come from one batched classification; context and
+    generation run with at most `concurrency` messages in flight. Batch
+    calls have the lowest upstream priority; when the limiter sheds one it
+    is retried after its Retry-After.
+    Yields one result dict per ticket in completion order, then a final
+    {"summary": ...} dict with throughput.
+    """
+    start = time.perf_counter()
+    limits.set_priority("batch")
+
+    # Deduplicate: normalized message -> indexes of the tickets that share it
+    groups = {}
+    for index, ticket in enumerate(tickets):
+        groups.setdefault(normalize_message(ticket["message"]), []).append(index)
+    unique = [tickets[indexes[0]]["message"] for indexes in groups.values()]
+
+    intents = await _retry_when_shed(lambda: classify_intents_batch_async(unique))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(message: str, intent: str, indexes: list) -> tuple:
+        async with semaphore:
+            pipeline = ChatPipeline(message, tickets[indexes[0]].get("customer_id") or ANONYMOUS_CUSTOMER, "batch")
+            # Mixed local and batched-Gemini labels, so not used for training
+            pipeline.intent, pipeline.intent_source = intent, "batch"
+            try:
+                await _retry_when_shed(lambda: pipeline.run(router))
+                return pipeline, indexes, None
+            except Exception as e:
+                logger.error(f"Batch item failed: {e}")
+                return pipeline, indexes, str(e)
+
+    tasks = [
+        asyncio.ensure_future(run(message, intent, indexes))
+        for message, intent, indexes in zip(unique, intents, groups.values())
+    ]
+    completed = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            pipeline, indexes, error = await next_done
+            for index in indexes:
+                ticket = tickets[index]
+                result = {
+                    "index": index,
+                    "customer_id": ticket.get("customer_id") or ANONYMOUS_CUSTOMER,
+                    "agent_type": pipeline.intent,
+                    "response": pipeline.response,
+                    "deduplicated": index != indexes[0],
+                    "cost": round(pipeline.meter.cost, 6) if index == indexes[0] else 0.0,
+                }
+                if error is not None:
+                    result["error"] = error
+                    failed += 1
+                else:
+                    completed += 1
+                    if on_complete is not None:
+                        # The shared run is logged once per ticket; its cost only on the first
+                        pipeline.customer_id = result["customer_id"]
+                        pipeline.deduplicated = result["deduplicated"]
+                        on_complete(pipeline)
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "messages": len(tickets),
+        "unique_messages": len(unique),
+        "completed": completed,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_second": round(len(tickets) / elapsed, 2) if elapsed else 0.0,
+    }
+    logger.info(f"Batch triage: {summary}")
+    yield {"summary": summary}
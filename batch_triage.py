@@ -0,0 +1,84 @@
+# batch_triage.py
+# CLI for bulk ticket triage (email/SMS backlogs)
+#
+# Input is JSONL ({"message": ..., "customer_id": ...} per line) or plain text
+# (one message per line). Results are written as NDJSON in completion order.
+#
+#     python batch_triage.py tickets.jsonl --out results.ndjson
+#     python batch_triage.py tickets.jsonl --url http://localhost:8000
+
+import argparse
+import asyncio
+import json
+import sys
+import httpx
+
+
+def load_tickets(path: str) -> list:
+    tickets = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                ticket = json.loads(line)
+            else:
+                ticket = {"message": line}
+            ticket.setdefault("customer_id", f"batch_{number}")
+            tickets.append(ticket)
+    return tickets
+
+
+async def run_local(tickets: list, concurrency: int):
+    """Triage in-process, logging to the local interaction store"""
+    from main import router, interaction_log
+    from batch import triage_batch, BATCH_CONCURRENCY
+    try:
+        async for result in triage_batch(
+            tickets, router, concurrency=concurrency or BATCH_CONCURRENCY,
+            on_complete=lambda pipeline: interaction_log.append(pipeline.to_log_entry()),
+        ):
+            yield result
+    finally:
+        interaction_log.close()
+
+
+async def run_remote(tickets: list, url: str):
+    """Stream results from a running server's /chat/batch endpoint"""
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", f"{url.rstrip('/')}/chat/batch", json={"messages": tickets}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+async def main(args):
+    tickets = load_tickets(args.tickets)
+    results = run_remote(tickets, args.url) if args.url else run_local(tickets, args.concurrency)
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        async for result in results:
+            if "summary" in result:
+                summary = result["summary"]
+                print(
+                    f"Triaged {summary['messages']} messages ({summary['unique_messages']} unique) "
+                    f"in {summary['elapsed_s']}s: {summary['messages_per_second']} messages/sec, "
+                    f"{summary['failed']} failed",
+                    file=sys.stderr,
+                )
+            else:
+                out.write(json.dumps(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-triage a backlog of customer messages")
+    parser.add_argument("tickets", help="JSONL or plain-text file of messages")
+    parser.add_argument("--out", help="write NDJSON results here instead of stdout")
+    parser.add_argument("--url", help="use a running server instead of triaging in-process")
+    parser.add_argument("--concurrency", type=int, help="in-process generation concurrency (default BATCH_CONCURRENCY)")
+    asyncio.run(main(parser.parse_args()))
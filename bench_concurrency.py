@@ -0,0 +1,68 @@
+# bench_concurrency.py
+# Concurrency benchmark: /chat throughput against local stub upstreams
+#
+# Every request sends a different message (a few templates, each with a
+# unique ticket number), so the response and context caches don't turn the
+# run into a measurement of cache hits.
+
+import argparse
+import asyncio
+import logging
+import time
+import httpx
+import stub_upstream
+from main import app
+
+MESSAGES = [
+    "My phone keeps dropping calls at home, ticket {ticket}.",
+    "Why is my bill higher than last month? Ticket {ticket}.",
+    "Which plan would suit a family of four? Ticket {ticket}.",
+    "I have a question about my account, ticket {ticket}.",
+]
+
+
+async def run_level(concurrency: int, total: int) -> float:
+    """Send `total` /chat requests with `concurrency` in flight; return requests/sec"""
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int):
+            async with semaphore:
+                response = await client.post("/chat", json={
+                    "message": MESSAGES[i % len(MESSAGES)].format(ticket=f"{concurrency}-{i}"),
+                    "customer_id": f"bench_{concurrency}_{i}",
+                })
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return total / elapsed
+
+
+async def main(levels: list, requests_per_level: int, latency_s: float, port: int):
+    stub_upstream.install(gemini_latency_s=latency_s, perplexity_port=port)
+    server = stub_upstream.StubServer(stub_upstream.create_perplexity_app(latency_s), port).start()
+    try:
+        print(f"{'concurrency':>12} {'req/s':>10} {'speedup':>10}")
+        baseline = None
+        for level in levels:
+            throughput = await run_level(level, max(requests_per_level, level))
+            baseline = baseline or throughput
+            print(f"{level:>12} {throughput:>10.2f} {throughput / baseline:>9.1f}x")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /chat throughput against stub upstreams")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub upstream latency (seconds)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(args.levels, args.requests, args.latency, args.port))
@@ -0,0 +1,103 @@
+# bench_fused.py
+# Latency and token cost of the fused classify-and-respond call against the multi-call pipeline
+#
+#     python bench_fused.py
+#     python bench_fused.py --context gemini --gemini-latency lognormal:0.3,0.4 --requests 400
+#
+# Every message is one the local classifier and knowledge base can't handle,
+# so the multi-call pipeline classifies with Gemini, fetches context (from
+# Perplexity, or with --context gemini from the Gemini fallback) and then
+# generates; fused mode makes one Gemini call. Token counts are estimated from
+# prompt and reply text, as metering does for the stubs.
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+MESSAGES = [
+    "Something odd has been going on with my account lately, case {i}",
+    "I have a question about an order I placed last week, ref {i}",
+    "My phone has been acting strange since yesterday, ticket {i}",
+    "Can someone look into what happened on my line, case {i}",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(fused: bool, args) -> dict:
+    import agents
+    from agents import AgentRouter
+    from pipeline import ChatPipeline
+
+    agents.FUSED_MODE = fused
+    router = AgentRouter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, meters = [], []
+
+    async def one(i: int):
+        message = MESSAGES[i % len(MESSAGES)].format(i=f"{'f' if fused else 'm'}{i}")
+        async with semaphore:
+            start = time.perf_counter()
+            pipeline = ChatPipeline(message, f"bench-{i}", "chat")
+            await pipeline.run(router)
+            pipeline.finish()
+            latencies.append((time.perf_counter() - start) * 1000)
+            meters.append(pipeline.meter)
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    gemini = [call for meter in meters for call in meter.calls if call["provider"] == "gemini"]
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "gemini_calls": len(gemini) / args.requests,
+        "input_tokens": sum(call["input_tokens"] for call in gemini) / args.requests,
+        "output_tokens": sum(call["output_tokens"] for call in gemini) / args.requests,
+        "cost": sum(meter.cost for meter in meters) / args.requests,
+    }
+
+
+def main(args):
+    import stub_upstream
+    from providers import registry as providers
+
+    stub_upstream.install(args.gemini_latency, args.perplexity_port, seed=args.seed)
+    server = stub_upstream.StubServer(
+        stub_upstream.create_perplexity_app(args.perplexity_latency), args.perplexity_port
+    ).start()
+    if args.context == "gemini":
+        providers.override("perplexity", None)
+    print(f"gemini {args.gemini_latency}, context from {args.context}"
+          f"{f' ({args.perplexity_latency})' if args.context == 'perplexity' else ''}, {args.requests} requests")
+    print(f"{'mode':>10} {'p50_ms':>8} {'p95_ms':>8} {'gemini_calls':>13} {'input_tokens':>13} "
+          f"{'output_tokens':>14} {'cost_usd':>10}")
+    try:
+        for mode, fused in (("multi_call", False), ("fused", True)):
+            result = asyncio.run(run(fused, args))
+            print(f"{mode:>10} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['gemini_calls']:>13.2f} "
+                  f"{result['input_tokens']:>13.1f} {result['output_tokens']:>14.1f} {result['cost']:>10.6f}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fused classify-and-respond against separate calls")
+    parser.add_argument("--gemini-latency", default="0.3", help="stub Gemini latency spec")
+    parser.add_argument("--perplexity-latency", default="0.4", help="stub Perplexity latency spec")
+    parser.add_argument("--perplexity-port", type=int, default=8765)
+    parser.add_argument("--context", choices=("perplexity", "gemini"), default="perplexity",
+                        help="where the multi-call pipeline gets context")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ.setdefault("LOG_DB_PATH", os.path.join(tmpdir, "bench.db"))
+        main(args)
@@ -0,0 +1,68 @@
+# bench_hedging.py
+# Tail latency of Gemini response generation with and without hedged requests
+#
+#     python bench_hedging.py
+#     python bench_hedging.py --latency lognormal:0.3,0.8 --requests 2000 --concurrency 16
+#
+# Gemini is replaced by a stub with a long-tailed latency distribution. Each
+# mode sends the same number of generate_response_async calls; the hedged
+# mode sends a duplicate once a call passes the recent p95 (within the
+# HEDGE_BUDGET share of calls), so the extra upstream calls are reported too.
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import services
+import stub_upstream
+from deadline import Hedger, HEDGE_BUDGET
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(hedger: Hedger, requests: int, concurrency: int) -> dict:
+    services.hedger = hedger
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await services.generate_response_async("billing", f"Question {i} about my bill", "")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    stats = hedger.stats().get("generate:standard", {})
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "extra_calls": stats.get("hedged", 0) / requests,
+    }
+
+
+def main(args):
+    stub_upstream.install(gemini_latency_s=args.latency, seed=args.seed)
+    print(f"stub Gemini latency {args.latency}, {args.requests} calls, concurrency {args.concurrency}, "
+          f"hedge budget {args.budget:.0%}")
+    print(f"{'mode':>10} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'max_ms':>8} {'extra_calls':>12}")
+    for mode, enabled in (("unhedged", False), ("hedged", True)):
+        result = asyncio.run(run(Hedger(enabled=enabled, budget=args.budget), args.requests, args.concurrency))
+        print(f"{mode:>10} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['max_ms']:>8.1f} {result['extra_calls']:>12.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hedged Gemini calls")
+    parser.add_argument("--latency", default="lognormal:0.2,1.0", help="stub Gemini latency spec")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--budget", type=float, default=HEDGE_BUDGET, help="share of calls that may be hedged")
+    parser.add_argument("--seed", type=int, default=1)
+    logging.basicConfig(level=logging.WARNING)
+    main(parser.parse_args())
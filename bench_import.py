@@ -0,0 +1,67 @@
+# bench_import.py
+# Cold-start benchmark: import time of services/main and test-client startup
+#
+#     python bench_import.py
+#     python bench_import.py --runs 10
+#
+# Each measurement runs in a fresh interpreter, so module caches don't carry over.
+# "main + warm_up" is what importing main cost when every provider was built
+# eagerly at import; the other rows are what a server or test client pays now.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SNIPPETS = {
+    "import services": "import services",
+    "import main": "import main",
+    "TestClient + /health": (
+        "from fastapi.testclient import TestClient\n"
+        "import main\n"
+        "TestClient(main.app).get('/health')"
+    ),
+    "main + warm_up": (
+        "import main\n"
+        "main.providers.warm_up()\n"
+        "main.router.warm_up()"
+    ),
+}
+
+TEMPLATE = """
+import json, time
+start = time.perf_counter()
+{body}
+elapsed = (time.perf_counter() - start) * 1000
+import sys
+print(json.dumps({{"ms": elapsed, "gemini_sdk_loaded": "google.generativeai" in sys.modules}}))
+"""
+
+
+def measure(body: str, env: dict) -> dict:
+    code = TEMPLATE.format(body=body)
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "LOG_DB_PATH": os.path.join(tmp, "bench.db")}
+        print(f"{'':>22} {'median_ms':>10} {'min_ms':>10} {'gemini_sdk':>11}")
+        for label, body in SNIPPETS.items():
+            results = [measure(body, env) for _ in range(args.runs)]
+            times = [result["ms"] for result in results]
+            print(f"{label:>22} {statistics.median(times):>10.1f} {min(times):>10.1f} "
+                  f"{str(results[0]['gemini_sdk_loaded']):>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cold import and startup time")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    main(parser.parse_args())
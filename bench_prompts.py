@@ -0,0 +1,87 @@
+# bench_prompts.py
+# Prompt size and generation latency with and without the prompt token budgets
+#
+#     python bench_prompts.py
+#     python bench_prompts.py --prefill-ms 150 --repeat 20
+#
+# Gemini is replaced by a stub whose latency grows with prompt size
+# (--prefill-ms per thousand prompt tokens), so the saving in tokens shows up
+# as a saving in time-to-response.
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import metering
+import services
+import stub_upstream
+from prompts import PromptRegistry
+from providers import registry as providers
+
+CONTEXT = (
+    "Dropped calls are usually caused by weak signal indoors, moving between towers, or outdated "
+    "carrier settings. Restart the phone, install carrier and software updates, and turn on Wi-Fi "
+    "Calling at home or work. If calls drop in one location only, report the location so the network "
+    "team can investigate. "
+)
+TURNS = [
+    ("Customer", "My calls keep dropping when I'm at home, it happens several times a day."),
+    ("Agent", "I'm sorry about that. 1. Restart your phone. 2. Turn on Wi-Fi Calling in settings. "
+              "3. Check for a carrier settings update. Let me know if the calls still drop."),
+]
+
+# name: (context, history)
+SCENARIOS = {
+    "first_turn": (CONTEXT * 2, ""),
+    "follow_up": (CONTEXT * 2, "\n".join(f"{role}: {text}" for role, text in TURNS * 3)),
+    "long_context": (
+        CONTEXT * 8,
+        "Earlier: " + " ".join(text for _, text in TURNS * 2) + "\n"
+        + "\n".join(f"{role}: {text}" for role, text in TURNS * 3),
+    ),
+}
+MESSAGE = "It still drops even with Wi-Fi Calling on, what else can I try?"
+
+
+def render_us(registry: PromptRegistry, context: str, history: str, repeat: int = 2000) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        registry.render("technical_support", MESSAGE, context, history)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def generate_ms(context: str, history: str, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await services.generate_response_async("technical_support", MESSAGE, context, history)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main(args):
+    stub_upstream.install(gemini_latency_s=args.latency)
+    providers.get("gemini").prefill_s_per_1k_tokens = args.prefill_ms / 1000
+    registries = {
+        "unbudgeted": PromptRegistry(max_tokens=0, context_tokens=0, history_tokens=0),
+        "budgeted": PromptRegistry(),
+    }
+    print(f"stub Gemini: {args.latency * 1000:.0f} ms + {args.prefill_ms:.0f} ms per 1k prompt tokens")
+    print(f"{'scenario':>14} {'prompts':>12} {'tokens':>8} {'render_us':>10} {'p50_ms':>8} {'mean_ms':>8}")
+    for name, (context, history) in SCENARIOS.items():
+        for label, registry in registries.items():
+            services.prompt_registry = registry
+            tokens = metering.estimate_tokens(registry.render("technical_support", MESSAGE, context, history))
+            latencies = asyncio.run(generate_ms(context, history, args.repeat))
+            print(f"{name:>14} {label:>12} {tokens:>8} {render_us(registry, context, history):>10.1f} "
+                  f"{statistics.median(latencies):>8.1f} {statistics.mean(latencies):>8.1f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark prompt token budgets")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub Gemini base latency (s)")
+    parser.add_argument("--prefill-ms", type=float, default=150, help="stub latency per 1k prompt tokens (ms)")
+    parser.add_argument("--repeat", type=int, default=10, help="generations per scenario")
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+# bench_retrieval.py
+# Recall/latency benchmark for the local knowledge-base index
+#
+#     python bench_retrieval.py
+#     python bench_retrieval.py --threshold 0.6 --repeat 200
+
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+from retrieval import KnowledgeIndex, KB_CORPUS_DIR, KB_MIN_CONFIDENCE
+
+# (customer message, passage id that answers it)
+EVAL_QUERIES = [
+    ("Why is my bill so high this month?", "billing_faq#why-is-my-bill-higher-than-usual"),
+    ("There's a partial charge on my bill after I changed plans", "billing_faq#prorated-charges-after-a-plan-change"),
+    ("I lost my autopay discount", "billing_faq#autopay-discount"),
+    ("Can I pay my bill with cash at a store?", "billing_faq#payment-options"),
+    ("I can't pay the full balance before the due date", "billing_faq#payment-arrangements-for-a-past-due-balance"),
+    ("I was charged a late fee", "billing_faq#late-fees-and-service-suspension"),
+    ("How long does a refund take to reach my bank?", "billing_faq#refunds-and-bill-credits"),
+    ("I want to dispute a charge on my bill", "billing_faq#disputing-a-charge"),
+    ("How do I pay off my phone installment early?", "billing_faq#device-payment-plans-eip"),
+    ("Can I change my bill due date?", "billing_faq#paperless-billing-and-bill-due-date"),
+    ("My phone keeps dropping calls at home", "network_troubleshooting#dropped-calls"),
+    ("My phone says SOS only", "network_troubleshooting#no-service-no-signal-or-sos-only"),
+    ("Mobile data is really slow today", "network_troubleshooting#slow-mobile-data"),
+    ("How do I turn on wifi calling?", "network_troubleshooting#wi-fi-calling"),
+    ("Is there an outage in my area?", "network_troubleshooting#network-outage-check"),
+    ("I don't see 5G on my phone", "network_troubleshooting#5g-not-showing-on-the-phone"),
+    ("What APN should I use?", "network_troubleshooting#apn-settings"),
+    ("How do I reset network settings on android?", "network_troubleshooting#resetting-network-settings"),
+    ("How do I activate my new SIM card?", "device_troubleshooting#activating-a-sim-card"),
+    ("Can I set up an eSIM with a QR code?", "device_troubleshooting#setting-up-esim"),
+    ("Picture messages won't send", "device_troubleshooting#picture-messages-mms-not-working"),
+    ("How do I set up voicemail?", "device_troubleshooting#setting-up-voicemail"),
+    ("I forgot my voicemail password", "device_troubleshooting#voicemail-password-reset"),
+    ("My hotspot is connected but has no internet", "device_troubleshooting#mobile-hotspot-not-working"),
+    ("My battery drains quickly and the phone gets hot", "device_troubleshooting#phone-overheating-or-battery-draining-quickly"),
+    ("My phone was stolen", "device_troubleshooting#lost-or-stolen-phone"),
+    ("What are your cheapest unlimited plans?", "plans#essentials-unlimited-plan"),
+    ("Does Go5G Plus include hotspot data?", "plans#go5g-plus-unlimited-plan"),
+    ("Can I get a discount as a veteran?", "plans#55-and-military-plans"),
+    ("How do I add a line for my daughter?", "plans#adding-a-line-to-an-account"),
+    ("Does my plan work when I travel to Mexico? International data roaming", "plans#international-roaming-and-calling"),
+    ("Can I keep my number if I switch carriers?", "plans#switching-to-t-mobile-and-keeping-a-number"),
+    ("Am I eligible for an upgrade with trade-in?", "plans#upgrade-eligibility-and-trade-in-offers"),
+    ("Where is my order? I need tracking", "account_faq#order-status-and-delivery"),
+    ("Can I return my phone within 14 days?", "account_faq#returns-and-cancellation-period"),
+    ("How do I change my account PIN?", "account_faq#account-pin-and-security"),
+    ("How do I file a device protection claim?", "account_faq#device-protection"),
+]
+
+# Messages the knowledge base can't answer: these should escalate to Perplexity
+OUT_OF_SCOPE = [
+    "Who won the game last night?",
+    "What's the weather in Seattle?",
+    "Recommend a good pizza place",
+    "Hello, are you a real person?",
+    "What time is it in Tokyo?",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(index: KnowledgeIndex, threshold: float, repeat: int) -> dict:
+    ranks, latencies, answered, false_accepts = [], [], 0, 0
+    for query, expected in EVAL_QUERIES:
+        hits, confidence = index.search(query, top_k=3)
+        ids = [hit["id"] for hit in hits]
+        ranks.append(ids.index(expected) + 1 if expected in ids else None)
+        answered += confidence >= threshold and bool(ids) and ids[0] == expected
+    for query in OUT_OF_SCOPE:
+        false_accepts += index.search(query)[1] >= threshold
+    for _ in range(repeat):
+        for query, _ in EVAL_QUERIES:
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "recall@1": sum(rank == 1 for rank in ranks) / len(ranks),
+        "recall@3": sum(rank is not None for rank in ranks) / len(ranks),
+        "mrr": statistics.mean(1 / rank if rank else 0 for rank in ranks),
+        "answered_locally": answered / len(ranks),
+        "false_accepts": false_accepts / len(OUT_OF_SCOPE),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def main(args):
+    results = {}
+    for label, embeddings in (("bm25", False), ("bm25+embeddings", True)):
+        with tempfile.TemporaryDirectory() as index_dir:
+            start = time.perf_counter()
+            built = KnowledgeIndex()
+            built.build(args.corpus, embeddings=embeddings)
+            build_ms = (time.perf_counter() - start) * 1000
+            built.save(index_dir)
+
+            # Incremental rebuild with nothing changed: every file is reused
+            start = time.perf_counter()
+            previous = KnowledgeIndex()
+            previous.load(index_dir)
+            KnowledgeIndex().build(args.corpus, previous=previous, embeddings=embeddings)
+            incremental_ms = (time.perf_counter() - start) * 1000
+
+            index = KnowledgeIndex()
+            index.load(index_dir)  # memory-mapped embeddings, as served
+            results[label] = {**evaluate(index, args.threshold, args.repeat),
+                              "build_ms": build_ms, "incremental_ms": incremental_ms}
+
+    print(f"{len(EVAL_QUERIES)} queries, {len(OUT_OF_SCOPE)} out-of-scope, threshold {args.threshold}")
+    columns = ["recall@1", "recall@3", "mrr", "answered_locally", "false_accepts",
+               "p50_ms", "p95_ms", "build_ms", "incremental_ms"]
+    print(f"{'':>16} " + " ".join(f"{column:>16}" for column in columns))
+    for label, result in results.items():
+        print(f"{label:>16} " + " ".join(f"{result[column]:>16.3f}" for column in columns))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark local knowledge-base retrieval")
+    parser.add_argument("--corpus", default=KB_CORPUS_DIR)
+    parser.add_argument("--threshold", type=float, default=KB_MIN_CONFIDENCE)
+    parser.add_argument("--repeat", type=int, default=50, help="timing passes over the query set")
+    main(parser.parse_args())
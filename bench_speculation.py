@@ -0,0 +1,118 @@
+# bench_speculation.py
+# Follow-up latency and Gemini spend with and without speculative agent generation
+#
+#     python bench_speculation.py
+#     python bench_speculation.py --miss-rate 0.5 --gemini-latency lognormal:0.3,0.4 --conversations 400
+#
+# Each conversation is two turns. The first is routed locally by a keyword
+# rule (two keyword hits, so it is confident enough); the second changes the wording enough that it is classified by Gemini,
+# which is where speculation on the session's agent can overlap generation with
+# classification. The stub Gemini classifies everything as technical_support,
+# so conversations that start on billing (--miss-rate of them) are wrong
+# guesses whose speculative response is discarded.
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+FIRST_TURNS = {
+    "technical_support": "I keep getting dropped calls and no signal at home",
+    "billing": "Why is my bill higher this month, there's an extra charge",
+}
+FOLLOW_UP = "Something else has been bothering me for a while now, case {i}"
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(mode: str, speculator, args) -> dict:
+    import agents
+    from agents import AgentRouter
+    from pipeline import ChatPipeline
+    from sessions import session_store
+
+    agents.speculator = speculator
+    router = AgentRouter()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, gemini_calls, gemini_tokens = [], 0, 0
+
+    async def turn(customer_id: str, message: str) -> ChatPipeline:
+        pipeline = ChatPipeline(message, customer_id, "chat", session_store.get(customer_id))
+        await pipeline.run(router)
+        pipeline.finish()
+        pipeline.remember()
+        return pipeline
+
+    async def conversation(i: int, first_intent: str):
+        nonlocal gemini_calls, gemini_tokens
+        customer_id = f"{mode}-{i}"
+        async with semaphore:
+            await turn(customer_id, FIRST_TURNS[first_intent])
+            start = time.perf_counter()
+            pipeline = await turn(customer_id, FOLLOW_UP.format(i=i))
+            latencies.append((time.perf_counter() - start) * 1000)
+        for call in pipeline.meter.calls:
+            if call["provider"] == "gemini":
+                gemini_calls += 1
+                gemini_tokens += call["input_tokens"] + call["output_tokens"]
+
+    intents = ["billing" if rng.random() < args.miss_rate else "technical_support"
+               for _ in range(args.conversations)]
+    await asyncio.gather(*(conversation(i, intent) for i, intent in enumerate(intents)))
+    stats = speculator.stats()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "gemini_calls": gemini_calls / args.conversations,
+        "gemini_tokens": gemini_tokens / args.conversations,
+        "hit_rate": stats["hit_rate"],
+        "speculated": stats["started"] / args.conversations,
+        "wasted_tokens": stats["wasted_tokens"],
+    }
+
+
+def main(args):
+    import stub_upstream
+    from speculation import Speculator
+
+    stub_upstream.install(args.gemini_latency, args.perplexity_port, seed=args.seed)
+    server = stub_upstream.StubServer(
+        stub_upstream.create_perplexity_app(args.perplexity_latency), args.perplexity_port
+    ).start()
+    print(f"gemini {args.gemini_latency}, perplexity {args.perplexity_latency}, {args.conversations} conversations, "
+          f"miss rate {args.miss_rate:.0%}, speculation budget {args.budget:.0%}")
+    print(f"{'mode':>8} {'p50_ms':>8} {'p95_ms':>8} {'speculated':>11} {'hit_rate':>9} "
+          f"{'gemini_calls':>13} {'gemini_tokens':>14} {'wasted_tokens':>14}")
+    try:
+        for mode, enabled in (("off", False), ("on", True)):
+            result = asyncio.run(run(mode, Speculator(enabled=enabled, budget=args.budget), args))
+            print(f"{mode:>8} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['speculated']:>11.1%} "
+                  f"{result['hit_rate']:>9.1%} {result['gemini_calls']:>13.2f} {result['gemini_tokens']:>14.1f} "
+                  f"{result['wasted_tokens']:>14}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark speculative agent generation")
+    parser.add_argument("--gemini-latency", default="0.3", help="stub Gemini latency spec")
+    parser.add_argument("--perplexity-latency", default="0.2", help="stub Perplexity latency spec")
+    parser.add_argument("--perplexity-port", type=int, default=8765)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--miss-rate", type=float, default=0.2, help="share of conversations the guess gets wrong")
+    parser.add_argument("--budget", type=float, default=1.0, help="share of requests that may speculate")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ.setdefault("LOG_DB_PATH", os.path.join(tmpdir, "bench.db"))
+        main(args)
@@ -0,0 +1,141 @@
+# bench_workers.py
+# Multi-worker benchmark: /chat throughput as the number of worker processes grows
+#
+#     python bench_workers.py
+#     python bench_workers.py --workers 1 2 4 8 --concurrency 64 --requests 2000
+#
+# For each worker count the app is served by `stub_upstream.py --workers N`
+# (every upstream stubbed, state in a fresh shared-state file) and driven over
+# HTTP. Stub latency defaults to a few milliseconds so the service's own CPU
+# work is what's measured; with near-zero latency one process is CPU-bound and
+# extra workers add throughput up to the number of cores. After each run the
+# shared interaction log is checked to contain every request, whichever
+# worker served it.
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+MESSAGES = [
+    "My phone keeps dropping calls at home.",
+    "Why is my bill so high this month?",
+    "What are your cheapest unlimited plans?",
+    "How do I set up voicemail?",
+    "Mobile data is really slow today",
+    "My phone says SOS only",
+]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def start_server(workers: int, port: int, perplexity_port: int, latency: str, tmp: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "WORKERS": str(workers),
+        "SHARED_STATE_PATH": os.path.join(tmp, f"state_{workers}.db"),
+        "LOG_DB_PATH": os.path.join(tmp, f"log_{workers}.db"),
+        "LOG_FLUSH_INTERVAL_S": "0.05",
+    }
+    return subprocess.Popen(
+        [sys.executable, "stub_upstream.py", "--workers", str(workers), "--port", str(port),
+         "--perplexity-port", str(perplexity_port), "--gemini-latency", latency,
+         "--perplexity-latency", latency, "--tts-latency", latency],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout_s: float = 60):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(client: httpx.AsyncClient, concurrency: int, total: int, tag: str) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/chat", json={
+                "message": MESSAGES[i % len(MESSAGES)], "customer_id": f"{tag}_{i % 200}",
+            })
+            latencies.append((time.perf_counter() - start) * 1000)
+            failures += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "failures": failures,
+    }
+
+
+async def logged(client: httpx.AsyncClient, expected: int, timeout_s: float = 10) -> int:
+    """Interactions in the shared log, once background writes from every worker have landed"""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        total = (await client.get("/logs", params={"limit": 1})).json()["total_interactions"]
+        if total >= expected or time.monotonic() > deadline:
+            return total
+        await asyncio.sleep(0.2)
+
+
+async def run_level(workers: int, args, tmp: str) -> dict:
+    server = start_server(workers, args.port, args.perplexity_port, args.latency, tmp)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60, limits=limits) as client:
+            await wait_ready(client)
+            warmup = min(100, args.requests)
+            await drive(client, args.concurrency, warmup, "warmup")
+            result = await drive(client, args.concurrency, args.requests, "bench")
+            result["logged"] = await logged(client, warmup + args.requests) - warmup
+            return result
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(args):
+    print(f"{os.cpu_count()} CPUs, stub latency {args.latency}, concurrency {args.concurrency}, "
+          f"{args.requests} requests per level")
+    print(f"{'workers':>8} {'req/s':>10} {'scaling':>8} {'p50_ms':>8} {'p95_ms':>8} {'failures':>9} {'logged':>8}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            result = asyncio.run(run_level(workers, args, tmp))
+            baseline = baseline or result["rps"]
+            print(f"{workers:>8} {result['rps']:>10.1f} {result['rps'] / baseline:>7.2f}x {result['p50_ms']:>8.1f} "
+                  f"{result['p95_ms']:>8.1f} {result['failures']:>9} {result['logged']:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /chat throughput across worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per worker count")
+    parser.add_argument("--latency", default="0.005", help="stub upstream latency (seconds or distribution spec)")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--perplexity-port", type=int, default=8771)
+    main(parser.parse_args())
@@ -0,0 +1,280 @@
+# benchmark.py
+# Offline benchmark suite: /chat, /chat/stream, /voice and /logs against stub upstreams
+#
+#     python benchmark.py
+#     python benchmark.py --scenarios chat voice --concurrency 32 --requests 500
+#     python benchmark.py --gemini-latency lognormal:0.3,0.4 --output after.json --compare before.json
+#
+# Every upstream is replaced by a stand-in from stub_upstream.py (sampled
+# latency, injected failures), so the numbers are the service's own overhead
+# on top of a known upstream profile. Each scenario reports throughput,
+# p50/p95/p99 latency, time to first byte for streaming endpoints, status
+# codes and process memory. Results are written as JSON for comparing runs.
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+MESSAGES = [
+    "My phone keeps dropping calls at home.",
+    "Why is my bill so high this month?",
+    "What are your cheapest unlimited plans?",
+    "How do I set up voicemail?",
+    "Mobile data is really slow today",
+    "Can I return my phone within 14 days?",
+    "My phone says SOS only",
+    "Can I get a discount as a veteran?",
+    "Who won the game last night?",
+    "I was charged a late fee",
+]
+
+
+def chat_request(i: int) -> tuple:
+    return "POST", "/chat", {"message": MESSAGES[i % len(MESSAGES)], "customer_id": f"bench_{i}"}
+
+
+def conversation_request(i: int) -> tuple:
+    # Ten customers taking turns, so later requests carry session history
+    return "POST", "/chat", {"message": MESSAGES[i % len(MESSAGES)], "customer_id": f"bench_conv_{i % 10}"}
+
+
+def stream_request(i: int) -> tuple:
+    return "POST", "/chat/stream", {"message": MESSAGES[i % len(MESSAGES)], "customer_id": f"bench_{i}"}
+
+
+def voice_request(i: int) -> tuple:
+    return "POST", "/voice", {"message": MESSAGES[i % len(MESSAGES)], "customer_id": f"bench_{i}"}
+
+
+def voice_stream_request(i: int) -> tuple:
+    return "POST", "/voice/stream", {"message": MESSAGES[i % len(MESSAGES)], "customer_id": f"bench_{i}"}
+
+
+def logs_request(i: int) -> tuple:
+    params = {"limit": 50}
+    if i % 2:
+        params["customer_id"] = f"bench_{i % 50}"
+    return "GET", "/logs", params
+
+
+# name: (request builder, streaming response, fault rates while it runs)
+SCENARIOS = {
+    "chat": (chat_request, False, None),
+    "chat_conversation": (conversation_request, False, None),
+    "chat_stream": (stream_request, True, None),
+    "voice": (voice_request, False, None),
+    "voice_stream": (voice_stream_request, True, None),
+    "logs": (logs_request, False, None),
+    "chat_faults": (chat_request, False, {"error_rate": 0.05, "throttle_rate": 0.05}),
+}
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc isn't available)"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def send(client, build, i: int, streaming: bool) -> dict:
+    method, path, payload = build(i)
+    kwargs = {"json": payload} if method == "POST" else {"params": payload}
+    start = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream(method, path, **kwargs) as response:
+            async for _ in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = (time.perf_counter() - start) * 1000
+            status = response.status_code
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"{method} {path} failed: {e}")
+        status = "error"
+    return {"ms": (time.perf_counter() - start) * 1000, "ttfb_ms": ttfb if streaming else None, "status": status}
+
+
+async def run_scenario(client, name: str, concurrency: int, total: int, warmup: int) -> dict:
+    build, streaming, _ = SCENARIOS[name]
+    for i in range(warmup):
+        await send(client, build, total + i, streaming)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> dict:
+        async with semaphore:
+            return await send(client, build, i, streaming)
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r["ms"] for r in results]
+    ttfbs = [r["ttfb_ms"] for r in results if r["ttfb_ms"] is not None]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "throughput_rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "ttfb_p50_ms": percentile(ttfbs, 50),
+        "ttfb_p95_ms": percentile(ttfbs, 95),
+        "statuses": statuses,
+        "success_rate": statuses.get("200", 0) / total,
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": rss_mb() - rss_before,
+    }
+
+
+def set_faults(stubs: list, error_rate: float, throttle_rate: float):
+    for faults in stubs:
+        faults.error_rate = error_rate
+        faults.throttle_rate = throttle_rate
+
+
+async def run(args) -> dict:
+    import httpx
+    import stub_upstream
+    from main import app, interaction_log
+
+    rng = random.Random(args.seed)
+    gemini, tts = stub_upstream.install(args.gemini_latency, args.perplexity_port, args.tts_latency,
+                                        args.error_rate, args.throttle_rate, args.seed)
+    perplexity_app = stub_upstream.create_perplexity_app(args.perplexity_latency, args.error_rate,
+                                                         args.throttle_rate, rng)
+    server = stub_upstream.StubServer(perplexity_app, args.perplexity_port).start()
+    # Served over real HTTP: the in-process ASGI transport buffers whole responses,
+    # which would hide time to first byte on the streaming endpoints
+    app_server = stub_upstream.StubServer(app, args.port).start()
+    fault_stubs = [gemini.faults, tts.faults, perplexity_app.state.faults]
+
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60,
+                                     limits=limits) as client:
+            for name in args.scenarios:
+                faults = SCENARIOS[name][2]
+                if faults:
+                    set_faults(fault_stubs, **faults)
+                try:
+                    results[name] = await run_scenario(client, name, args.concurrency, args.requests, args.warmup)
+                finally:
+                    if faults:
+                        set_faults(fault_stubs, args.error_rate, args.throttle_rate)
+                interaction_log.flush()
+                print_row(name, results[name])
+    finally:
+        app_server.stop()
+        server.stop()
+    return results
+
+
+COLUMNS = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "success_rate", "rss_mb"]
+
+
+def print_row(name: str, result: dict):
+    cells = " ".join(
+        f"{'-' if result[column] is None else format(result[column], '.2f'):>14}" for column in COLUMNS
+    )
+    print(f"{name:>18} {cells}", flush=True)
+
+
+def compare(previous: dict, current: dict):
+    """Print current vs previous for the scenarios both runs have"""
+    print(f"\nvs {previous['meta'].get('commit') or 'previous run'} ({previous['meta']['timestamp']})")
+    print(f"{'':>18} {'throughput':>14} {'p50':>14} {'p95':>14} {'p99':>14}")
+    for name, result in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+        cells = [f"{result['throughput_rps'] / before['throughput_rps']:>13.2f}x"]
+        for column in ("p50_ms", "p95_ms", "p99_ms"):
+            cells.append(f"{(result[column] - before[column]) / before[column] * 100:>+13.1f}%")
+        print(f"{name:>18} " + " ".join(cells))
+
+
+def main(args):
+    os.environ.setdefault("LOG_DB_PATH", os.path.join(args.tmpdir, "benchmark.db"))
+    os.environ.setdefault("AUDIO_CACHE_DIR", os.path.join(args.tmpdir, "audio_cache"))
+    print(f"gemini {args.gemini_latency}, perplexity {args.perplexity_latency}, tts {args.tts_latency}, "
+          f"errors {args.error_rate}, throttles {args.throttle_rate}")
+    print(f"{'scenario':>18} " + " ".join(f"{column:>14}" for column in COLUMNS))
+    scenarios = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("compare", "tmpdir")},
+        },
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the service against stub upstreams")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each scenario")
+    parser.add_argument("--gemini-latency", default="lognormal:0.2,0.3",
+                        help="seconds, or uniform:/normal:/lognormal: spec (see stub_upstream.py)")
+    parser.add_argument("--perplexity-latency", default="lognormal:0.4,0.3")
+    parser.add_argument("--tts-latency", default="lognormal:0.25,0.3")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls that fail")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of upstream calls rate-limited")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766, help="local port the app is served on")
+    parser.add_argument("--perplexity-port", type=int, default=8765)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args.tmpdir = tmpdir
+        main(args)
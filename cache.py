@@ -0,0 +1,427 @@
+# cache.py
+# Response and context caches with pluggable storage backends
+
+from intent_classifier import featurize, LABELS
+from collections import OrderedDict
+import numpy as np
+import shared_state
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_INTENTS = os.getenv("RESPONSE_CACHE_INTENTS", ",".join(LABELS)).split(",")
+# Cosine similarity needed for a near-duplicate hit; 0 disables similarity lookup
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+EMBEDDING_DIM = 1024
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "1") == "1"
+CONTEXT_CACHE_TTL_S = float(os.getenv("CONTEXT_CACHE_TTL_S", "21600"))
+# Gemini fallback context expires sooner, so Perplexity is retried once it recovers
+CONTEXT_CACHE_FALLBACK_TTL_S = float(os.getenv("CONTEXT_CACHE_FALLBACK_TTL_S", "300"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "5000"))
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class CacheBackend:
+    """
+    Key/value storage behind a cache. Subclass this to put the cache in a
+    shared store; values must round-trip unchanged through get/set.
+    """
+    def get(self, key: str):
+        """Returns: stored value, or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl_s: float = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def items(self, prefix: str = "") -> list:
+        """Returns: live (key, value) pairs whose key starts with prefix"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryBackend(CacheBackend):
+    """In-process backend with per-entry TTL, LRU eviction and a size bound"""
+    def __init__(self, max_entries: int = 1000, default_ttl_s: float = None):
+        self.max_entries = max_entries
+        self.default_ttl_s = default_ttl_s
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl_s: float = None):
+        ttl_s = ttl_s if ttl_s is not None else self.default_ttl_s
+        expires_at = time.monotonic() + ttl_s if ttl_s is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def items(self, prefix: str = "") -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (expires_at, value) in self._entries.items()
+                if key.startswith(prefix) and (expires_at is None or expires_at > now)
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Backend in the shared-state SQLite file, so every worker process sees the
+    same entries. Values are pickled; expiry uses wall-clock time so it holds
+    across processes. Least recently used entries beyond max_entries are
+    evicted every EVICT_EVERY writes rather than on each one.
+    Writes run on shared_state.writer; until one lands, get() answers from
+    the pending value so this worker reads its own writes. Reads run inline
+    on a short busy timeout and count as misses when the file is locked
+    (see shared_state.py).
+    """
+    EVICT_EVERY = 32
+    # Reads refresh an entry's LRU position at most this often
+    TOUCH_INTERVAL_S = 1.0
+    _DELETED = object()
+
+    def __init__(self, namespace: str, max_entries: int = 1000, default_ttl_s: float = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.default_ttl_s = default_ttl_s
+        self.evictions = 0
+        self._writes = itertools.count(1)
+        self._pending = {}  # key -> (write seq, value, expires_at) not yet in the file
+        self._pending_lock = threading.Lock()
+
+    def _write(self, key: str, value, expires_at: float, write):
+        seq = next(self._writes)
+        with self._pending_lock:
+            self._pending[key] = (seq, value, expires_at)
+
+        def landed(_, error):
+            with self._pending_lock:
+                if self._pending.get(key, (None,))[0] == seq:
+                    del self._pending[key]
+            if error is not None:
+                logger.warning(f"Shared {self.namespace} cache write failed: {error}")
+
+        shared_state.writer.submit(lambda: write(seq), landed)
+
+    def get(self, key: str):
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            _, value, expires_at = pending
+            if value is self._DELETED or (expires_at is not None and expires_at <= time.time()):
+                return None
+            return value
+        try:
+            row = shared_state.connect_reader().execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            # Locked past the read timeout (or not initialized yet): a miss, not a stall
+            logger.debug(f"Shared {self.namespace} cache read skipped: {e}")
+            return None
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            self.delete(key)
+            return None
+        if now - accessed_at >= self.TOUCH_INTERVAL_S:
+            shared_state.writer.submit(lambda: shared_state.connect().execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key)
+            ))
+        return pickle.loads(value)
+
+    def set(self, key: str, value, ttl_s: float = None):
+        ttl_s = ttl_s if ttl_s is not None else self.default_ttl_s
+        now = time.time()
+        expires_at = now + ttl_s if ttl_s is not None else None
+        data = pickle.dumps(value)
+
+        def write(seq: int):
+            conn = shared_state.connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, data, expires_at, now),
+            )
+            if seq % self.EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+        self._write(key, value, expires_at, write)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        cursor = conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+        self.evictions += max(0, cursor.rowcount)
+
+    def delete(self, key: str):
+        self._write(key, self._DELETED, None, lambda seq: shared_state.connect().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ))
+
+    def items(self, prefix: str = "") -> list:
+        try:
+            rows = shared_state.connect_reader().execute(
+                "SELECT key, value FROM cache WHERE namespace = ? AND substr(key, 1, ?) = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (self.namespace, len(prefix), prefix, time.time()),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.debug(f"Shared {self.namespace} cache scan skipped: {e}")
+            return []
+        return [(key, pickle.loads(value)) for key, value in rows]
+
+    def __len__(self) -> int:
+        try:
+            return shared_state.connect_reader().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (self.namespace, time.time()),
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+
+def make_backend(namespace: str, max_entries: int, default_ttl_s: float = None) -> CacheBackend:
+    """Shared SQLite backend in multi-worker mode, otherwise an in-process LRU"""
+    if shared_state.enabled():
+        return SQLiteBackend(namespace, max_entries, default_ttl_s)
+    return InMemoryBackend(max_entries, default_ttl_s)
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    message = _PUNCTUATION_RE.sub(" ", message.lower())
+    return _WHITESPACE_RE.sub(" ", message).strip()
+
+
+def hashed_embedding(message: str) -> np.ndarray:
+    """Default local embedding: hashed n-grams from the intent classifier"""
+    return featurize(message, n_features=EMBEDDING_DIM)
+
+
+class ResponseCache:
+    """
+    Caches agent responses keyed on (intent, normalized message).
+    With a similarity threshold set, a miss falls back to the most similar
+    cached message of the same intent.
+    """
+    def __init__(self, backend: CacheBackend = None, ttl_s: float = RESPONSE_CACHE_TTL_S,
+                 enabled_intents: list = None, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+                 embed=hashed_embedding, enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.backend = backend or make_backend("response", RESPONSE_CACHE_MAX_ENTRIES)
+        self.ttl_s = ttl_s
+        self.enabled = enabled
+        self.enabled_intents = set(enabled_intents if enabled_intents is not None else RESPONSE_CACHE_INTENTS)
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def is_enabled_for(self, intent: str) -> bool:
+        return self.enabled and intent in self.enabled_intents
+
+    def lookup(self, intent: str, message: str):
+        """
+        Returns: cached {"agent_name", "response", "context"} dict, or None on a miss
+        """
+        if not self.is_enabled_for(intent):
+            self._count("bypassed")
+            return None
+
+        entry = self.backend.get(f"{intent}:{normalize_message(message)}")
+        if entry is not None:
+            self._count("exact_hits")
+            return entry
+
+        if self.similarity_threshold > 0:
+            entry = self._most_similar(intent, message)
+            if entry is not None:
+                self._count("similar_hits")
+                return entry
+
+        self._count("misses")
+        return None
+
+    def contains(self, intent: str, message: str) -> bool:
+        """Whether an exact entry exists, without counting a lookup"""
+        return self.is_enabled_for(intent) and self.backend.get(f"{intent}:{normalize_message(message)}") is not None
+
+    def _most_similar(self, intent: str, message: str):
+        candidates = [value for _, value in self.backend.items(f"{intent}:") if "embedding" in value]
+        if not candidates:
+            return None
+        scores = np.stack([value["embedding"] for value in candidates]) @ self.embed(message)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        logger.info(f"Similar cache hit (cosine {scores[best]:.3f})")
+        return candidates[best]
+
+    def store(self, intent: str, message: str, agent_name: str, response: str, context: str):
+        if not self.is_enabled_for(intent):
+            return
+        entry = {"agent_name": agent_name, "response": response, "context": context}
+        if self.similarity_threshold > 0:
+            entry["embedding"] = self.embed(message)
+        self.backend.set(f"{intent}:{normalize_message(message)}", entry, self.ttl_s)
+        self._count("stores")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        hits = counters["exact_hits"] + counters["similar_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "entries": len(self.backend),
+            "evictions": getattr(self.backend, "evictions", None),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ContextCache:
+    """
+    Memoizes context lookups with a TTL. Entries are kept per provider and
+    lookups prefer the Perplexity entry. Gemini fallback answers only live
+    for fallback_ttl_s, so after a Perplexity outage the query goes back to
+    Perplexity soon rather than serving the fallback for the full TTL.
+    Concurrent identical async lookups share one in-flight upstream call
+    (within a worker; workers share stored entries, not in-flight calls).
+    """
+    PROVIDERS = ("perplexity", "gemini")
+
+    def __init__(self, backend: CacheBackend = None, ttl_s: float = CONTEXT_CACHE_TTL_S,
+                 fallback_ttl_s: float = CONTEXT_CACHE_FALLBACK_TTL_S, enabled: bool = CONTEXT_CACHE_ENABLED):
+        self.backend = backend or make_backend("context", CONTEXT_CACHE_MAX_ENTRIES)
+        self.ttl_s = ttl_s
+        self.fallback_ttl_s = min(fallback_ttl_s, ttl_s)
+        self.enabled = enabled
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "perplexity_hits": 0, "gemini_hits": 0, "misses": 0, "coalesced": 0,
+            "perplexity_stores": 0, "gemini_stores": 0,
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, query: str):
+        """Returns: cached context (Perplexity preferred), or None on a miss"""
+        if not self.enabled:
+            return None
+        normalized = normalize_message(query)
+        for provider in self.PROVIDERS:
+            context = self.backend.get(f"{provider}:{normalized}")
+            if context is not None:
+                self._count(f"{provider}_hits")
+                return context
+        self._count("misses")
+        return None
+
+    def set(self, provider: str, query: str, context: str):
+        if not self.enabled:
+            return
+        ttl_s = self.ttl_s if provider == "perplexity" else self.fallback_ttl_s
+        self.backend.set(f"{provider}:{normalize_message(query)}", context, ttl_s)
+        self._count(f"{provider}_stores")
+
+    async def get_or_fetch(self, query: str, fetch) -> str:
+        """
+        Return cached context, or run fetch(query) -> (provider, context) once
+        for all concurrent callers asking the same query. A None provider
+        marks a failed lookup, which is returned but not cached.
+        """
+        if not self.enabled:
+            return (await fetch(query))[1]
+        cached = self.get(query)
+        if cached is not None:
+            return cached
+
+        key = (asyncio.get_running_loop(), normalize_message(query))
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(query, fetch))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self._count("coalesced")
+        # Shield so one cancelled caller does not abort the shared fetch
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, query: str, fetch) -> str:
+        provider, context = await fetch(query)
+        if provider is not None:
+            self.set(provider, query, context)
+        return context
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        hits = counters["perplexity_hits"] + counters["gemini_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "entries": len(self.backend),
+            "in_flight": len(self._in_flight),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared instances used by AgentRouter and services.py
+response_cache = ResponseCache()
+context_cache = ContextCache()
@@ -0,0 +1,230 @@
+# deadline.py
+# Per-request deadlines, and hedged upstream calls to cut tail latency
+#
+# Each request gets a Deadline when its ChatPipeline is created (REQUEST_DEADLINE_S,
+# or <ENDPOINT>_DEADLINE_S for one endpoint; 0 means none). The deadline is passed
+# down through AgentRouter.route and Agent.process into the service calls, and
+# every stage runs within what is left of it. Classification and context get
+# at most their own CLASSIFY/CONTEXT_TIMEOUT_S and leave DEADLINE_GENERATE_RESERVE_S
+# (at most half the budget) for the response. A stage that runs out degrades instead of failing the request:
+# classification falls back to "other", context is skipped, and a response that
+# can't be generated in time comes from the response cache when it has one.
+#
+# Gemini calls are hedged: once a call has taken longer than the recent p95
+# for its operation, a duplicate is sent and whichever answers first wins.
+# Hedges are limited to HEDGE_BUDGET of calls so a slow upstream isn't sent
+# twice the traffic.
+
+import asyncio
+from collections import deque
+import logging
+import os
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "10"))
+# Batch triage is throughput work with no one waiting on a single answer
+DEFAULT_DEADLINES = {"batch": "0"}
+# Time kept back for generating the response while classification and context run
+DEADLINE_GENERATE_RESERVE_S = float(os.getenv("DEADLINE_GENERATE_RESERVE_S", "2"))
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Latency samples kept per operation, and how many are needed before hedging starts
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+# Share of calls that may be hedged (token bucket; bursts up to HEDGE_BURST)
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "5"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.05"))
+
+DEADLINE_EXCEEDED = metrics.Counter(
+    "agent_deadline_exceeded_total", "Stages cut short by the request deadline", ("stage",)
+)
+HEDGES = metrics.Counter(
+    "agent_hedged_calls_total", "Duplicate upstream calls sent after the hedge delay", ("operation", "winner")
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A stage ran out of request budget"""
+    def __init__(self, stage: str):
+        super().__init__(f"request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Absolute time by which a request has to be answered"""
+    def __init__(self, budget_s: float):
+        self.budget_s = budget_s
+        self.expires_at = time.monotonic() + budget_s
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, cap: float = None, reserve: float = 0.0) -> float:
+        """
+        Returns: time a stage may take: what's left less reserve (at most half
+        the request's budget), and at most cap
+        """
+        budget = self.remaining() - min(reserve, self.budget_s / 2)
+        if cap is not None:
+            budget = min(budget, cap)
+        return max(0.0, budget)
+
+
+def for_endpoint(endpoint: str):
+    """
+    Deadline for a new request on endpoint.
+    Returns: Deadline, or None when the endpoint's budget is 0
+    """
+    default = DEFAULT_DEADLINES.get(endpoint, str(REQUEST_DEADLINE_S))
+    budget_s = float(os.getenv(f"{endpoint.upper()}_DEADLINE_S", default))
+    return Deadline(budget_s) if budget_s > 0 else None
+
+
+async def within(deadline, stage: str, awaitable, cap: float = None, reserve: float = 0.0):
+    """
+    Await awaitable within deadline's budget (and at most cap seconds).
+    deadline: Deadline, or None for no request deadline (cap still applies)
+    Raises DeadlineExceeded when the budget runs out, or is gone already.
+    """
+    timeout = deadline.budget(cap, reserve) if deadline is not None else cap
+    if timeout is None:
+        return await awaitable
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage) from None
+
+
+class LatencyTracker:
+    """Recent latencies of one operation, and the delay after which to hedge it"""
+    def __init__(self, window: int = HEDGE_WINDOW, percentile: float = HEDGE_PERCENTILE):
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self._delay = None
+        self._stale = 0
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def hedge_delay(self):
+        """
+        Returns: the percentile latency (recomputed every 10 samples), or None
+        while there are fewer than HEDGE_MIN_SAMPLES
+        """
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        if self._delay is None or self._stale >= 10:
+            ordered = sorted(self.samples)
+            index = min(len(ordered) - 1, int(self.percentile / 100 * len(ordered)))
+            self._delay = max(HEDGE_MIN_DELAY_S, ordered[index])
+            self._stale = 0
+        return self._delay
+
+    def stats(self) -> dict:
+        delay = self.hedge_delay()
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
+
+
+class Hedger:
+    """
+    Runs upstream calls with a hedge: if the first attempt is still running
+    after the operation's hedge delay, a second one starts and the first
+    success is returned. Runs on the event loop thread; no locking needed.
+    """
+    def __init__(self, enabled: bool = HEDGE_ENABLED, budget: float = HEDGE_BUDGET, burst: float = HEDGE_BURST):
+        self.enabled = enabled
+        self.budget = budget
+        self.burst = burst
+        self._tokens = burst
+        self.trackers = {}
+
+    def tracker(self, operation: str) -> LatencyTracker:
+        tracker = self.trackers.get(operation)
+        if tracker is None:
+            tracker = self.trackers[operation] = LatencyTracker()
+        return tracker
+
+    def _take_token(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def call(self, operation: str, attempt, discarded=None):
+        """
+        Run attempt() (a coroutine function), hedging it once if it is slow.
+        If both attempts fail, the first attempt's error is raised. The losing
+        attempt is cancelled if still running; if it had already succeeded,
+        discarded(result) is called so its spend can still be recorded.
+        Returns: the first successful result
+        """
+        tracker = self.tracker(operation)
+        tracker.calls += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+        delay = tracker.hedge_delay() if self.enabled else None
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(attempt())
+        tasks = [primary]
+        winner = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._take_token():
+                    tracker.hedged += 1
+                    logger.info(f"Hedging {operation} after {delay * 1000:.0f} ms")
+                    tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        tracker.observe(time.perf_counter() - start)
+                        if len(tasks) > 1:
+                            tracker.hedge_wins += task is not primary
+                            HEDGES.inc(operation=operation, winner="hedge" if task is not primary else "primary")
+                        return task.result()
+            if len(tasks) > 1:
+                HEDGES.inc(operation=operation, winner="none")
+            return primary.result()
+        finally:
+            cancelled = [task for task in tasks if not task.done()]
+            for task in cancelled:
+                task.cancel()
+            if cancelled:
+                # Let the losers unwind (and record what they spent) before the caller moves on
+                await asyncio.wait(cancelled)
+            if discarded is not None:
+                for task in tasks:
+                    if task is not winner and task not in cancelled and task.exception() is None:
+                        discarded(task.result())
+
+    def stats(self) -> dict:
+        return {operation: tracker.stats() for operation, tracker in self.trackers.items()}
+
+
+hedger = Hedger()
@@ -0,0 +1,105 @@
+# evaluate_intent_classifier.py
+# Offline evaluation: local fast-path classifier vs Gemini intent labels
+#
+#     python evaluate_intent_classifier.py logs.json
+#     python evaluate_intent_classifier.py logs.json --relabel   # fetch fresh Gemini labels
+#     python evaluate_intent_classifier.py logs.json --holdout 0.2
+#
+# Without --relabel, only interactions the logs say Gemini classified are
+# used as references, so the local classifier isn't graded on its own labels.
+
+import argparse
+import random
+import time
+from intent_classifier import LABELS, INTENT_MODEL_PATH, TRAINING_SOURCES, LocalIntentClassifier, load_interactions
+
+
+def gemini_labels(messages: list) -> list:
+    """Label each message with Gemini directly, bypassing the local tier"""
+    from services import classify_intent_gemini
+    return [classify_intent_gemini(message) for message in messages]
+
+
+def evaluate(classifier: LocalIntentClassifier, messages: list, labels: list) -> dict:
+    """
+    Compare local predictions against reference labels.
+    coverage: share answered locally at the threshold
+    fast_path_accuracy: accuracy on the messages answered locally
+    overall_accuracy: accuracy of the best local guess on every message
+    """
+    answered = correct_answered = correct_overall = 0
+    per_label = {label: {"total": 0, "answered": 0, "correct": 0} for label in LABELS}
+
+    start = time.perf_counter()
+    predictions = [classifier.predict(message) for message in messages]
+    elapsed = time.perf_counter() - start
+
+    for (predicted, confidence, source), label in zip(predictions, labels):
+        row = per_label[label]
+        row["total"] += 1
+        correct_overall += predicted == label
+        if source != "none" and confidence >= classifier.threshold:
+            answered += 1
+            row["answered"] += 1
+            if predicted == label:
+                correct_answered += 1
+                row["correct"] += 1
+
+    total = len(messages)
+    return {
+        "examples": total,
+        "threshold": classifier.threshold,
+        "coverage": answered / total if total else 0.0,
+        "fast_path_accuracy": correct_answered / answered if answered else 0.0,
+        "overall_accuracy": correct_overall / total if total else 0.0,
+        "mean_latency_us": elapsed / total * 1e6 if total else 0.0,
+        "per_label": per_label,
+    }
+
+
+def print_report(report: dict):
+    print(f"\nExamples:            {report['examples']}")
+    print(f"Threshold:           {report['threshold']:.2f}")
+    print(f"Coverage (local):    {report['coverage'] * 100:.1f}%")
+    print(f"Fast-path accuracy:  {report['fast_path_accuracy'] * 100:.1f}%")
+    print(f"Overall accuracy:    {report['overall_accuracy'] * 100:.1f}%")
+    print(f"Mean latency:        {report['mean_latency_us']:.1f} µs/message\n")
+    print(f"{'intent':<20} {'total':>6} {'local':>6} {'correct':>8}")
+    for label, row in report["per_label"].items():
+        print(f"{label:<20} {row['total']:>6} {row['answered']:>6} {row['correct']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the local intent classifier against Gemini labels")
+    parser.add_argument("logs", help="/logs JSON dump or JSONL of interactions")
+    parser.add_argument("--model", default=INTENT_MODEL_PATH)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--relabel", action="store_true",
+                        help="label every message with Gemini instead of using logged Gemini labels")
+    parser.add_argument("--holdout", type=float, default=0.0,
+                        help="train a fresh model on the rest and evaluate on this fraction")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Relabeling only needs the messages, so every logged interaction can be used
+    examples = load_interactions(args.logs, None if args.relabel else TRAINING_SOURCES)
+    if not examples:
+        raise SystemExit(f"No Gemini-labeled interactions found in {args.logs} (try --relabel)")
+    messages = [message for message, _ in examples]
+    labels = gemini_labels(messages) if args.relabel else [label for _, label in examples]
+
+    classifier = LocalIntentClassifier()
+    if args.threshold is not None:
+        classifier.threshold = args.threshold
+
+    if args.holdout:
+        pairs = list(zip(messages, labels))
+        random.Random(args.seed).shuffle(pairs)
+        split = int(len(pairs) * (1 - args.holdout))
+        train, test = pairs[:split], pairs[split:]
+        classifier.fit([m for m, _ in train], [l for _, l in train])
+        messages, labels = [m for m, _ in test], [l for _, l in test]
+    else:
+        classifier.load(args.model)
+
+    print_report(evaluate(classifier, messages, labels))
@@ -0,0 +1,234 @@
+# http_client.py
+# Pooled keep-alive HTTP client for REST upstreams: timeouts, retries, circuit breaker
+
+from requests.adapters import HTTPAdapter
+import requests
+import httpx
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "3"))
+HTTP_READ_TIMEOUT_S = float(os.getenv("HTTP_READ_TIMEOUT_S", "15"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE_S = float(os.getenv("HTTP_BACKOFF_BASE_S", "0.2"))
+HTTP_BACKOFF_MAX_S = float(os.getenv("HTTP_BACKOFF_MAX_S", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the upstream's breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and refuses calls
+    for `reset_s`. After that one trial call is let through (half-open);
+    its outcome closes or re-opens the breaker.
+    """
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_s: float = BREAKER_RESET_S):
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial = None  # permit of the half-open trial call, while it runs
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_s:
+            return "half_open"
+        return "open"
+
+    @property
+    def trial_in_flight(self) -> bool:
+        return self._trial is not None
+
+    def allow(self):
+        """
+        Returns: a permit if a call may go to the upstream now (pass it to
+        abandon() if the call is cancelled), or None
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return object()
+            if state == "half_open" and self._trial is None:
+                self._trial = object()
+                return self._trial
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def abandon(self, permit):
+        """A call ended without an outcome (cancelled by the caller): free the trial slot if it held it"""
+        with self._lock:
+            if self._trial is permit:
+                self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.times_opened += 1
+                self.opened_at = time.monotonic()
+            self._trial = None
+
+
+class UpstreamClient:
+    """
+    Shared connection pool for one REST upstream.
+    Provides sync (requests.Session) and async (httpx.AsyncClient) POSTs with
+    connect/read timeouts, HTTP keep-alive, jittered exponential backoff on
+    429/5xx and transport errors, and a circuit breaker.
+    """
+    def __init__(self, name: str, pool_size: int = HTTP_POOL_SIZE,
+                 max_keepalive: int = HTTP_MAX_KEEPALIVE,
+                 connect_timeout_s: float = HTTP_CONNECT_TIMEOUT_S,
+                 read_timeout_s: float = HTTP_READ_TIMEOUT_S,
+                 max_retries: int = HTTP_MAX_RETRIES,
+                 breaker: CircuitBreaker = None):
+        self.name = name
+        self.pool_size = pool_size
+        self.max_keepalive = max_keepalive
+        self.connect_timeout_s = connect_timeout_s
+        self.read_timeout_s = read_timeout_s
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+        self._session = None
+        self._session_lock = threading.Lock()
+        # One async client per event loop (connections cannot be shared across loops)
+        self._async_clients = {}
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.max_keepalive,
+                ),
+                timeout=httpx.Timeout(self.read_timeout_s, connect=self.connect_timeout_s),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def available(self) -> bool:
+        """Returns: False while the circuit breaker is open (callers should skip this upstream)"""
+        if self.breaker.state == "open":
+            self.counters["short_circuited"] += 1
+            return False
+        return True
+
+    def _backoff_s(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), HTTP_BACKOFF_MAX_S)
+            except ValueError:
+                pass
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(HTTP_BACKOFF_MAX_S, HTTP_BACKOFF_BASE_S * 2 ** attempt))
+
+    def _check_breaker(self):
+        """Returns: the breaker's permit for this call (raises CircuitOpenError if refused)"""
+        permit = self.breaker.allow()
+        if permit is None:
+            self.counters["short_circuited"] += 1
+            raise CircuitOpenError(f"{self.name} circuit breaker is open")
+        return permit
+
+    def _finish(self, response, error: Exception):
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            self.breaker.record_success()
+            return response
+        self.counters["failures"] += 1
+        self.breaker.record_failure()
+        if error is not None:
+            raise error
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Synchronous POST through the pooled session"""
+        self._check_breaker()
+        self.counters["requests"] += 1
+        response, error = None, None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response, error = self.session.post(
+                    url, timeout=(self.connect_timeout_s, self.read_timeout_s), **kwargs
+                ), None
+            except requests.RequestException as e:
+                response, error = None, e
+            if error is None and response.status_code not in RETRY_STATUSES:
+                break
+            if attempt < self.max_retries:
+                self.counters["retries"] += 1
+                retry_after = response.headers.get("Retry-After") if response is not None else None
+                time.sleep(self._backoff_s(attempt, retry_after))
+        return self._finish(response, error)
+
+    async def post_async(self, url: str, **kwargs) -> httpx.Response:
+        """Async POST through the pooled client for the running event loop"""
+        permit = self._check_breaker()
+        self.counters["requests"] += 1
+        response, error = None, None
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response, error = await self.async_client().post(url, **kwargs), None
+                except httpx.TransportError as e:
+                    response, error = None, e
+                if error is None and response.status_code not in RETRY_STATUSES:
+                    break
+                if attempt < self.max_retries:
+                    self.counters["retries"] += 1
+                    retry_after = response.headers.get("Retry-After") if response is not None else None
+                    await asyncio.sleep(self._backoff_s(attempt, retry_after))
+        except asyncio.CancelledError:
+            # The caller gave up (a deadline, a cancelled prefetch, a lost hedge), not the
+            # upstream: a slow upstream shows up as a read timeout instead. Covers the backoff
+            # sleeps too, so a cancelled half-open trial never leaves the breaker stuck.
+            self.breaker.abandon(permit)
+            raise
+        return self._finish(response, error)
+
+    async def aclose(self):
+        """Close the async client for the running event loop"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> dict:
+        return {**self.counters, "breaker": self.breaker.state, "breaker_opened": self.breaker.times_opened}
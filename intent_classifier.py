@@ -0,0 +1,256 @@
+# intent_classifier.py
+# Local fast-path intent classifier: keyword rules + hashed n-gram linear model
+#
+# Sits in front of the Gemini classify_intent call. Confident predictions are
+# answered locally; anything below the confidence threshold escalates to Gemini.
+#
+# Train from logged /chat interactions:
+#     python intent_classifier.py train logs.json --out intent_model.npz
+#
+# Only interactions whose intent came from Gemini's classifier are used
+# (intent_source "gemini"); the local classifier's own decisions, sticky
+# routes, fused replies and timeout defaults would train it on itself.
+
+import numpy as np
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+LABELS = ["billing", "sales", "technical_support", "other"]
+N_FEATURES = 2 ** 14
+
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.npz")
+LOCAL_INTENT_THRESHOLD = float(os.getenv("LOCAL_INTENT_THRESHOLD", "0.85"))
+
+# Keyword/regex rules. A message that matches exactly one intent's rules is
+# classified locally; the confidence grows with the number of matching rules.
+# One matching rule is a guess below the threshold (a single keyword misroutes
+# "my phone won't charge" to billing); it takes two rules, or the trained model
+# agreeing, to skip Gemini.
+KEYWORD_RULES = {
+    "billing": [
+        r"\bbill(s|ed|ing)?\b", r"\bcharge[sd]?\b", r"\brefund", r"\bpay(ment|ments)?\b",
+        r"\bautopay\b", r"\binvoice", r"\bfees?\b", r"\blate fee", r"\boverdue\b",
+        r"\bprorated?\b", r"\bbalance\b",
+    ],
+    "sales": [
+        r"\bupgrad(e|ing)\b", r"\bnew (phone|plan|line)\b", r"\bunlimited\b", r"\bplans?\b",
+        r"\bpromo(tion)?s?\b", r"\bdeals?\b", r"\bswitch(ing)? (to|from)\b",
+        r"\badd (a )?lines?\b", r"\btrade[- ]?in\b", r"\bbuy\b", r"\bpricing\b",
+    ],
+    "technical_support": [
+        r"\bdropp(ed|ing)? calls?\b", r"\bno service\b", r"\bsignal\b", r"\bslow (data|internet)\b",
+        r"\bwi-?fi calling\b", r"\be?sim\b", r"\bvoicemail\b", r"\bapn\b", r"\bnot working\b",
+        r"\bhotspot\b", r"\brestart", r"\b(sms|mms)\b", r"\bcoverage\b", r"\boutage\b",
+        r"\bbars\b", r"\bconnect(ion)?\b",
+    ],
+}
+RULE_CONFIDENCE = {1: 0.7, 2: 0.9}
+RULE_CONFIDENCE_MAX = 0.97
+# A single rule hit the trained model also predicts
+RULE_MODEL_AGREEMENT = 0.9
+
+_COMPILED_RULES = {
+    label: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for label, patterns in KEYWORD_RULES.items()
+}
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def _normalize(text: str) -> str:
+    # Fold non-ASCII hyphens (e.g. "Wi‑Fi") so rules and n-grams match either form
+    return text.lower().replace("‑", "-").replace("‐", "-")
+
+
+def featurize(text: str, n_features: int = N_FEATURES) -> np.ndarray:
+    """
+    Hash word unigrams, word bigrams and character trigrams into a fixed-size,
+    L2-normalized vector.
+    """
+    text = _normalize(text)
+    tokens = _TOKEN_RE.findall(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"#{token}#"
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    vector = np.zeros(n_features, dtype=np.float32)
+    for gram in grams:
+        vector[zlib.crc32(gram.encode()) % n_features] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class LocalIntentClassifier:
+    """
+    Rule + linear-model intent classifier with a confidence threshold.
+    classify() returns an intent when confident, or None to escalate to Gemini.
+    """
+    def __init__(self, threshold: float = LOCAL_INTENT_THRESHOLD):
+        self.threshold = threshold
+        self.weights = None
+        self.bias = None
+        self._lock = threading.Lock()
+        self.counters = {"rule_hits": 0, "model_hits": 0, "escalations": 0}
+
+    @property
+    def trained(self) -> bool:
+        return self.weights is not None
+
+    def match_rules(self, text: str) -> tuple:
+        """
+        Returns: (intent, confidence) if exactly one intent's rules match, else (None, 0.0)
+        """
+        text = _normalize(text)
+        hits = {
+            label: sum(1 for rule in rules if rule.search(text))
+            for label, rules in _COMPILED_RULES.items()
+        }
+        matched = [label for label, count in hits.items() if count]
+        if len(matched) != 1:
+            return None, 0.0
+        label = matched[0]
+        return label, RULE_CONFIDENCE.get(hits[label], RULE_CONFIDENCE_MAX)
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        """Class probabilities from the linear model (in LABELS order)"""
+        return _softmax(featurize(text) @ self.weights + self.bias)
+
+    def predict(self, text: str) -> tuple:
+        """
+        Best local guess regardless of threshold.
+        Returns: (intent, confidence, source) where source is rule, model or none
+        """
+        label, confidence = self.match_rules(text)
+        probs = self.predict_proba(text) if self.trained else None
+        if label is not None:
+            if probs is not None and LABELS[int(np.argmax(probs))] == label:
+                confidence = max(confidence, RULE_MODEL_AGREEMENT)
+            return label, confidence, "rule"
+        if probs is not None:
+            best = int(np.argmax(probs))
+            return LABELS[best], float(probs[best]), "model"
+        return "other", 0.0, "none"
+
+    def classify(self, text: str):
+        """
+        Fast-path classification.
+        Returns: intent if confidence >= threshold, else None (escalate to Gemini)
+        """
+        label, confidence, source = self.predict(text)
+        with self._lock:
+            if source != "none" and confidence >= self.threshold:
+                self.counters[f"{source}_hits"] += 1
+                return label
+            self.counters["escalations"] += 1
+        return None
+
+    def stats(self) -> dict:
+        """Hit-rate counters for the local tier"""
+        with self._lock:
+            counters = dict(self.counters)
+        total = sum(counters.values())
+        local = counters["rule_hits"] + counters["model_hits"]
+        return {
+            **counters,
+            "threshold": self.threshold,
+            "model_loaded": self.trained,
+            "hit_rate": round(local / total, 4) if total else 0.0,
+        }
+
+    def fit(self, texts: list, labels: list, epochs: int = 200,
+            learning_rate: float = 0.5, l2: float = 1e-4) -> "LocalIntentClassifier":
+        """Train the linear model with full-batch softmax regression"""
+        features = np.stack([featurize(text) for text in texts])
+        targets = np.zeros((len(labels), len(LABELS)), dtype=np.float32)
+        for row, label in enumerate(labels):
+            targets[row, LABELS.index(label)] = 1.0
+
+        weights = np.zeros((N_FEATURES, len(LABELS)), dtype=np.float32)
+        bias = np.zeros(len(LABELS), dtype=np.float32)
+        for _ in range(epochs):
+            error = _softmax(features @ weights + bias) - targets
+            weights -= learning_rate * (features.T @ error / len(texts) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+
+        self.weights, self.bias = weights, bias
+        return self
+
+    def save(self, path: str = INTENT_MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(LABELS))
+        logger.info(f"Saved intent model to {path}")
+
+    def load(self, path: str = INTENT_MODEL_PATH) -> bool:
+        """Load a trained model if one exists; rules still work without it"""
+        if not os.path.exists(path):
+            return False
+        data = np.load(path)
+        if list(data["labels"]) != LABELS:
+            logger.warning(f"Intent model {path} has unexpected labels, ignoring it")
+            return False
+        self.weights, self.bias = data["weights"], data["bias"]
+        logger.info(f"Loaded intent model from {path}")
+        return True
+
+
+# Label sources fit for training and evaluation (see ChatPipeline.intent_source)
+TRAINING_SOURCES = ("gemini",)
+
+
+def load_interactions(path: str, sources: tuple = TRAINING_SOURCES) -> list:
+    """
+    Read logged /chat interactions from a /logs JSON dump or a JSONL file.
+    sources: keep entries whose intent_source is one of these (None keeps every entry,
+    including ones logged before intent_source was recorded)
+    Returns: list of (customer_message, agent_type)
+    """
+    with open(path) as f:
+        raw = f.read()
+    try:
+        data = json.loads(raw)
+        entries = data["logs"] if isinstance(data, dict) else data
+    except json.JSONDecodeError:
+        entries = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    return [
+        (entry["customer_message"], entry["agent_type"])
+        for entry in entries
+        if entry.get("agent_type") in LABELS
+        and (sources is None or entry.get("intent_source") in sources)
+    ]
+
+
+# Shared instance used by services.classify_intent
+fast_classifier = LocalIntentClassifier()
+fast_classifier.load()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local intent classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train", help="train from logged /chat interactions")
+    train.add_argument("logs", help="/logs JSON dump or JSONL of interactions")
+    train.add_argument("--out", default=INTENT_MODEL_PATH)
+    train.add_argument("--epochs", type=int, default=200)
+    train.add_argument("--any-source", action="store_true",
+                       help="also train on labels that didn't come from Gemini (local, sticky, fused, fallback)")
+    args = parser.parse_args()
+
+    examples = load_interactions(args.logs, None if args.any_source else TRAINING_SOURCES)
+    if not examples:
+        raise SystemExit(f"No Gemini-labeled interactions found in {args.logs} (see --any-source)")
+    texts, labels = zip(*examples)
+    classifier = LocalIntentClassifier().fit(list(texts), list(labels), epochs=args.epochs)
+    classifier.save(args.out)
+    print(f"Trained on {len(texts)} interactions -> {args.out}")
@@ -0,0 +1,270 @@
+# limits.py
+# Adaptive (AIMD) concurrency limits and priority load shedding for upstream providers
+#
+# Every async upstream call in services.py runs inside limits.slot(provider).
+# Each provider's limit grows by ~1 per limit's worth of successful calls and
+# halves when the provider throttles us (429 / ResourceExhausted). Calls over
+# the limit wait in a bounded queue ordered by endpoint priority (voice before
+# chat before batch); when the queue is full or the wait runs out the call is
+# shed with Overloaded, which main.py turns into a 503 with Retry-After.
+# In multi-worker mode the limit is cluster-wide (see shared_state.py): each
+# worker batches its increases and backoffs into it every LIMIT_SYNC_S and
+# runs at an equal share.
+
+from contextlib import asynccontextmanager
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import os
+import sys
+import time
+import metrics
+import shared_state
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(provider: str, key: str, default: str) -> float:
+    """Per-provider override (e.g. GEMINI_LIMIT_MAX), then the global LIMIT_* value"""
+    return float(os.getenv(f"{provider.upper()}_{key}", os.getenv(key, default)))
+
+
+# Lower number = served first; unknown endpoints rank with chat
+PRIORITIES = {"voice": 0, "voice_stream": 0, "chat": 1, "chat_stream": 1, "batch": 2}
+DEFAULT_PRIORITY = PRIORITIES["chat"]
+
+SHED_REQUESTS = metrics.Counter(
+    "agent_shed_total", "Upstream calls rejected by the concurrency limiter", ("provider", "endpoint", "reason")
+)
+
+
+class Overloaded(Exception):
+    """An upstream call was shed (queue full, queue wait expired, or provider throttling)"""
+    def __init__(self, provider: str, reason: str, retry_after_s: float):
+        super().__init__(f"{provider} is overloaded ({reason}), retry after {retry_after_s:g}s")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after_s)))
+
+
+class Throttled(Exception):
+    """Raised inside a slot when a provider answers with a rate-limit status"""
+
+
+def is_throttle(error: Exception) -> bool:
+    """Errors that mean the provider wants less traffic from us"""
+    if isinstance(error, Throttled):
+        return True
+    # Only the Gemini SDK raises these, so until it's loaded there is nothing to match
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    return google_exceptions is not None and isinstance(error, (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable,
+    ))
+
+
+def check_status(provider: str, status_code: int):
+    """Raise Throttled for a 429 so the limiter backs off"""
+    if status_code == 429:
+        raise Throttled(f"{provider} returned 429")
+
+
+_current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+
+def set_priority(endpoint: str):
+    """Queue the current request's upstream calls at `endpoint`'s priority"""
+    _current_endpoint.set(endpoint)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one provider, with a bounded priority wait
+    queue. Runs on the event loop thread; no locking needed.
+    coordinator: shared_state.LimitCoordinator to split a cluster-wide limit
+    across workers, or None to keep the limit local
+    """
+    def __init__(self, name: str, coordinator: shared_state.LimitCoordinator = None):
+        self.name = name
+        self.min_limit = max(1.0, _setting(name, "LIMIT_MIN", "1"))
+        self.max_limit = max(self.min_limit, _setting(name, "LIMIT_MAX", "64"))
+        self.limit = min(self.max_limit, max(self.min_limit, _setting(name, "LIMIT_INITIAL", "8")))
+        self.backoff = _setting(name, "LIMIT_BACKOFF", "0.5")
+        self.max_queue = int(_setting(name, "LIMIT_QUEUE_SIZE", "100"))
+        self.queue_timeout_s = _setting(name, "LIMIT_QUEUE_TIMEOUT_S", "5")
+        self.retry_after_s = _setting(name, "LIMIT_RETRY_AFTER_S", "2")
+        self.in_flight = 0
+        self.coordinator = coordinator
+        self.cluster_limit = self.limit
+        self._pending_increase = 0.0
+        self._pending_factor = 1.0
+        self._synced_at = None
+        self._syncing = False
+        self._waiters = []  # heap of (priority, seq, future, endpoint)
+        self._seq = itertools.count()
+        self.counters = {"requests": 0, "queued": 0, "shed": 0, "throttled": 0}
+
+    def _shed(self, reason: str, endpoint: str) -> Overloaded:
+        self.counters["shed"] += 1
+        SHED_REQUESTS.inc(provider=self.name, endpoint=endpoint or "", reason=reason)
+        logger.warning(f"Shedding {endpoint or 'unknown'} call to {self.name}: {reason}")
+        return Overloaded(self.name, reason, self.retry_after_s)
+
+    def _grant(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future, _ = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _discard(self, entry: tuple):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    async def acquire(self):
+        endpoint = _current_endpoint.get()
+        priority = PRIORITIES.get(endpoint, DEFAULT_PRIORITY)
+        self.counters["requests"] += 1
+        self._maybe_sync()
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            # Full queue: the newest lowest-priority waiter makes room, unless that is us
+            worst = max(self._waiters)
+            if worst[0] <= priority:
+                raise self._shed("queue_full", endpoint)
+            self._discard(worst)
+            worst[2].set_exception(self._shed("preempted", worst[3]))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future, endpoint)
+        heapq.heappush(self._waiters, entry)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            raise self._shed("queue_timeout", endpoint)
+        except asyncio.CancelledError:
+            self._discard(entry)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as we were cancelled: hand the slot on
+                self.release("error")
+            raise
+
+    def release(self, outcome: str):
+        """outcome: success (additive increase), throttled (multiplicative decrease) or error"""
+        self.in_flight -= 1
+        if self.coordinator is not None:
+            if outcome == "success":
+                self._pending_increase += 1 / self.cluster_limit
+            elif outcome == "throttled":
+                self.counters["throttled"] += 1
+                self._pending_factor *= self.backoff
+            self._maybe_sync(force=outcome == "throttled")
+        elif outcome == "success":
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif outcome == "throttled":
+            self.counters["throttled"] += 1
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            logger.warning(f"{self.name} throttled us, concurrency limit now {int(self.limit)}")
+        self._grant()
+
+    def _maybe_sync(self, force: bool = False):
+        """
+        Fold this worker's changes into the cluster-wide limit and take an
+        equal share. The sync runs on shared_state.writer; _synced applies the
+        result back on the event loop.
+        """
+        if self.coordinator is None or self._syncing:
+            return
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < shared_state.LIMIT_SYNC_S:
+            return
+        self._synced_at = now
+        self._syncing = True
+        increase, factor = self._pending_increase, self._pending_factor
+        self._pending_increase, self._pending_factor = 0.0, 1.0
+        loop = asyncio.get_running_loop()
+        initial = self.limit
+
+        def sync():
+            return self.coordinator.sync(
+                self.name, increase, factor, initial=initial, min_limit=self.min_limit, max_limit=self.max_limit,
+            )
+
+        def done(result, error):
+            try:
+                loop.call_soon_threadsafe(self._synced, result, error, increase, factor)
+            except RuntimeError:
+                pass  # loop closed while the sync ran
+
+        shared_state.writer.submit(sync, done)
+
+    def _synced(self, result, error, increase: float, factor: float):
+        self._syncing = False
+        if error is not None:
+            # Keep running on the last known share; the changes are retried next sync
+            logger.warning(f"Could not sync {self.name} limit with other workers: {error}")
+            self._pending_increase += increase
+            self._pending_factor *= factor
+            return
+        self.cluster_limit, workers = result
+        if factor < 1:
+            logger.warning(f"{self.name} throttled us, cluster concurrency limit now {int(self.cluster_limit)}")
+        self.limit = max(1.0, self.cluster_limit / workers)
+        self._grant()
+        if self._pending_factor < 1:
+            # Throttled again while that sync was running
+            self._maybe_sync(force=True)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one unit of concurrency for the `with` block. Provider throttling
+        inside the block shrinks the limit and surfaces as Overloaded.
+        """
+        await self.acquire()
+        outcome = "error"
+        try:
+            yield
+            outcome = "success"
+        except Exception as e:
+            if is_throttle(e):
+                outcome = "throttled"
+                SHED_REQUESTS.inc(provider=self.name, endpoint=_current_endpoint.get() or "", reason="throttled")
+                raise Overloaded(self.name, "throttled", self.retry_after_s) from e
+            raise
+        finally:
+            self.release(outcome)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "limit": int(self.limit),
+            "cluster_limit": int(self.cluster_limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+        }
+
+
+limiters = {
+    name: AdaptiveLimiter(name, shared_state.limit_coordinator)
+    for name in ("gemini", "perplexity", "elevenlabs")
+}
+
+
+def slot(provider: str):
+    """Concurrency slot for one call to `provider` (see AdaptiveLimiter.slot)"""
+    return limiters[provider].slot()
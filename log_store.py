@@ -0,0 +1,189 @@
+# log_store.py
+# Bounded, persistent interaction log: SQLite in WAL mode with batched background writes
+
+import sqlite3
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LOG_DB_PATH = os.getenv("LOG_DB_PATH", "interactions.db")
+LOG_MAX_ROWS = int(os.getenv("LOG_MAX_ROWS", "100000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL_S = float(os.getenv("LOG_FLUSH_INTERVAL_S", "0.5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    customer_id TEXT,
+    agent_type TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_customer ON interactions (customer_id, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_agent ON interactions (agent_type, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions (timestamp);
+"""
+
+
+class InteractionLogStore:
+    """
+    Append-only interaction log.
+    append() only enqueues; a background thread writes batches in a single
+    transaction and prunes rows beyond max_rows. Reads page through SQLite,
+    so memory stays constant however many interactions are retained.
+    """
+    def __init__(self, path: str = LOG_DB_PATH, max_rows: int = LOG_MAX_ROWS,
+                 batch_size: int = LOG_BATCH_SIZE, flush_interval_s: float = LOG_FLUSH_INTERVAL_S):
+        self.path = path
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        if self._read_conn is None:
+            self._read_conn = self._connect()
+        return self._read_conn
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+                    self._writer.start()
+
+    def append(self, entry: dict):
+        """Queue an interaction for writing (never blocks the request path)"""
+        self._ensure_writer()
+        self._queue.put(entry)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                self._queue.task_done()
+                break
+            # Write once the batch is full or flush_interval_s after its first entry,
+            # so a steady trickle of requests can't hold entries back indefinitely
+            batch = [entry]
+            flush_at = time.monotonic() + self.flush_interval_s
+            try:
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    batch.append(self._queue.get(timeout=max(0.0, flush_at - time.monotonic())))
+            except queue.Empty:
+                pass
+            stop = batch[-1] is None
+            rows = [
+                (e["timestamp"], e.get("customer_id"), e.get("agent_type"), json.dumps(e))
+                for e in batch if e is not None
+            ]
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO interactions (timestamp, customer_id, agent_type, entry) VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                    conn.execute(
+                        "DELETE FROM interactions WHERE id <= (SELECT MAX(id) FROM interactions) - ?",
+                        (self.max_rows,),
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(rows)} interactions: {e}")
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    def flush(self):
+        """Block until every queued interaction has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+    @staticmethod
+    def _where(customer_id: str = None, agent_type: str = None,
+               since: str = None, until: str = None) -> tuple:
+        clauses, params = [], []
+        for clause, value in (
+            ("customer_id = ?", customer_id),
+            ("agent_type = ?", agent_type),
+            ("timestamp >= ?", since),
+            ("timestamp < ?", until),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return clauses, params
+
+    def _select(self, sql: str, params: list) -> list:
+        with self._read_lock:
+            return self._reader().execute(sql, params).fetchall()
+
+    def count(self, **filters) -> int:
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._select(f"SELECT COUNT(*) FROM interactions {where}", params)[0][0]
+
+    def page(self, limit: int = 50, cursor: int = None, **filters) -> tuple:
+        """
+        Newest-first page of interactions.
+        cursor: id to continue below (from the previous page's next_cursor)
+        Returns: (entries, next_cursor or None)
+        """
+        clauses, params = self._where(**filters)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._select(
+            f"SELECT id, entry FROM interactions {where} ORDER BY id DESC LIMIT ?", params + [limit]
+        )
+        entries = [{"id": row_id, **json.loads(entry)} for row_id, entry in rows]
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return entries, next_cursor
+
+    def export(self, cursor: int = 0, page_size: int = 500, **filters):
+        """
+        Oldest-first generator over every matching interaction, read one page
+        at a time. cursor: id to resume after.
+        """
+        clauses, params = self._where(**filters)
+        clauses.append("id > ?")
+        where = " AND ".join(clauses)
+        while True:
+            rows = self._select(
+                f"SELECT id, entry FROM interactions WHERE {where} ORDER BY id LIMIT ?",
+                params + [cursor, page_size],
+            )
+            for row_id, entry in rows:
+                yield {"id": row_id, **json.loads(entry)}
+            if len(rows) < page_size:
+                return
+            cursor = rows[-1][0]
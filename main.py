@@ -1,12 +1,39 @@
 # main.py
 # FastAPI backend with all endpoints
 
-from fastapi import FastAPI, HTTPException
+from providers import load_env, registry as providers
+
+# Modules below read their settings at import, so .env has to be loaded first
+load_env()
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-from services import classify_intent, get_context_from_perplexity, generate_response, text_to_speech
+from typing import Optional
+from services import text_to_speech_async, close_http_clients, perplexity_client, get_tts_client
+from voice import synthesize_stream
+from log_store import InteractionLogStore
+from batch import triage_batch
 from agents import AgentRouter
+from pipeline import ChatPipeline
+from intent_classifier import fast_classifier
+from cache import response_cache, context_cache
+from limits import Overloaded, limiters
+from sessions import session_store, ANONYMOUS_CUSTOMER
+from retrieval import knowledge_base
+from prompts import prompt_registry
+from model_tiers import model_router
+from deadline import hedger
+from audio_cache import audio_cache, AudioFileResponse
+from speculation import speculator
+import metering
+import metrics
+import shared_state
 import logging
-from datetime import datetime
+import asyncio
+import json
+import base64
+import os
 
 # Setup logging
 logging.basicConfig(
@@ -22,17 +49,43 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# In-memory interaction log
-interaction_log = []
+# Persistent, bounded interaction log (writes are batched off the request path)
+interaction_log = InteractionLogStore()
 
 # Initialize agent router
 router = AgentRouter()
 
+# Build upstream clients and agents at startup rather than on the first request
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "1") == "1"
+
+# Cache, breaker and fast-path counters, exported as gauges on /metrics
+metrics.register_stats("intent_fast_path", fast_classifier.stats)
+metrics.register_stats("response_cache", response_cache.stats)
+metrics.register_stats("context_cache", context_cache.stats)
+metrics.register_stats("sessions", session_store.stats)
+metrics.register_stats("knowledge_base", knowledge_base.stats)
+metrics.register_stats("prompts", prompt_registry.stats)
+metrics.register_stats("audio_cache", audio_cache.stats)
+metrics.register_stats("speculation", speculator.stats)
+metrics.register_stats("perplexity", lambda: {
+    **perplexity_client.stats(), "breaker_open": perplexity_client.breaker.state != "closed",
+})
+for name, limiter in limiters.items():
+    metrics.register_stats(f"limiter_{name}", limiter.stats)
+for tier in model_router.tiers:
+    metrics.register_stats(f"model_{tier}", lambda tier=tier: model_router.stats()[tier])
+
 
 class CustomerMessage(BaseModel):
     """Customer message request"""
     message: str
-    customer_id: str = "demo_customer"
+    # Without one the request is anonymous: logged under ANONYMOUS_CUSTOMER, with no session
+    customer_id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    """Batch of customer messages for bulk triage"""
+    messages: list[CustomerMessage]
 
 
 class AgentResponse(BaseModel):
@@ -41,6 +94,46 @@ class AgentResponse(BaseModel):
     response: str
     context_used: str
     cost_estimate: float
+    cost_breakdown: dict = {}
+
+
+async def run_pipeline(msg: CustomerMessage, endpoint: str = "chat") -> ChatPipeline:
+    """
+    Run the chat pipeline once for a message, in the customer's session.
+    Shared by /chat and /voice so neither repeats an upstream call.
+    """
+    logger.info(f"Received: {msg.message[:50]}...")
+    
+    # Steps 1-3: Classify intent (or stick with the session's agent) and get context, route to agent or cache
+    return await new_pipeline(msg, endpoint).run(router)
+
+
+def new_pipeline(msg: CustomerMessage, endpoint: str) -> ChatPipeline:
+    """ChatPipeline for a message, in the customer's session (none for anonymous callers)"""
+    return ChatPipeline(msg.message, msg.customer_id or ANONYMOUS_CUSTOMER, endpoint,
+                        session_store.for_customer(msg.customer_id))
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded) -> JSONResponse:
+    """Shed requests get an immediate 503 telling the client when to retry"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+
+def record_interaction(pipeline: ChatPipeline) -> float:
+    """
+    Close the request's cost meter, add the exchange to the customer's
+    session and append the interaction to the log.
+    Returns: the request's upstream cost in USD
+    """
+    cost = pipeline.finish()
+    pipeline.remember()
+    interaction_log.append(pipeline.to_log_entry())
+    return cost
 
 
 @app.post("/chat", response_model=AgentResponse)
@@ -49,92 +142,291 @@ async def chat(msg: CustomerMessage) -> AgentResponse:
     Main chat endpoint: receive message, classify intent, route to agent, return response
     """
     try:
-        logger.info(f"Received: {msg.message[:50]}...")
-        
-        # Step 1: Classify intent
-        intent = classify_intent(msg.message)
-        logger.info(f"Classified as: {intent}")
-        
-        # Step 2: Get context
-        context = get_context_from_perplexity(msg.message)
-        logger.info(f"Context retrieved: {context[:50]}...")
-        
-        # Step 3: Route to agent and get response
-        agent_name, response = router.route(intent, msg.message)
-        logger.info(f"Generated response from {agent_name}")
+        pipeline = await run_pipeline(msg)
         
-        # Step 4: Log interaction
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "customer_id": msg.customer_id,
-            "customer_message": msg.message,
-            "agent_type": intent,
-            "response": response,
-            "context": context[:200],
-        }
-        interaction_log.append(log_entry)
-        
-        # Step 5: Calculate cost estimate (mock)
-        cost_estimate = 0.023  # Rough estimate per interaction
+        # Steps 4-5: Log interaction with its metered upstream cost
+        cost_estimate = record_interaction(pipeline)
         
         return AgentResponse(
-            agent_type=intent,
-            response=response,
-            context_used=context[:200],
+            agent_type=pipeline.intent,
+            response=pipeline.response,
+            context_used=(pipeline.context or "")[:200],
             cost_estimate=cost_estimate,
+            cost_breakdown=pipeline.meter.summary(),
         )
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in /chat: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(msg: CustomerMessage) -> StreamingResponse:
+    """
+    Streaming chat endpoint (Server-Sent Events).
+    Frames: one `intent`, then `token` frames as the response is generated,
+    then a final `done` frame with cost_estimate and context_used.
+    """
+    try:
+        logger.info(f"Stream request received: {msg.message[:50]}...")
+        pipeline = new_pipeline(msg, "chat_stream")
+        tokens = await pipeline.stream_response(router)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /chat/stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        pipeline.bind()
+        try:
+            yield sse_event("intent", {"agent_type": pipeline.intent, "agent_name": pipeline.agent_name})
+            try:
+                async for token in tokens:
+                    yield sse_event("token", {"text": token})
+            except Overloaded as e:
+                # Headers are already sent, so the 503 becomes an error frame
+                yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after_s})
+                return
+            except Exception as e:
+                logger.error(f"Error in /chat/stream: {str(e)}")
+                yield sse_event("error", {"detail": str(e)})
+                return
+            
+            # Log the fully assembled response
+            cost_estimate = record_interaction(pipeline)
+            yield sse_event("done", {
+                "cost_estimate": cost_estimate,
+                "context_used": (pipeline.context or "")[:200],
+            })
+        finally:
+            # Errors and disconnects still log what was sent, and roll up its cost
+            if pipeline.response is None:
+                pipeline.stream_stopped()
+                record_interaction(pipeline)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchRequest) -> StreamingResponse:
+    """
+    Bulk triage endpoint: NDJSON stream with one result per message in
+    completion order, then a summary line with messages_per_second.
+    """
+    logger.info(f"Batch request received: {len(batch.messages)} messages")
+    tickets = [msg.model_dump() for msg in batch.messages]
+    
+    async def lines():
+        # Batch-level meter catches the shared classification calls
+        batch_meter = metering.start_request("batch", None)
+        async for result in triage_batch(tickets, router, on_complete=record_interaction):
+            yield json.dumps(result) + "\n"
+        metering.finish_request(batch_meter)
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/voice")
 async def voice_chat(msg: CustomerMessage) -> dict:
     """
-    Voice chat endpoint: returns both text response and voice availability
+    Voice chat endpoint: returns the text response plus base64-encoded audio when available
     """
     try:
         logger.info(f"Voice request received: {msg.message[:50]}...")
         
         # Get text response
-        response = await chat(msg)
+        pipeline = await run_pipeline(msg, "voice")
         
         # Convert to speech
-        tts_result = text_to_speech(response.response)
+        tts_result = await text_to_speech_async(pipeline.response, pipeline.deadline)
+        cost_estimate = record_interaction(pipeline)
         
         return {
-            "text_response": response.response,
-            "agent_type": response.agent_type,
+            "text_response": pipeline.response,
+            "agent_type": pipeline.intent,
             "audio_available": tts_result["success"],
             "audio_message": tts_result["message"],
-            "cost_estimate": response.cost_estimate,
+            "audio_base64": base64.b64encode(tts_result["audio"]).decode() if tts_result["success"] else None,
+            "audio_url": f"/audio/{tts_result['audio_key']}" if tts_result["success"] else None,
+            "cost_estimate": cost_estimate,
         }
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in /voice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/voice/stream")
+async def voice_stream(msg: CustomerMessage) -> StreamingResponse:
+    """
+    Streaming voice endpoint: chunked audio/mpeg response.
+    Sentences are synthesized as the text is generated, so the first audio
+    arrives roughly one sentence into generation. The agent type is sent in
+    the X-Agent-Type header.
+    """
+    if get_tts_client() is None:
+        raise HTTPException(status_code=503, detail="Text-to-speech is not configured")
+    try:
+        logger.info(f"Voice stream request received: {msg.message[:50]}...")
+        pipeline = new_pipeline(msg, "voice_stream")
+        tokens = await pipeline.stream_response(router)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /voice/stream: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def audio():
+        pipeline.bind()
+        try:
+            async for chunk in synthesize_stream(tokens):
+                yield chunk
+        finally:
+            # Errors and disconnects still log what was sent, and roll up its cost
+            pipeline.stream_stopped()
+            record_interaction(pipeline)
+    
+    return StreamingResponse(
+        audio(),
+        media_type="audio/mpeg",
+        headers={"X-Agent-Type": pipeline.intent},
+    )
+
+
+@app.get("/audio/{key}")
+async def get_audio(key: str) -> AudioFileResponse:
+    """
+    Synthesized audio by content key (the audio_url from /voice), served
+    straight from the on-disk audio cache. Content never changes for a key,
+    so clients may cache it indefinitely.
+    """
+    path = await asyncio.to_thread(audio_cache.locate, key) if audio_cache.is_key(key) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return AudioFileResponse(
+        path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
 @app.get("/logs")
-async def get_logs() -> dict:
+def get_logs(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: int = None,
+    customer_id: str = None,
+    agent_type: str = None,
+    since: str = None,
+    until: str = None,
+) -> dict:
     """
-    View all interaction logs
+    View interaction logs, newest first, one page at a time.
+    Filter by customer_id, agent_type and ISO timestamp range [since, until);
+    pass next_cursor back as cursor to get the following page.
     """
-    logger.info(f"Logs requested: {len(interaction_log)} interactions")
+    filters = {"customer_id": customer_id, "agent_type": agent_type, "since": since, "until": until}
+    logs, next_cursor = interaction_log.page(limit=limit, cursor=cursor, **filters)
+    total = interaction_log.count(**filters)
+    logger.info(f"Logs requested: {len(logs)} of {total} interactions")
     return {
-        "total_interactions": len(interaction_log),
-        "logs": interaction_log,
+        "total_interactions": total,
+        "logs": logs,
+        "next_cursor": next_cursor,
     }
 
 
+@app.get("/logs/export")
+def export_logs(
+    cursor: int = 0,
+    customer_id: str = None,
+    agent_type: str = None,
+    since: str = None,
+    until: str = None,
+) -> StreamingResponse:
+    """
+    Stream matching interactions oldest first as NDJSON. Each line carries
+    its id, so an interrupted export can resume with cursor=<last id>.
+    """
+    entries = interaction_log.export(
+        cursor=cursor, customer_id=customer_id, agent_type=agent_type, since=since, until=until
+    )
+    return StreamingResponse(
+        (json.dumps(entry) + "\n" for entry in entries),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/costs")
+async def get_costs() -> dict:
+    """
+    Rolling upstream cost and token totals per agent, customer (top spenders),
+    endpoint and provider
+    """
+    return metering.aggregates.snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> str:
+    """
+    Prometheus scrape endpoint: per-stage, per-provider and per-agent latency
+    histograms, upstream error and fallback counters, cache and breaker gauges
+    """
+    return metrics.render()
+
+
 @app.get("/health")
 async def health() -> dict:
     """
     Health check endpoint
     """
-    return {"status": "ok", "service": "T-Mobile AI Agent"}
+    return {
+        "status": "ok",
+        "service": "T-Mobile AI Agent",
+        "intent_fast_path": fast_classifier.stats(),
+        "response_cache": response_cache.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "context_cache": context_cache.stats(),
+        "sessions": session_store.stats(),
+        "upstreams": {"perplexity": perplexity_client.stats()},
+        "providers": providers.stats(),
+        "model_tiers": model_router.stats(),
+        "hedging": hedger.stats(),
+        # Entry count and size come from the on-disk index
+        "audio_cache": await asyncio.to_thread(audio_cache.stats),
+        "speculation": speculator.stats(),
+        "limiters": {name: limiter.stats() for name, limiter in limiters.items()},
+        "shared_state": shared_state.SHARED_STATE_PATH or None,
+    }
+
+
+@app.on_event("startup")
+async def startup():
+    """Warm up providers (SDK imports, client setup) off the event loop, then the agents"""
+    if WARM_UP_ON_STARTUP:
+        built = await asyncio.to_thread(providers.warm_up)
+        router.warm_up()
+        logger.info(f"Warm-up done: {built}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release pooled upstream connections and flush the interaction log"""
+    await close_http_clients()
+    interaction_log.close()
 
 
 if __name__ == "__main__":
     import uvicorn
-    logger.info("Starting T-Mobile AI Agent backend")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if shared_state.WORKERS > 1:
+        # Each worker re-imports this module and opens the same shared-state file
+        logger.info(f"Starting T-Mobile AI Agent backend with {shared_state.WORKERS} workers")
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=shared_state.WORKERS)
+    else:
+        logger.info("Starting T-Mobile AI Agent backend")
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,203 @@
+# metering.py
+# Token/character metering and cost accounting for upstream calls
+#
+# services.py records every Gemini, Perplexity and ElevenLabs call into the
+# Meter of the request being served (tracked with a context variable), and
+# finished requests roll up into windowed aggregates per agent, customer,
+# endpoint and provider.
+
+from collections import deque
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RATE_TABLE_PATH = os.getenv("RATE_TABLE_PATH")
+METERING_WINDOW_MIN = int(os.getenv("METERING_WINDOW_MIN", "60"))
+
+# USD. Token rates are per 1M tokens, character rates per 1K characters,
+# request rates per call. Override any entry with a JSON file at RATE_TABLE_PATH.
+DEFAULT_RATE_TABLE = {
+    "gemini": {
+        "gemini-2.0-flash": {"input_per_1m": 0.10, "output_per_1m": 0.40},
+        "gemini-2.0-flash-lite": {"input_per_1m": 0.075, "output_per_1m": 0.30},
+        "gemini-1.5-pro": {"input_per_1m": 1.25, "output_per_1m": 5.00},
+    },
+    "perplexity": {
+        "sonar": {"input_per_1m": 1.00, "output_per_1m": 1.00, "per_request": 0.005},
+    },
+    "elevenlabs": {
+        "eleven_monolingual_v1": {"per_1k_chars": 0.30},
+    },
+}
+
+
+def load_rate_table(path: str = RATE_TABLE_PATH) -> dict:
+    """Default rates, with per-model overrides from a JSON file if configured"""
+    table = {provider: dict(models) for provider, models in DEFAULT_RATE_TABLE.items()}
+    if path:
+        with open(path) as f:
+            for provider, models in json.load(f).items():
+                table.setdefault(provider, {}).update(models)
+        logger.info(f"Loaded rate table overrides from {path}")
+    return table
+
+
+rate_table = load_rate_table()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) when the API reports none"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def price(provider: str, model: str, input_tokens: int = 0, output_tokens: int = 0,
+          characters: int = 0) -> float:
+    rates = rate_table.get(provider, {}).get(model)
+    if rates is None:
+        logger.warning(f"No rate configured for {provider}/{model}, pricing at 0")
+        return 0.0
+    return (
+        input_tokens * rates.get("input_per_1m", 0.0) / 1_000_000
+        + output_tokens * rates.get("output_per_1m", 0.0) / 1_000_000
+        + characters * rates.get("per_1k_chars", 0.0) / 1_000
+        + rates.get("per_request", 0.0)
+    )
+
+
+class Meter:
+    """Usage and cost of the upstream calls made while serving one request"""
+    def __init__(self, endpoint: str, customer_id: str):
+        self.endpoint = endpoint
+        self.customer_id = customer_id
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, call: dict):
+        with self._lock:
+            self.calls.append(call)
+
+    @property
+    def cost(self) -> float:
+        return sum(call["cost"] for call in self.calls)
+
+    def summary(self) -> dict:
+        """Totals per provider for the response body"""
+        by_provider = {}
+        for call in self.calls:
+            totals = by_provider.setdefault(call["provider"], {
+                "calls": 0, "input_tokens": 0, "output_tokens": 0, "characters": 0, "cost": 0.0,
+            })
+            totals["calls"] += 1
+            for field in ("input_tokens", "output_tokens", "characters", "cost"):
+                totals[field] += call[field]
+        for totals in by_provider.values():
+            totals["cost"] = round(totals["cost"], 6)
+        return {"total_cost": round(self.cost, 6), "by_provider": by_provider}
+
+
+_current_meter = contextvars.ContextVar("current_meter", default=None)
+
+
+def start_request(endpoint: str, customer_id: str) -> Meter:
+    """Create a Meter for the current request and make it the active one"""
+    meter = Meter(endpoint, customer_id)
+    _current_meter.set(meter)
+    return meter
+
+
+def bind(meter: Meter):
+    """Make an existing Meter active (e.g. inside a streaming response generator)"""
+    _current_meter.set(meter)
+
+
+def record(provider: str, model: str, input_tokens: int = 0, output_tokens: int = 0,
+           characters: int = 0, stage: str = None) -> float:
+    """
+    Record one upstream call against the active request and the provider totals.
+    Returns: cost in USD
+    """
+    cost = price(provider, model, input_tokens, output_tokens, characters)
+    call = {
+        "provider": provider, "model": model, "stage": stage,
+        "input_tokens": input_tokens, "output_tokens": output_tokens,
+        "characters": characters, "cost": cost,
+    }
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(call)
+    aggregates.add_call(call)
+    return cost
+
+
+class RollingAggregates:
+    """
+    Cost/usage totals over the last `window_min` minutes, kept in per-minute
+    buckets so old traffic ages out.
+    """
+    DIMENSIONS = ("agent", "customer", "endpoint", "provider")
+
+    def __init__(self, window_min: int = METERING_WINDOW_MIN):
+        self.window_min = window_min
+        self._buckets = deque()
+        self._lock = threading.Lock()
+
+    def _bucket(self) -> dict:
+        minute = int(time.time() // 60)
+        while self._buckets and self._buckets[0][0] <= minute - self.window_min:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != minute:
+            self._buckets.append((minute, {dimension: {} for dimension in self.DIMENSIONS}))
+        return self._buckets[-1][1]
+
+    @staticmethod
+    def _add(table: dict, key: str, requests: int, cost: float, input_tokens: int, output_tokens: int):
+        totals = table.setdefault(key, {"requests": 0, "cost": 0.0, "input_tokens": 0, "output_tokens": 0})
+        totals["requests"] += requests
+        totals["cost"] += cost
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+
+    def add_call(self, call: dict):
+        with self._lock:
+            self._add(self._bucket()["provider"], call["provider"], 1, call["cost"],
+                      call["input_tokens"], call["output_tokens"])
+
+    def add_request(self, meter: Meter, agent_type: str = None):
+        input_tokens = sum(call["input_tokens"] for call in meter.calls)
+        output_tokens = sum(call["output_tokens"] for call in meter.calls)
+        keys = {"endpoint": meter.endpoint, "customer": meter.customer_id, "agent": agent_type}
+        with self._lock:
+            bucket = self._bucket()
+            for dimension, key in keys.items():
+                if key is not None:
+                    self._add(bucket[dimension], key, 1, meter.cost, input_tokens, output_tokens)
+
+    def snapshot(self, top_customers: int = 20) -> dict:
+        merged = {dimension: {} for dimension in self.DIMENSIONS}
+        with self._lock:
+            self._bucket()
+            for _, bucket in self._buckets:
+                for dimension, table in bucket.items():
+                    for key, totals in table.items():
+                        self._add(merged[dimension], key, totals["requests"], totals["cost"],
+                                  totals["input_tokens"], totals["output_tokens"])
+        customers = sorted(merged["customer"].items(), key=lambda item: item[1]["cost"], reverse=True)
+        merged["customer"] = dict(customers[:top_customers])
+        return {"window_minutes": self.window_min, **{f"by_{d}": merged[d] for d in self.DIMENSIONS}}
+
+
+aggregates = RollingAggregates()
+
+
+def finish_request(meter: Meter, agent_type: str = None) -> float:
+    """
+    Roll a finished request into the aggregates.
+    Returns: the request's total cost in USD
+    """
+    aggregates.add_request(meter, agent_type)
+    return meter.cost
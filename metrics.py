@@ -0,0 +1,243 @@
+# metrics.py
+# In-process latency histograms and counters, exported in Prometheus text format
+#
+# services.py times each stage and upstream call, agents.py times each agent,
+# and pipeline.py keeps a per-request timing breakdown (tracked with a context
+# variable) for the interaction log. GET /metrics renders everything here.
+
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+# Seconds; spans a local fast-path classification up to a slow generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_collectors = []
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label combination"""
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds", "Latency of each pipeline stage", ("stage",)
+)
+UPSTREAM_SECONDS = Histogram(
+    "agent_upstream_seconds", "Latency of each upstream call", ("provider", "operation")
+)
+AGENT_SECONDS = Histogram(
+    "agent_process_seconds", "Latency of Agent.process per agent", ("agent",)
+)
+REQUEST_SECONDS = Histogram(
+    "agent_request_seconds", "End-to-end latency per endpoint", ("endpoint",)
+)
+UPSTREAM_ERRORS = Counter(
+    "agent_upstream_errors_total", "Failed upstream calls", ("provider", "operation")
+)
+UPSTREAM_CANCELLED = Counter(
+    "agent_upstream_cancelled_total",
+    "Upstream calls cancelled by us (lost hedges, discarded speculations, deadlines)", ("provider", "operation")
+)
+FALLBACKS = Counter(
+    "agent_fallbacks_total",
+    "Degraded results per stage (e.g. context from Gemini instead of Perplexity)",
+    ("stage", "fallback"),
+)
+FUSED_CALLS = Counter(
+    "agent_fused_calls_total",
+    "Fused classify-and-respond calls by outcome (answered, or why the multi-call path took over)",
+    ("outcome",),
+)
+
+
+# Per-request stage timings (milliseconds), for the interaction log
+_current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+def start_request() -> dict:
+    """Create the timing breakdown for the current request and make it the active one"""
+    timings = {}
+    _current_timings.set(timings)
+    return timings
+
+
+def bind(timings: dict):
+    """Make an existing timing breakdown active (e.g. inside a streaming response generator)"""
+    _current_timings.set(timings)
+
+
+def _record_stage(stage: str, elapsed: float):
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 2)
+
+
+def timed(stage: str):
+    """
+    Decorator: observe a function's latency as pipeline stage `stage` and add
+    it to the active request's timing breakdown. Works on plain functions,
+    coroutines and async generators (timed from first to last chunk).
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                finally:
+                    _record_stage(stage, time.perf_counter() - start)
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _record_stage(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _record_stage(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def upstream(provider: str, operation: str):
+    """
+    Time one upstream call and count it as an error if it raises.
+    Calls we cancel are counted separately and left out of the latencies.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except GeneratorExit:
+        # A streaming consumer stopped early; not the upstream's fault
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, provider=provider, operation=operation)
+        raise
+    except asyncio.CancelledError:
+        UPSTREAM_CANCELLED.inc(provider=provider, operation=operation)
+        raise
+    except BaseException:
+        UPSTREAM_ERRORS.inc(provider=provider, operation=operation)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, provider=provider, operation=operation)
+        raise
+    UPSTREAM_SECONDS.observe(time.perf_counter() - start, provider=provider, operation=operation)
+
+
+def register_stats(name: str, stats_fn):
+    """
+    Export the numeric fields of a stats() dict (cache, breaker, classifier
+    counters) as gauges named agent_<name>_<field>, read at scrape time.
+    """
+    _collectors.append((name, stats_fn))
+
+
+def _render_stats(name: str, stats: dict) -> list:
+    lines = []
+    for field, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        metric = f"agent_{name}_{field}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return lines
+
+
+def render() -> str:
+    """Returns: every metric in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for name, stats_fn in _collectors:
+        lines += _render_stats(name, stats_fn())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,227 @@
+# model_tiers.py
+# Model tiering: which Gemini model serves each stage and agent role, and when to escalate
+#
+# Classification, the context fallback and general questions go to a lite
+# model; agent responses go to the standard model. A response is moved one
+# tier up the ladder when the customer's message looks complex (long, or
+# several questions at once), and re-asked one tier up when the first answer
+# looks weak (very short, or a non-answer). Classification is re-asked one tier
+# up when the reply isn't a valid label.
+#
+# Routes are looked up as "<stage>:<role>" then "<stage>". Override any part of
+# the policy with a JSON file at MODEL_POLICY_PATH, e.g.
+#
+#     {"routes": {"generate:billing": "lite"}, "max_tier": "standard"}
+
+from contextlib import contextmanager
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MODEL_POLICY_PATH = os.getenv("MODEL_POLICY_PATH")
+
+DEFAULT_POLICY = {
+    "tiers": {
+        "lite": "gemini-2.0-flash-lite",
+        "standard": "gemini-2.0-flash",
+        "pro": "gemini-1.5-pro",
+    },
+    # Escalation order, cheapest first
+    "ladder": ["lite", "standard", "pro"],
+    "routes": {
+        "classify": "lite",
+        "classify_batch": "lite",
+        "context": "lite",
+        "generate": "standard",
+        "generate:other": "lite",
+        "fused": "standard",
+    },
+    "default_tier": "standard",
+    # Escalation never goes above this tier
+    "max_tier": "pro",
+    "escalation": {
+        # A message with at least this many words, or this many questions, starts one tier up
+        "complex_words": 80,
+        "complex_questions": 3,
+        # An answer shorter than this, or containing one of these phrases, is re-asked one tier up
+        "min_answer_chars": 40,
+        "weak_phrases": [
+            "i'm not sure",
+            "i am not sure",
+            "i don't know",
+            "i do not know",
+            "i cannot help",
+            "i can't help",
+            "as an ai",
+        ],
+    },
+}
+
+MODEL_SECONDS = metrics.Histogram(
+    "agent_model_seconds", "Latency of Gemini calls per model tier and stage", ("tier", "stage")
+)
+MODEL_COST = metrics.Counter(
+    "agent_model_cost_usd_total", "Gemini spend per model tier", ("tier",)
+)
+MODEL_ESCALATIONS = metrics.Counter(
+    "agent_model_escalations_total", "Calls moved to a larger model", ("from_tier", "to_tier", "reason")
+)
+
+
+def load_policy(path: str = MODEL_POLICY_PATH) -> dict:
+    """Default policy, with sections overridden from a JSON file if configured"""
+    policy = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_POLICY.items()}
+    if path:
+        with open(path) as f:
+            for key, value in json.load(f).items():
+                if isinstance(value, dict) and isinstance(policy.get(key), dict):
+                    policy[key].update(value)
+                else:
+                    policy[key] = value
+        logger.info(f"Loaded model policy overrides from {path}")
+    unknown = {tier for tier in policy["routes"].values() if tier not in policy["tiers"]}
+    if unknown or policy["max_tier"] not in policy["tiers"]:
+        raise ValueError(f"Model policy references unknown tiers: {sorted(unknown | {policy['max_tier']})}")
+    return policy
+
+
+class ModelRouter:
+    """Picks a model tier per call and keeps per-tier latency, cost and escalation counts"""
+    def __init__(self, policy: dict):
+        self.policy = policy
+        self.tiers = policy["tiers"]
+        self.ladder = [tier for tier in policy["ladder"] if tier in self.tiers]
+        self.routes = policy["routes"]
+        escalation = policy["escalation"]
+        self.complex_words = escalation["complex_words"]
+        self.complex_questions = escalation["complex_questions"]
+        self.min_answer_chars = escalation["min_answer_chars"]
+        self.weak_phrases = [phrase.lower() for phrase in escalation["weak_phrases"]]
+        max_tier = policy["max_tier"]
+        self.max_rank = self.ladder.index(max_tier) if max_tier in self.ladder else len(self.ladder) - 1
+        self._lock = threading.Lock()
+        # skipped: messages routed to a tier but escalated before it was called
+        self._stats = {
+            tier: {"calls": 0, "skipped": 0, "errors": 0, "cancelled": 0, "escalations": 0, "seconds": 0.0, "cost": 0.0}
+            for tier in self.tiers
+        }
+
+    def route(self, stage: str, role: str = None) -> str:
+        """Returns: the configured tier for stage (and agent role, if given)"""
+        if role is not None and f"{stage}:{role}" in self.routes:
+            return self.routes[f"{stage}:{role}"]
+        return self.routes.get(stage, self.policy["default_tier"])
+
+    def model_name(self, tier: str) -> str:
+        return self.tiers[tier]
+
+    def next_tier(self, tier: str):
+        """Returns: the tier above tier on the ladder, or None at the top (or at max_tier)"""
+        if tier not in self.ladder:
+            return None
+        rank = self.ladder.index(tier) + 1
+        return self.ladder[rank] if rank <= self.max_rank else None
+
+    def is_complex(self, message: str) -> bool:
+        return (len(message.split()) >= self.complex_words
+                or message.count("?") >= self.complex_questions)
+
+    def choose(self, stage: str, role: str = None, message: str = None) -> str:
+        """
+        Tier for a call, one step up from the route when message looks complex.
+        Returns: tier name
+        """
+        tier = self.route(stage, role)
+        if message and self.is_complex(message):
+            target = self.escalate(tier, "complex_message")
+            if target is not None:
+                with self._lock:
+                    self._stats[tier]["skipped"] += 1
+                return target
+        return tier
+
+    def answer_problem(self, text: str):
+        """
+        Returns: why an answer looks too weak to send ("short_answer",
+        "weak_answer"), or None if it looks fine
+        """
+        if len(text.strip()) < self.min_answer_chars:
+            return "short_answer"
+        lowered = text.lower()
+        if any(phrase in lowered for phrase in self.weak_phrases):
+            return "weak_answer"
+        return None
+
+    def escalate(self, tier: str, reason: str):
+        """
+        Count a move from tier to the next one up.
+        Returns: the next tier, or None if tier is already the highest allowed
+        """
+        target = self.next_tier(tier)
+        if target is None:
+            return None
+        MODEL_ESCALATIONS.inc(from_tier=tier, to_tier=target, reason=reason)
+        with self._lock:
+            self._stats[tier]["escalations"] += 1
+        logger.info(f"Escalating from {tier} to {target}: {reason}")
+        return target
+
+    @contextmanager
+    def timed(self, tier: str, stage: str):
+        """
+        Time one call on tier, counting it as an error if it raises.
+        Calls we cancel are counted separately and left out of calls and latency.
+        """
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if outcome != "cancelled":
+                MODEL_SECONDS.observe(elapsed, tier=tier, stage=stage)
+            with self._lock:
+                stats = self._stats[tier]
+                if outcome == "cancelled":
+                    stats["cancelled"] += 1
+                else:
+                    stats["calls"] += 1
+                    stats["errors"] += outcome == "error"
+                    stats["seconds"] += elapsed
+
+    def record_cost(self, tier: str, cost: float):
+        MODEL_COST.inc(cost, tier=tier)
+        with self._lock:
+            self._stats[tier]["cost"] += cost
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                tier: {
+                    "model": self.tiers[tier],
+                    "calls": s["calls"],
+                    "errors": s["errors"],
+                    "cancelled": s["cancelled"],
+                    "escalations": s["escalations"],
+                    "escalation_rate": (round(s["escalations"] / (s["calls"] + s["skipped"]), 4)
+                                        if s["calls"] + s["skipped"] else 0.0),
+                    "avg_ms": round(s["seconds"] / s["calls"] * 1000, 1) if s["calls"] else 0.0,
+                    "cost": round(s["cost"], 6),
+                }
+                for tier, s in self._stats.items()
+            }
+
+
+model_router = ModelRouter(load_policy())
@@ -0,0 +1,228 @@
+# pipeline.py
+# Request-scoped chat pipeline: intent -> context -> agent response
+
+from services import classify_intent_with_source_async, get_context_from_perplexity_async, FALLBACK_CONTEXT
+from sessions import session_store
+from deadline import within, for_endpoint, DeadlineExceeded, DEADLINE_GENERATE_RESERVE_S
+from datetime import datetime
+import metering
+import metrics
+import limits
+import asyncio
+import time
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Per-branch caps for the classify/context fan-out (within the request deadline)
+CLASSIFY_TIMEOUT_S = float(os.getenv("CLASSIFY_TIMEOUT_S", "5"))
+CONTEXT_TIMEOUT_S = float(os.getenv("CONTEXT_TIMEOUT_S", "4"))
+
+
+class ChatPipeline:
+    """
+    Carries one customer message through classification, context retrieval
+    and agent response. Each stage runs at most once per request; later
+    consumers (AgentRouter, /voice, the interaction log) reuse its result.
+    """
+    def __init__(self, customer_message: str, customer_id: str = "demo_customer", endpoint: str = "chat",
+                 session=None):
+        self.customer_message = customer_message
+        self.customer_id = customer_id
+        # Upstream usage for this request; services.py records into it
+        self.meter = metering.start_request(endpoint, customer_id)
+        # Per-stage latency for this request (ms); services.py records into it
+        self.timings = metrics.start_request()
+        self.endpoint = endpoint
+        self._started = time.perf_counter()
+        # Time budget for the whole request (None if this endpoint has none)
+        self.deadline = for_endpoint(endpoint)
+        # Upstream calls queue at this endpoint's priority
+        limits.set_priority(endpoint)
+        self.intent = None
+        # Where the intent came from: local, gemini, session, fused, batch or fallback
+        self.intent_source = None
+        self.context = None
+        self.agent_name = None
+        self.response = None
+        self.cache_hit = False
+        # Batch ticket answered by another ticket's run: logged, but its cost is counted there
+        self.deduplicated = False
+        self._context_task = None
+        self._streamed = []
+        # Streamed response cut short; logged, not remembered
+        self.partial = False
+        self._finished = False
+        # Conversation memory: prior turns for the prompt, and sticky routing for follow-ups
+        self.session = session
+        self.history = session.history() if session is not None else ""
+        self.sticky = False
+        if session is not None:
+            self.intent = session_store.follow_up_intent(session, customer_message)
+            if self.intent is not None:
+                self.sticky = True
+                self.intent_source = "session"
+                self.context = session.context
+
+    async def classify(self) -> str:
+        """Stage 1: classify intent (cached after the first call)"""
+        if self.intent is None:
+            try:
+                self.intent, self.intent_source = await within(
+                    self.deadline, "classify", classify_intent_with_source_async(self.customer_message),
+                    cap=CLASSIFY_TIMEOUT_S, reserve=DEADLINE_GENERATE_RESERVE_S,
+                )
+            except DeadlineExceeded:
+                logger.warning("Intent classification ran out of time, defaulting to 'other'")
+                metrics.FALLBACKS.inc(stage="classify", fallback="timeout")
+                self.intent, self.intent_source = "other", "fallback"
+            logger.info(f"Classified as: {self.intent}")
+        return self.intent
+
+    async def _fetch_context(self) -> str:
+        try:
+            context = await within(
+                self.deadline, "context", get_context_from_perplexity_async(self.customer_message),
+                cap=CONTEXT_TIMEOUT_S, reserve=DEADLINE_GENERATE_RESERVE_S,
+            )
+        except DeadlineExceeded:
+            logger.warning("Context retrieval ran out of time, using fallback context")
+            metrics.FALLBACKS.inc(stage="context", fallback="timeout")
+            context = FALLBACK_CONTEXT
+        logger.info(f"Context retrieved: {context[:50]}...")
+        return context
+
+    def bind(self):
+        """
+        Re-activate this request's meter, timings and priority in another
+        context (e.g. inside a streaming response generator)
+        """
+        metering.bind(self.meter)
+        metrics.bind(self.timings)
+        limits.set_priority(self.endpoint)
+
+    def start_context(self):
+        """Start context retrieval in the background without waiting for it"""
+        if self.context is None and self._context_task is None:
+            self._context_task = asyncio.ensure_future(self._fetch_context())
+
+    async def retrieve_context(self) -> str:
+        """
+        Stage 2: retrieve context (cached after the first call). Shielded, so
+        a cancelled caller (e.g. a discarded speculative generation) doesn't
+        cancel the retrieval the other callers are waiting on.
+        """
+        if self.context is None:
+            self.start_context()
+            self.context = await asyncio.shield(self._context_task)
+        return self.context
+
+    def cancel_context(self):
+        """Abandon context retrieval still in flight (it can be restarted later)"""
+        if self._context_task is not None and not self._context_task.done():
+            self._context_task.cancel()
+            self._context_task = None
+
+    def use_cached(self, cached: dict):
+        """
+        Adopt a cached response: skip the remaining stages and cancel any
+        context retrieval still in flight.
+        """
+        self.cancel_context()
+        if self.context is None:
+            self.context = cached["context"]
+        self.cache_hit = True
+
+    async def respond(self, router) -> str:
+        """Stage 3: route to an agent and generate the response (cached after the first call)"""
+        if self.response is None:
+            self.agent_name, self.response = await router.route(self)
+            logger.info(f"Generated response from {self.agent_name}")
+        return self.response
+
+    async def stream_response(self, router):
+        """
+        Stage 3, streaming: classify, pick an agent, then return an async
+        iterator of response chunks. self.response holds the assembled text
+        once the iterator is exhausted.
+        """
+        self.start_context()
+        try:
+            self.agent_name, tokens = await router.route_stream(self)
+        except BaseException:
+            self.cancel_context()
+            raise
+
+        self._streamed = []
+
+        async def assemble():
+            async for token in tokens:
+                self._streamed.append(token)
+                yield token
+            self.response = "".join(self._streamed)
+            logger.info(f"Streamed response from {self.agent_name}")
+
+        return assemble()
+
+    def stream_stopped(self):
+        """
+        The stream ended early (upstream error or client gone): keep what
+        was sent as the response, for the log but not the session.
+        """
+        if self.response is None:
+            self.partial = True
+            self.response = "".join(self._streamed)
+            logger.warning(f"Stream from {self.agent_name} stopped after {len(self.response)} characters")
+
+    async def run(self, router) -> "ChatPipeline":
+        """
+        Run every stage once. Context retrieval starts in the background while
+        the router classifies, so a response-cache hit (or a shed request)
+        can cancel it.
+        """
+        self.start_context()
+        try:
+            await self.respond(router)
+        except BaseException:
+            self.cancel_context()
+            raise
+        return self
+
+    def remember(self):
+        """Add this exchange to the customer's session (no-op without one, or for a partial response)"""
+        if self.session is not None and self.response is not None and not self.partial:
+            session_store.record(
+                self.session, self.customer_message, self.intent, self.agent_name,
+                self.response, None if self.context == FALLBACK_CONTEXT else self.context,
+            )
+
+    def finish(self) -> float:
+        """
+        Close the request's meter and roll it into the cost aggregates, and
+        record its end-to-end latency (only the first call counts).
+        Returns: total upstream cost in USD
+        """
+        if not self._finished:
+            self._finished = True
+            metering.finish_request(self.meter, self.intent)
+            elapsed = time.perf_counter() - self._started
+            self.timings["total"] = round(elapsed * 1000, 2)
+            metrics.REQUEST_SECONDS.observe(elapsed, endpoint=self.endpoint)
+        return self.meter.cost
+
+    def to_log_entry(self) -> dict:
+        """Build the interaction log entry from the stage results"""
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "customer_id": self.customer_id,
+            "customer_message": self.customer_message,
+            "agent_type": self.intent,
+            "intent_source": self.intent_source,
+            "response": self.response,
+            "context": (self.context or "")[:200],
+            "cache_hit": self.cache_hit,
+            "sticky_route": self.sticky,
+            "cost": 0.0 if self.deduplicated else round(self.meter.cost, 6),
+            "timings_ms": dict(self.timings),
+        }
@@ -0,0 +1,267 @@
+# prompts.py
+# Prompt registry: per-role response templates compiled once, with token budgets
+#
+# Each agent role gets a RoleTemplate at import time: the static system prompt,
+# its token count and the fixed framing are built once, so a request only fills
+# in context, history and the customer message. Context and history are trimmed
+# to PROMPT_CONTEXT_TOKENS / PROMPT_HISTORY_TOKENS, then the whole prompt to
+# PROMPT_MAX_TOKENS (history goes first, the customer message is never cut).
+# A budget of 0 disables that limit.
+#
+# The fused prompt (FUSED_MODE in services.py) carries all four role prompts
+# and asks for the intent, a context summary and the chosen agent's response
+# as one JSON object, within the same budgets.
+
+import logging
+import os
+import threading
+import metering
+
+logger = logging.getLogger(__name__)
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1200"))
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "250"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "300"))
+# Same ratio as metering.estimate_tokens, used to turn a token budget into characters
+CHARS_PER_TOKEN = 4
+
+ROLE_PROMPTS = {
+    "billing": """You are a T-Mobile billing support agent. Your role is to help customers understand their charges and billing issues.
+
+Requirements:
+- Be helpful, professional, and concise
+- Explain charges clearly and in plain language
+- Offer solutions to billing problems
+- Provide information about payment options
+- Handle billing disputes professionally
+- Suggest cost-saving options when relevant
+- Break down complex charges into understandable components
+- Proactively offer payment plans if customer has concerns about high bills
+- Provide credit or refund information when applicable
+- Always be empathetic to billing concerns""",
+
+    "sales": """You are a T-Mobile sales agent. Your role is to help customers understand plans, find the best options for their needs, and close sales.
+
+Requirements:
+- Help customers understand plan features and benefits in simple terms
+- Be persuasive but honest about offerings and limitations
+- Ask qualifying questions to understand customer needs (usage, budget, location)
+- Recommend the best plan based on their specific use case
+- Explain add-on services and current promotions
+- Address objections professionally and confidently
+- Focus on customer value proposition, not just features
+- Highlight 5G capabilities, coverage, and speed advantages
+- Offer bundle deals and limited-time promotions
+- Provide clear pricing and contract terms
+- Create urgency with time-limited offers when appropriate
+- Always prioritize customer satisfaction over quick sales""",
+
+    "technical_support": """You are a T-Mobile technical support agent. Your role is to help customers troubleshoot network, device, and service issues.
+
+Requirements:
+- Start by clarifying the problem and asking targeted follow-up questions
+- Provide clear, numbered step-by-step troubleshooting instructions
+- Use simple language while explaining technical concepts
+- Cover basics first: restart device, check airplane mode, check Wi‑Fi vs cellular, check SIM
+- Instruct how to check signal bars and network status on common devices
+- Suggest checking coverage or outage information when relevant
+- Help with common issues: dropped calls, slow data, no service, voicemail, SMS/MMS
+- Offer device-specific tips when the customer mentions iPhone/Android/other
+- Only suggest advanced settings (APN, network reset) after basic steps fail
+- Explain when an issue is likely on the network vs the device vs the account
+- Tell the customer what to try next if the first steps do not work
+- Recommend escalation to in‑store support or phone support for hardware damage or SIM replacement
+- Remain calm, patient, and empathetic to customer frustration""",
+
+    "other": "You are a T-Mobile customer service agent. Help the customer efficiently and professionally.",
+}
+
+RESPONSE_INSTRUCTION = "Provide a helpful, professional response with clear steps."
+FUSED_INSTRUCTION = (
+    "Reply with ONLY a JSON object with these keys:\n"
+    '"intent": the primary intent of the customer message, ONE of: {intents}\n'
+    '"context_summary": 2-3 sentences of facts relevant to the message, including technical, '
+    "device or network details if applicable\n"
+    f'"response": the reply to the customer from that intent\'s agent. {RESPONSE_INSTRUCTION}'
+)
+# Fixed labels around the variable parts, counted once for budgeting
+_FRAME_TOKENS = metering.estimate_tokens(
+    f"Customer context: \n\nConversation so far:\n\n\nCustomer message: \n\n{RESPONSE_INSTRUCTION}"
+)
+
+
+def fused_schema(intents: list) -> dict:
+    """Returns: JSON schema of the fused reply, for SDKs with structured output"""
+    return {
+        "type": "object",
+        "properties": {
+            "intent": {"type": "string", "enum": list(intents)},
+            "context_summary": {"type": "string"},
+            "response": {"type": "string"},
+        },
+        "required": ["intent", "context_summary", "response"],
+    }
+
+
+def _trim_head(text: str, max_tokens: int) -> str:
+    """Keep the start of text within max_tokens, ending on a sentence or word boundary"""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if not max_tokens or len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = cut.rfind(". ")
+    if end < limit // 2:
+        end = cut.rfind(" ")
+    return cut[:end + 1].rstrip() if end > 0 else cut
+
+
+def _trim_tail(text: str, max_tokens: int) -> str:
+    """Keep the end of text within max_tokens, dropping the oldest lines first"""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if not max_tokens or len(text) <= limit:
+        return text
+    lines = text.split("\n")
+    while lines and len("\n".join(lines)) > limit:
+        if len(lines) == 1:
+            # A single long line: keep its end, starting on a word boundary
+            return lines[0][-limit:].split(" ", 1)[-1] if limit else ""
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class RoleTemplate:
+    """Static parts of one role's response prompt, built once"""
+    __slots__ = ("role", "system", "system_tokens", "prefix")
+
+    def __init__(self, role: str, system: str):
+        self.role = role
+        self.system = system
+        self.system_tokens = metering.estimate_tokens(system)
+        self.prefix = f"{system}\n\n"
+
+    def render(self, customer_message: str, context: str, history: str = "",
+               include_system: bool = True) -> str:
+        conversation = f"Conversation so far:\n{history}\n\n" if history else ""
+        return (
+            f"{self.prefix if include_system else ''}"
+            f"Customer context: {context}\n\n"
+            f"{conversation}"
+            f"Customer message: {customer_message}\n\n"
+            f"{RESPONSE_INSTRUCTION}"
+        )
+
+
+class FusedTemplate:
+    """Static parts of the fused classify-and-respond prompt: every role's instructions, built once"""
+    __slots__ = ("intents", "system", "system_tokens", "prefix", "instruction", "frame_tokens")
+
+    def __init__(self, templates: dict):
+        self.intents = list(templates)
+        sections = "\n\n".join(f"### {role}\n{template.system}" for role, template in templates.items())
+        self.system = (
+            "You are the T-Mobile customer service assistant. Decide which of these agents the customer's "
+            f"message is for ({', '.join(self.intents)}), then answer as that agent, following its "
+            f"instructions.\n\n{sections}"
+        )
+        self.system_tokens = metering.estimate_tokens(self.system)
+        self.prefix = f"{self.system}\n\n"
+        self.instruction = FUSED_INSTRUCTION.format(intents=", ".join(self.intents))
+        self.frame_tokens = metering.estimate_tokens(
+            f"Customer context: \n\nConversation so far:\n\n\nCustomer message: \n\n{self.instruction}"
+        )
+
+    def render(self, customer_message: str, context: str = "", history: str = "",
+               include_system: bool = True) -> str:
+        grounding = f"Customer context: {context}\n\n" if context else ""
+        conversation = f"Conversation so far:\n{history}\n\n" if history else ""
+        return (
+            f"{self.prefix if include_system else ''}"
+            f"{grounding}"
+            f"{conversation}"
+            f"Customer message: {customer_message}\n\n"
+            f"{self.instruction}"
+        )
+
+
+class PromptRegistry:
+    """Role templates plus the token budgets applied when rendering them"""
+    def __init__(self, role_prompts: dict = None, max_tokens: int = PROMPT_MAX_TOKENS,
+                 context_tokens: int = PROMPT_CONTEXT_TOKENS, history_tokens: int = PROMPT_HISTORY_TOKENS):
+        self.templates = {role: RoleTemplate(role, text) for role, text in (role_prompts or ROLE_PROMPTS).items()}
+        self.fused = FusedTemplate(self.templates)
+        self.max_tokens = max_tokens
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self.renders = 0
+        self.trimmed = 0
+        self.tokens_trimmed = 0
+        self._lock = threading.Lock()
+
+    def template(self, role: str) -> RoleTemplate:
+        return self.templates.get(role) or self.templates["other"]
+
+    def render(self, role: str, customer_message: str, context: str, history: str = "",
+               include_system: bool = True) -> str:
+        """
+        Build the response prompt for role within the token budgets.
+        include_system: False when the role prompt is bound to the model as a system instruction
+        Returns: prompt text
+        """
+        template = self.template(role)
+        fixed = _FRAME_TOKENS + metering.estimate_tokens(customer_message)
+        fixed += template.system_tokens if include_system else 0
+        context, history = self._fit(context, history, fixed)
+        return template.render(customer_message, context, history, include_system)
+
+    def render_fused(self, customer_message: str, context: str = "", history: str = "",
+                     include_system: bool = True) -> str:
+        """
+        Build the fused classify-and-respond prompt within the token budgets.
+        context: grounding context if already known ("" to have the model summarize its own)
+        Returns: prompt text
+        """
+        fixed = self.fused.frame_tokens + metering.estimate_tokens(customer_message)
+        fixed += self.fused.system_tokens if include_system else 0
+        context, history = self._fit(context, history, fixed)
+        return self.fused.render(customer_message, context, history, include_system)
+
+    def _fit(self, context: str, history: str, fixed: int) -> tuple:
+        """
+        Trim context and history to their budgets, then to what the rest of
+        the prompt (fixed tokens) leaves of max_tokens.
+        Returns: (context, history)
+        """
+        before = metering.estimate_tokens(context) + metering.estimate_tokens(history)
+        context = _trim_head(context, self.context_tokens)
+        history = _trim_tail(history, self.history_tokens)
+
+        if self.max_tokens:
+            spare = max(0, self.max_tokens - fixed)
+            history_tokens = metering.estimate_tokens(history)
+            context_tokens = metering.estimate_tokens(context)
+            if history_tokens + context_tokens > spare:
+                # Older conversation goes before the grounding context
+                history = _trim_tail(history, max(0, spare - context_tokens)) if spare > context_tokens else ""
+                context = _trim_head(context, spare - metering.estimate_tokens(history)) if spare else ""
+
+        saved = before - metering.estimate_tokens(context) - metering.estimate_tokens(history)
+        with self._lock:
+            self.renders += 1
+            if saved > 0:
+                self.trimmed += 1
+                self.tokens_trimmed += saved
+        return context, history
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "roles": len(self.templates),
+                "renders": self.renders,
+                "trimmed": self.trimmed,
+                "tokens_trimmed": self.tokens_trimmed,
+                "max_tokens": self.max_tokens,
+            }
+
+
+# Shared registry, compiled when the module is first imported
+prompt_registry = PromptRegistry()
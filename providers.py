@@ -0,0 +1,226 @@
+# providers.py
+# Upstream clients created on first use: Gemini model, ElevenLabs client, Perplexity key
+#
+# Importing the Gemini SDK alone takes most of a second, so nothing here runs
+# at import time. Each provider is built once, under a lock, by the first
+# caller (or by warm_up() from the FastAPI startup hook), and .env is read
+# at that point rather than as a side effect of importing services.
+# Benchmarks and tests swap in stand-ins with override(); a stand-in then
+# serves every model name and role.
+
+import inspect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env():
+    """Read .env into the environment once (existing variables win)"""
+    global _env_loaded
+    if not _env_loaded:
+        with _env_lock:
+            if not _env_loaded:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _env_loaded = True
+
+
+class Provider:
+    """A client built by factory on first get(); factory may return None when unconfigured"""
+    def __init__(self, name: str, factory):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self.init_ms = None
+
+    def get(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    start = time.perf_counter()
+                    self._client = self._factory()
+                    self.init_ms = (time.perf_counter() - start) * 1000
+                    self._ready = True
+                    logger.info(f"Provider {self.name} initialized in {self.init_ms:.0f} ms")
+        return self._client
+
+    def override(self, client):
+        """Use client instead of building one (stubs, tests)"""
+        with self._lock:
+            self._client = client
+            self._ready = True
+
+    def reset(self):
+        """Forget the client so the next get() builds it again"""
+        with self._lock:
+            self._client = None
+            self._ready = False
+            self.init_ms = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+
+def _gemini_sdk():
+    import google.generativeai as genai
+    return genai
+
+
+def _create_gemini():
+    load_env()
+    genai = _gemini_sdk()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        logger.error("GEMINI_API_KEY not found in .env")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def _create_elevenlabs():
+    load_env()
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        return None
+    from elevenlabs.client import ElevenLabs
+    return ElevenLabs(api_key=api_key)
+
+
+def _perplexity_key():
+    load_env()
+    return os.getenv("PERPLEXITY_API_KEY")
+
+
+def _is_sdk_model(model) -> bool:
+    return type(model).__module__.startswith("google.generativeai")
+
+
+class ProviderRegistry:
+    """Named providers plus the per-model and per-role Gemini models derived from the base one"""
+    def __init__(self):
+        self.providers = {}
+        self._models = {}
+        self._role_models = {}
+        self._role_lock = threading.Lock()
+        self._system_instruction = None
+        self._structured_output = None
+
+    def register(self, name: str, factory) -> Provider:
+        self.providers[name] = Provider(name, factory)
+        return self.providers[name]
+
+    def get(self, name: str):
+        return self.providers[name].get()
+
+    def override(self, name: str, client):
+        self.providers[name].override(client)
+        with self._role_lock:
+            self._models.clear()
+            self._role_models.clear()
+
+    def model(self, model_name: str = GEMINI_MODEL_NAME):
+        """
+        Gemini model by name (see model_tiers.py), built once per name.
+        Returns: model; the base model itself for GEMINI_MODEL_NAME or when it
+        has been overridden with a stand-in
+        """
+        base = self.get("gemini")
+        if model_name == GEMINI_MODEL_NAME or not _is_sdk_model(base):
+            return base
+        with self._role_lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = _gemini_sdk().GenerativeModel(model_name)
+                self._models[model_name] = model
+        return model
+
+    def role_model(self, role: str, system: str, model_name: str = GEMINI_MODEL_NAME):
+        """
+        Gemini model with system as its system instruction, built once per role and model name.
+        Returns: model, or None when the SDK has no system instructions (0.3.x)
+        or the base model has been overridden with a stand-in
+        """
+        base = self.get("gemini")
+        if not _is_sdk_model(base):
+            return None
+        genai = _gemini_sdk()
+        if self._system_instruction is None:
+            self._system_instruction = (
+                "system_instruction" in inspect.signature(genai.GenerativeModel.__init__).parameters
+            )
+        if not self._system_instruction:
+            return None
+        with self._role_lock:
+            model = self._role_models.get((model_name, role))
+            if model is None:
+                model = genai.GenerativeModel(model_name, system_instruction=system)
+                self._role_models[(model_name, role)] = model
+        return model
+
+    def json_model(self, name: str, schema: dict, system: str, model_name: str = GEMINI_MODEL_NAME):
+        """
+        Gemini model that replies with JSON matching schema, with system as its
+        system instruction, built once per name and model name.
+        Returns: model, or None when the SDK has no structured output (0.3.x)
+        or the base model has been overridden with a stand-in
+        """
+        base = self.get("gemini")
+        if not _is_sdk_model(base):
+            return None
+        genai = _gemini_sdk()
+        if self._structured_output is None:
+            self._structured_output = (
+                "response_schema" in inspect.signature(genai.types.GenerationConfig).parameters
+                and "system_instruction" in inspect.signature(genai.GenerativeModel.__init__).parameters
+            )
+        if not self._structured_output:
+            return None
+        with self._role_lock:
+            model = self._role_models.get((model_name, name))
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name, system_instruction=system,
+                    generation_config=genai.types.GenerationConfig(
+                        response_mime_type="application/json", response_schema=schema,
+                    ),
+                )
+                self._role_models[(model_name, name)] = model
+        return model
+
+    def warm_up(self, names: list = None) -> dict:
+        """
+        Build providers ahead of the first request.
+        Returns: {name: init_ms} for the providers built
+        """
+        built = {}
+        for name in names or self.providers:
+            provider = self.providers[name]
+            if not provider.ready:
+                try:
+                    provider.get()
+                    built[name] = provider.init_ms
+                except Exception as e:
+                    logger.warning(f"Warm-up of {name} failed: {e}")
+        return built
+
+    def stats(self) -> dict:
+        return {
+            name: {"ready": provider.ready, "init_ms": provider.init_ms}
+            for name, provider in self.providers.items()
+        }
+
+
+registry = ProviderRegistry()
+registry.register("gemini", _create_gemini)
+registry.register("elevenlabs", _create_elevenlabs)
+registry.register("perplexity", _perplexity_key)
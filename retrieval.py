@@ -0,0 +1,362 @@
+# retrieval.py
+# Local knowledge-base retrieval: BM25 over passages, with optional memory-mapped embedding vectors
+#
+# Sits in front of the Perplexity context lookup. Passages come from the
+# Markdown files in knowledge_base/ (one passage per "## " section); when the
+# best match covers enough of the query, its text is the context and no
+# upstream call is made.
+#
+# Off unless KB_ENABLED=1: the bundled knowledge_base/ is sample content, not
+# real policy, and must not answer customers until it is replaced.
+#
+# Build (or incrementally refresh) the on-disk index:
+#     python retrieval.py build --embeddings
+#     python retrieval.py query "why is my bill higher this month"
+
+from cache import hashed_embedding, EMBEDDING_DIM
+import numpy as np
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+KB_ENABLED = os.getenv("KB_ENABLED", "0") == "1"
+KB_CORPUS_DIR = os.getenv("KB_CORPUS_DIR", "knowledge_base")
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", "kb_index")
+# Idf-weighted share of the query the best passage must cover to skip Perplexity
+KB_MIN_CONFIDENCE = float(os.getenv("KB_MIN_CONFIDENCE", "0.5"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "2"))
+KB_CONTEXT_CHARS = int(os.getenv("KB_CONTEXT_CHARS", "700"))
+# Build embeddings when indexing in memory (the build CLI takes --embeddings)
+KB_EMBEDDINGS = os.getenv("KB_EMBEDDINGS", "0") == "1"
+KB_EMBEDDING_WEIGHT = float(os.getenv("KB_EMBEDDING_WEIGHT", "0.3"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Section headings name the topic, so their terms count extra
+TITLE_WEIGHT = 3
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SECTION_RE = re.compile(r"^## +(.+)$", re.MULTILINE)
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from get has have how i if in is it its "
+    "me my no not of on or so that the their there this to up was what when where which "
+    "who why will with you your im ive dont doesnt didnt cant wont isnt "
+    "t s m ll ve re d don doesn didn won isn".split()
+)
+
+
+def _stem(word: str) -> str:
+    """Crude suffix stripping so "dropped", "dropping" and "drops" share a term"""
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    for suffix in ("ing", "ed", "er", "s"):
+        if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3 + (suffix == "er"):
+            word = word[:-len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+                word = word[:-1]
+            return word
+    return word
+
+
+def tokenize(text: str) -> list:
+    return [_stem(token) for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _slug(text: str) -> str:
+    return "-".join(_TOKEN_RE.findall(text.lower()))
+
+
+def chunk_markdown(name: str, text: str) -> list:
+    """
+    Split one Markdown file into passages, one per "## " section.
+    Returns: list of {"id", "file", "title", "text", "terms"}
+    """
+    passages = []
+    sections = _SECTION_RE.split(text)
+    # sections = [preamble, heading, body, heading, body, ...]
+    for heading, body in zip(sections[1::2], sections[2::2]):
+        body = " ".join(body.split())
+        if not body:
+            continue
+        terms = {}
+        for term in tokenize(heading):
+            terms[term] = terms.get(term, 0) + TITLE_WEIGHT
+        for term in tokenize(body):
+            terms[term] = terms.get(term, 0) + 1
+        passages.append({
+            "id": f"{name}#{_slug(heading)}",
+            "file": name,
+            "title": heading.strip(),
+            "text": body,
+            "terms": terms,
+        })
+    return passages
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class KnowledgeIndex:
+    """
+    BM25 index over knowledge-base passages, optionally blended with cosine
+    similarity of hashed n-gram embeddings. Embeddings are stored in a .npy
+    file and memory-mapped on load, so only the pages a query touches are read.
+    """
+    def __init__(self, min_confidence: float = KB_MIN_CONFIDENCE,
+                 embedding_weight: float = KB_EMBEDDING_WEIGHT):
+        self.min_confidence = min_confidence
+        self.embedding_weight = embedding_weight
+        self.passages = []
+        self.files = {}
+        self.embeddings = None
+        self._postings = {}
+        self._idf = {}
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._avg_len = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"local_hits": 0, "escalations": 0}
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.passages)
+
+    def _finalize(self):
+        """Rebuild the postings and BM25 statistics from self.passages"""
+        postings = {}
+        for doc, passage in enumerate(self.passages):
+            for term, tf in passage["terms"].items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc)
+                postings[term][1].append(tf)
+        n = len(self.passages)
+        self._postings = {
+            term: (np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.float32))
+            for term, (docs, tfs) in postings.items()
+        }
+        self._idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in self._postings.items()
+        }
+        self._doc_len = np.array([sum(p["terms"].values()) for p in self.passages], dtype=np.float32)
+        self._avg_len = float(self._doc_len.mean()) if n else 0.0
+
+    def build(self, corpus_dir: str = KB_CORPUS_DIR, previous: "KnowledgeIndex" = None,
+              embeddings: bool = False) -> dict:
+        """
+        Index every *.md file in corpus_dir. With `previous`, files whose
+        content is unchanged keep their passages and embedding rows; only new
+        or edited files are re-chunked and re-embedded.
+        Returns: {"files", "reused", "reindexed", "removed", "passages"}
+        """
+        names = sorted(name for name in os.listdir(corpus_dir) if name.endswith(".md"))
+        previous_rows = {}
+        if previous is not None:
+            for row, passage in enumerate(previous.passages):
+                previous_rows.setdefault(passage["file"], []).append(row)
+
+        passages, rows, files = [], [], {}
+        reused = reindexed = 0
+        for name in names:
+            stem = name[:-3]
+            digest = _file_digest(os.path.join(corpus_dir, name))
+            files[stem] = digest
+            if previous is not None and previous.files.get(stem) == digest:
+                for row in previous_rows.get(stem, []):
+                    passages.append(previous.passages[row])
+                    rows.append(row)
+                reused += 1
+            else:
+                with open(os.path.join(corpus_dir, name)) as f:
+                    new = chunk_markdown(stem, f.read())
+                passages.extend(new)
+                rows.extend([None] * len(new))
+                reindexed += 1
+
+        vectors = None
+        if embeddings:
+            reuse = previous is not None and previous.embeddings is not None
+            vectors = np.stack([
+                np.asarray(previous.embeddings[row]) if reuse and row is not None
+                else hashed_embedding(f"{passage['title']} {passage['text']}")
+                for passage, row in zip(passages, rows)
+            ]).astype(np.float32) if passages else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+        with self._lock:
+            self.passages, self.files, self.embeddings = passages, files, vectors
+            self._finalize()
+        summary = {
+            "files": len(names),
+            "reused": reused,
+            "reindexed": reindexed,
+            "removed": len(set(previous.files) - set(files)) if previous is not None else 0,
+            "passages": len(passages),
+        }
+        logger.info(f"Built knowledge index from {corpus_dir}: {summary}")
+        return summary
+
+    def save(self, index_dir: str = KB_INDEX_DIR):
+        """Write index.json (and embeddings.npy) atomically"""
+        os.makedirs(index_dir, exist_ok=True)
+        meta = {"version": INDEX_VERSION, "files": self.files, "passages": self.passages,
+                "embeddings": self.embeddings is not None}
+        tmp = os.path.join(index_dir, "index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        if self.embeddings is not None:
+            tmp_vectors = os.path.join(index_dir, "embeddings.tmp.npy")
+            np.save(tmp_vectors, np.asarray(self.embeddings, dtype=np.float32))
+            os.replace(tmp_vectors, os.path.join(index_dir, "embeddings.npy"))
+        os.replace(tmp, os.path.join(index_dir, "index.json"))
+        logger.info(f"Saved knowledge index to {index_dir}")
+
+    def load(self, index_dir: str = KB_INDEX_DIR) -> bool:
+        """Load a built index if one exists; embeddings are memory-mapped"""
+        path = os.path.join(index_dir, "index.json")
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            logger.warning(f"Knowledge index {index_dir} has version {meta.get('version')}, ignoring it")
+            return False
+        vectors = None
+        if meta["embeddings"]:
+            vectors = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        with self._lock:
+            self.passages, self.files, self.embeddings = meta["passages"], meta["files"], vectors
+            self._finalize()
+        logger.info(f"Loaded knowledge index from {index_dir} ({len(self.passages)} passages)")
+        return True
+
+    def search(self, query: str, top_k: int = KB_TOP_K) -> tuple:
+        """
+        Rank passages for a query.
+        Returns: (hits, confidence) where hits are passages with a "score"
+        and confidence is in [0, 1]
+        """
+        terms = set(tokenize(query))
+        if not self.passages or not terms:
+            return [], 0.0
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            norm = tfs + BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[docs] / self._avg_len)
+            scores[docs] += self._idf[term] * tfs * (BM25_K1 + 1) / norm
+        if not scores.any():
+            return [], 0.0
+
+        similarity = None
+        ranking = scores / scores.max()
+        if self.embeddings is not None:
+            similarity = np.asarray(self.embeddings @ hashed_embedding(query))
+            ranking = (1 - self.embedding_weight) * ranking + self.embedding_weight * similarity
+        order = np.argsort(-ranking)[:top_k]
+
+        # Confidence: how much of the query (by idf) the best passage contains
+        best = self.passages[order[0]]
+        unknown_idf = max(self._idf.values())
+        total = sum(self._idf.get(term, unknown_idf) for term in terms)
+        confidence = sum(self._idf[term] for term in terms if term in best["terms"]) / total
+        if similarity is not None:
+            confidence = (1 - self.embedding_weight) * confidence + self.embedding_weight * float(similarity[order[0]])
+
+        hits = [{**self.passages[doc], "score": round(float(ranking[doc]), 4)} for doc in order]
+        return hits, round(confidence, 4)
+
+    def retrieve(self, query: str):
+        """
+        Context for a customer query from the local knowledge base.
+        Returns: context text, or None if retrieval is not confident enough
+        (or the knowledge base is off)
+        """
+        if not self.ready:
+            return None
+        hits, confidence = self.search(query)
+        with self._lock:
+            if not hits or confidence < self.min_confidence:
+                self.counters["escalations"] += 1
+                return None
+            self.counters["local_hits"] += 1
+        # Second and later passages only if they score close to the best one
+        best = hits[0]["score"]
+        passages = [f"{hit['title']}: {hit['text']}" for hit in hits if hit["score"] >= 0.5 * best]
+        return " ".join(passages)[:KB_CONTEXT_CHARS]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["local_hits"] + counters["escalations"]
+        return {
+            **counters,
+            "enabled": self.ready,
+            "passages": len(self.passages),
+            "embeddings": self.embeddings is not None,
+            "min_confidence": self.min_confidence,
+            "hit_rate": round(counters["local_hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+def load_knowledge_base(index_dir: str = KB_INDEX_DIR, corpus_dir: str = KB_CORPUS_DIR,
+                        enabled: bool = KB_ENABLED) -> KnowledgeIndex:
+    """
+    Load the built index, or index the corpus in memory if none has been built.
+    Returns: the index (empty, so every lookup goes upstream, when not enabled)
+    """
+    index = KnowledgeIndex()
+    if not enabled:
+        logger.info("Local knowledge base is off (KB_ENABLED=0)")
+        return index
+    if not index.load(index_dir) and os.path.isdir(corpus_dir):
+        index.build(corpus_dir, embeddings=KB_EMBEDDINGS)
+    return index
+
+
+# Shared instance used by services.get_context_from_perplexity
+knowledge_base = load_knowledge_base()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local knowledge-base index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="index the corpus (incrementally if an index exists)")
+    build.add_argument("--corpus", default=KB_CORPUS_DIR)
+    build.add_argument("--index", default=KB_INDEX_DIR)
+    build.add_argument("--embeddings", action="store_true", help="also store embedding vectors")
+    build.add_argument("--full", action="store_true", help="ignore the existing index and rebuild everything")
+    query = subparsers.add_parser("query", help="show the best passages for a query")
+    query.add_argument("text")
+    query.add_argument("--index", default=KB_INDEX_DIR)
+    query.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        previous = None
+        if not args.full:
+            previous = KnowledgeIndex()
+            if not previous.load(args.index):
+                previous = None
+        index = KnowledgeIndex()
+        summary = index.build(args.corpus, previous=previous, embeddings=args.embeddings)
+        index.save(args.index)
+        print(f"Indexed {summary['passages']} passages from {summary['files']} files "
+              f"({summary['reindexed']} re-indexed, {summary['reused']} unchanged, "
+              f"{summary['removed']} removed) -> {args.index}")
+    else:
+        index = load_knowledge_base(args.index, enabled=True)
+        hits, confidence = index.search(args.text, args.top_k)
+        print(f"confidence {confidence} (threshold {index.min_confidence})")
+        for hit in hits:
+            print(f"  {hit['score']:.3f}  {hit['id']}: {hit['text'][:100]}...")
@@ -1,15 +1,24 @@
 # services.py
 # LLM Integrations: Gemini, Perplexity, ElevenLabs
 
-import google.generativeai as genai
-import requests
+from intent_classifier import fast_classifier
+from cache import context_cache
+from retrieval import knowledge_base
+from prompts import prompt_registry, fused_schema
+from http_client import UpstreamClient
+from providers import registry as providers
+from model_tiers import model_router
+from deadline import hedger, within, DeadlineExceeded
+from audio_cache import audio_cache
+import metering
+import metrics
+import limits
+import asyncio
+import json
 import os
-from dotenv import load_dotenv
+import sqlite3
 import logging
 
-# Load environment variables
-load_dotenv()
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -17,187 +26,727 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
-    logger.error("GEMINI_API_KEY not found in .env")
-genai.configure(api_key=gemini_api_key)
-gemini_model = genai.GenerativeModel("gemini-2.0-flash")
+# The Gemini models, ElevenLabs client and Perplexity key come from the provider
+# registry, built on first use (or at startup by main.py's warm-up). Which
+# Gemini model serves each call is decided by model_tiers.model_router.
+PERPLEXITY_API_URL = os.getenv(
+    "PERPLEXITY_API_URL", "https://api.perplexity.ai/openai/v1/chat/completions"
+)
+
+VALID_INTENTS = ["billing", "sales", "technical_support", "other"]
+FALLBACK_CONTEXT = "Unable to retrieve context."
+FALLBACK_RESPONSE = "I apologize, I'm unable to process that request right now. Please try again later."
+
+# Fused mode: one Gemini call classifies, summarizes context and answers
+# (classify_and_respond_async) for messages the local tiers can't classify
+FUSED_MODE = os.getenv("FUSED_MODE", "0") == "1"
+
+# Messages per multi-item classification prompt in batch triage
+BATCH_CLASSIFY_SIZE = int(os.getenv("BATCH_CLASSIFY_SIZE", "50"))
+
+# ElevenLabs voice settings
+ELEVENLABS_VOICE = os.getenv("ELEVENLABS_VOICE", "Rachel")
+ELEVENLABS_MODEL = os.getenv("ELEVENLABS_MODEL", "eleven_monolingual_v1")
+
+# Shared keep-alive connection pool (timeouts, retries, circuit breaker) for Perplexity
+perplexity_client = UpstreamClient("perplexity")
+
+
+async def close_http_clients():
+    """Close pooled upstream connections for the running event loop"""
+    await perplexity_client.aclose()
+
+
+def _meter_gemini(tier: str, stage: str, prompt: str, response=None, output_text: str = None):
+    """Record a Gemini call on tier, using reported token counts when the SDK provides them"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        input_tokens, output_tokens = usage.prompt_token_count, usage.candidates_token_count
+    else:
+        text = output_text if output_text is not None else response.text
+        input_tokens, output_tokens = metering.estimate_tokens(prompt), metering.estimate_tokens(text)
+    cost = metering.record("gemini", model_router.model_name(tier), input_tokens, output_tokens, stage=stage)
+    model_router.record_cost(tier, cost)
+
+
+def _meter_perplexity(query: str, result: dict, context: str):
+    usage = result.get("usage") or {}
+    metering.record(
+        "perplexity", "sonar",
+        usage.get("prompt_tokens") or metering.estimate_tokens(_perplexity_prompt(query)),
+        usage.get("completion_tokens") or metering.estimate_tokens(context),
+        stage="context",
+    )
+
+
+async def _gemini_async(tier: str, stage: str, prompt: str, model=None):
+    """
+    One async Gemini call on tier, hedged with a duplicate when it runs past
+    the recent p95 for this stage and tier (see deadline.py).
+    model: model to call (default: the tier's model)
+    Returns: the Gemini response
+    """
+    model = model or providers.model(model_router.model_name(tier))
+
+    async def attempt():
+        async with limits.slot("gemini"):
+            with metrics.upstream("gemini", stage), model_router.timed(tier, stage):
+                try:
+                    return await model.generate_content_async(prompt)
+                except asyncio.CancelledError:
+                    # Cancelled mid-call (the losing hedge, or the deadline): the prompt was still sent
+                    _meter_gemini(tier, stage, prompt, output_text="")
+                    raise
+
+    # A hedge that also finished is billed like the one whose answer we use
+    return await hedger.call(f"{stage}:{tier}", attempt,
+                             discarded=lambda response: _meter_gemini(tier, stage, prompt, response))
+
+
+def _classify_prompt(customer_message: str) -> str:
+    return (
+        "Classify this customer message as ONE of: billing, sales, technical_support, other. "
+        "Focus on the primary intent only. "
+        "Reply with ONLY the classification (one word).\n\n"
+        f"Message: {customer_message}"
+    )
+
 
-# Perplexity API key (if available)
-perplexity_api_key = os.getenv("PERPLEXITY_API_KEY")
+def _is_intent(text: str) -> bool:
+    return text.strip().lower() in VALID_INTENTS
 
 
+def _parse_intent(text: str) -> str:
+    classification = text.strip().lower()
+    if classification in VALID_INTENTS:
+        logger.info(f"Classified as: {classification}")
+        return classification
+    logger.warning(f"Invalid classification: {classification}, defaulting to 'other'")
+    metrics.FALLBACKS.inc(stage="classify", fallback="other")
+    return "other"
+
+
+def _perplexity_prompt(query: str) -> str:
+    return (
+        f"Provide accurate information about: {query}\n"
+        f"Focus on facts, not recommendations.\n"
+        f"Keep response concise (2-3 sentences max).\n"
+        f"Include relevant technical or network details if applicable."
+    )
+
+
+def _perplexity_request(query: str) -> dict:
+    return {
+        "headers": {"Authorization": f"Bearer {providers.get('perplexity')}"},
+        "json": {
+            "model": "sonar",
+            "messages": [{"role": "user", "content": _perplexity_prompt(query)}],
+        },
+    }
+
+
+def _parse_perplexity(result: dict) -> str:
+    return (
+        result.get("choices", [{}])[0]
+        .get("message", {})
+        .get("content", "")
+    )
+
+
+def _gemini_context_prompt(query: str) -> str:
+    return (
+        f"Provide accurate information about: {query}\n"
+        f"Focus on facts, not recommendations.\n"
+        f"Keep response concise (2-3 sentences max).\n"
+        f"Include relevant technical, device, or network details if applicable."
+    )
+
+
+@metrics.timed("classify")
 def classify_intent(customer_message: str) -> str:
     """
-    Classify customer message into intent category using Gemini.
+    Classify customer message into intent category.
+    Confident messages are answered by the local fast-path classifier;
+    ambiguous ones escalate to Gemini.
+    Returns: billing, sales, technical_support, or other
+    """
+    local_intent = fast_classifier.classify(customer_message)
+    if local_intent is not None:
+        logger.info(f"Classified locally as: {local_intent}")
+        return local_intent
+    return classify_intent_gemini(customer_message)
+
+
+def classify_intent_gemini(customer_message: str) -> str:
+    """
+    Classify customer message into intent category using Gemini only.
+    A reply that isn't a valid label is asked again one model tier up.
     Returns: billing, sales, technical_support, or other
     """
     try:
-        response = gemini_model.generate_content(
-            "Classify this customer message as ONE of: billing, sales, technical_support, other. "
-            "Focus on the primary intent only. "
-            "Reply with ONLY the classification (one word).\n\n"
-            f"Message: {customer_message}"
-        )
-        classification = response.text.strip().lower()
-        valid_intents = ["billing", "sales", "technical_support", "other"]
-        if classification in valid_intents:
-            logger.info(f"Classified as: {classification}")
-            return classification
-        else:
-            logger.warning(f"Invalid classification: {classification}, defaulting to 'other'")
-            return "other"
+        prompt = _classify_prompt(customer_message)
+        tier = model_router.route("classify")
+        while True:
+            with metrics.upstream("gemini", "classify"), model_router.timed(tier, "classify"):
+                response = providers.model(model_router.model_name(tier)).generate_content(prompt)
+            _meter_gemini(tier, "classify", prompt, response)
+            tier = None if _is_intent(response.text) else model_router.escalate(tier, "invalid_label")
+            if tier is None:
+                return _parse_intent(response.text)
     except Exception as e:
         logger.error(f"Intent classification failed: {e}")
+        metrics.FALLBACKS.inc(stage="classify", fallback="other")
         return "other"
 
 
+async def classify_intent_async(customer_message: str) -> str:
+    """
+    Async variant of classify_intent (local fast path, then Gemini).
+    Returns: billing, sales, technical_support, or other
+    """
+    intent, _ = await classify_intent_with_source_async(customer_message)
+    return intent
+
+
+@metrics.timed("classify")
+async def classify_intent_with_source_async(customer_message: str) -> tuple:
+    """
+    classify_intent_async, also saying where the label came from, so the
+    interaction log can tell Gemini labels (fit for training the local
+    classifier) from the local classifier's own guesses and defaults.
+    Returns: (intent, source) where source is local, gemini, or fallback
+    """
+    local_intent = fast_classifier.classify(customer_message)
+    if local_intent is not None:
+        logger.info(f"Classified locally as: {local_intent}")
+        return local_intent, "local"
+    return await _classify_gemini_async(customer_message)
+
+
+async def classify_intent_gemini_async(customer_message: str) -> str:
+    """
+    Async variant of classify_intent_gemini.
+    Raises limits.Overloaded if the Gemini limiter sheds the call.
+    Returns: billing, sales, technical_support, or other
+    """
+    intent, _ = await _classify_gemini_async(customer_message)
+    return intent
+
+
+async def _classify_gemini_async(customer_message: str) -> tuple:
+    """
+    Returns: (intent, source) where source is gemini, or fallback when the
+    call failed or never produced a valid label
+    """
+    try:
+        prompt = _classify_prompt(customer_message)
+        tier = model_router.route("classify")
+        while True:
+            response = await _gemini_async(tier, "classify", prompt)
+            _meter_gemini(tier, "classify", prompt, response)
+            tier = None if _is_intent(response.text) else model_router.escalate(tier, "invalid_label")
+            if tier is None:
+                return _parse_intent(response.text), "gemini" if _is_intent(response.text) else "fallback"
+    except limits.Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Intent classification failed: {e}")
+        metrics.FALLBACKS.inc(stage="classify", fallback="other")
+        return "other", "fallback"
+
+
+@metrics.timed("classify_batch")
+async def classify_intents_batch_async(customer_messages: list) -> list:
+    """
+    Classify many messages at once. The local fast path answers what it
+    can; the rest go to Gemini as numbered items in one prompt per
+    BATCH_CLASSIFY_SIZE messages. If Gemini's reply can't be parsed, those
+    messages are classified one by one.
+    Returns: intents in input order
+    """
+    intents = [fast_classifier.classify(message) for message in customer_messages]
+    pending = [i for i, intent in enumerate(intents) if intent is None]
+    for start in range(0, len(pending), BATCH_CLASSIFY_SIZE):
+        chunk = pending[start:start + BATCH_CLASSIFY_SIZE]
+        results = await _classify_chunk_async([customer_messages[i] for i in chunk])
+        for i, intent in zip(chunk, results):
+            intents[i] = intent
+    return intents
+
+
+async def _classify_chunk_async(customer_messages: list) -> list:
+    numbered = "\n".join(f"{i + 1}. {message}" for i, message in enumerate(customer_messages))
+    try:
+        prompt = (
+            "Classify each customer message below as ONE of: billing, sales, technical_support, other. "
+            "Focus on the primary intent only. "
+            f"Reply with ONLY a JSON array of {len(customer_messages)} classifications, in order.\n\n"
+            f"Messages:\n{numbered}"
+        )
+        tier = model_router.route("classify_batch")
+        response = await _gemini_async(tier, "classify_batch", prompt)
+        _meter_gemini(tier, "classify_batch", prompt, response)
+        text = response.text.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+        labels = json.loads(text)
+        if not isinstance(labels, list) or len(labels) != len(customer_messages):
+            raise ValueError(f"expected {len(customer_messages)} labels, got {labels!r:.100}")
+        intents = [str(label).strip().lower() for label in labels]
+        logger.info(f"Batch-classified {len(intents)} messages")
+        return [intent if intent in VALID_INTENTS else "other" for intent in intents]
+    except limits.Overloaded:
+        raise
+    except Exception as e:
+        logger.warning(f"Batch classification failed, classifying individually: {e}")
+        metrics.FALLBACKS.inc(stage="classify_batch", fallback="individual")
+        return list(await asyncio.gather(*(
+            classify_intent_gemini_async(message) for message in customer_messages
+        )))
+
+
+@metrics.timed("retrieval")
+def _retrieve_local_context(query: str):
+    """
+    Context from the local knowledge-base index.
+    Returns: context, or None if retrieval is not confident (ask Perplexity)
+    """
+    try:
+        context = knowledge_base.retrieve(query)
+    except Exception as e:
+        logger.error(f"Local retrieval failed: {e}")
+        return None
+    if context is not None:
+        logger.info("Context retrieved from local knowledge base")
+    return context
+
+
+@metrics.timed("context")
 def get_context_from_perplexity(query: str) -> str:
     """
-    Retrieve context about customer query using Perplexity or fallback to Gemini.
+    Retrieve context about customer query: the local knowledge base first,
+    then Perplexity, falling back to Gemini.
+    Upstream results are memoized per provider in the context cache.
+    """
+    local = _retrieve_local_context(query)
+    if local is not None:
+        return local
+    cached = context_cache.get(query)
+    if cached is not None:
+        return cached
+    provider, context = _fetch_context(query)
+    if provider is not None:
+        context_cache.set(provider, query, context)
+    return context
+
+
+def _fetch_context(query: str) -> tuple:
+    """
+    Returns: (provider, context) where provider is perplexity, gemini, or None on failure
     """
     try:
-        if perplexity_api_key:
+        if providers.get("perplexity") and perplexity_client.available():
             try:
-                response = requests.post(
-                    "https://api.perplexity.ai/openai/v1/chat/completions",
-                    headers={"Authorization": f"Bearer {perplexity_api_key}"},
-                    json={
-                        "model": "sonar",
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": (
-                                    f"Provide accurate information about: {query}\n"
-                                    f"Focus on facts, not recommendations.\n"
-                                    f"Keep response concise (2-3 sentences max).\n"
-                                    f"Include relevant technical or network details if applicable."
-                                ),
-                            }
-                        ],
-                    },
-                )
+                with metrics.upstream("perplexity", "context"):
+                    response = perplexity_client.post(PERPLEXITY_API_URL, **_perplexity_request(query))
                 if response.status_code == 200:
                     result = response.json()
-                    context = (
-                        result.get("choices", [{}])[0]
-                        .get("message", {})
-                        .get("content", "")
-                    )
+                    context = _parse_perplexity(result)
+                    _meter_perplexity(query, result, context)
                     logger.info("Context retrieved from Perplexity")
-                    return context[:500]
+                    return "perplexity", context[:500]
+                metrics.UPSTREAM_ERRORS.inc(provider="perplexity", operation="context")
             except Exception as e:
                 logger.warning(f"Perplexity failed, falling back to Gemini: {e}")
+        if providers.get("perplexity"):
+            metrics.FALLBACKS.inc(stage="context", fallback="gemini")
         
         # Fallback to Gemini
-        response = gemini_model.generate_content(
-            f"Provide accurate information about: {query}\n"
-            f"Focus on facts, not recommendations.\n"
-            f"Keep response concise (2-3 sentences max).\n"
-            f"Include relevant technical, device, or network details if applicable."
-        )
+        prompt = _gemini_context_prompt(query)
+        tier = model_router.route("context")
+        with metrics.upstream("gemini", "context"), model_router.timed(tier, "context"):
+            response = providers.model(model_router.model_name(tier)).generate_content(prompt)
+        _meter_gemini(tier, "context", prompt, response)
         context = response.text
         logger.info("Context retrieved from Gemini (fallback)")
-        return context[:500]
+        return "gemini", context[:500]
     
     except Exception as e:
         logger.error(f"Context retrieval failed: {e}")
-        return "Unable to retrieve context."
+        metrics.FALLBACKS.inc(stage="context", fallback="fallback_context")
+        return None, FALLBACK_CONTEXT
 
 
-def generate_response(agent_type: str, customer_message: str, context: str) -> str:
+@metrics.timed("context")
+async def get_context_from_perplexity_async(query: str) -> str:
     """
-    Generate agent response using Gemini.
-    agent_type: billing, sales, technical_support, or other
+    Async variant of get_context_from_perplexity.
+    Concurrent identical queries share one in-flight upstream call.
     """
-    system_prompts = {
-        "billing": """You are a T-Mobile billing support agent. Your role is to help customers understand their charges and billing issues.
-
-Requirements:
-- Be helpful, professional, and concise
-- Explain charges clearly and in plain language
-- Offer solutions to billing problems
-- Provide information about payment options
-- Handle billing disputes professionally
-- Suggest cost-saving options when relevant
-- Break down complex charges into understandable components
-- Proactively offer payment plans if customer has concerns about high bills
-- Provide credit or refund information when applicable
-- Always be empathetic to billing concerns""",
-        
-        "sales": """You are a T-Mobile sales agent. Your role is to help customers understand plans, find the best options for their needs, and close sales.
-
-Requirements:
-- Help customers understand plan features and benefits in simple terms
-- Be persuasive but honest about offerings and limitations
-- Ask qualifying questions to understand customer needs (usage, budget, location)
-- Recommend the best plan based on their specific use case
-- Explain add-on services and current promotions
-- Address objections professionally and confidently
-- Focus on customer value proposition, not just features
-- Highlight 5G capabilities, coverage, and speed advantages
-- Offer bundle deals and limited-time promotions
-- Provide clear pricing and contract terms
-- Create urgency with time-limited offers when appropriate
-- Always prioritize customer satisfaction over quick sales""",
-        
-        "technical_support": """You are a T-Mobile technical support agent. Your role is to help customers troubleshoot network, device, and service issues.
-
-Requirements:
-- Start by clarifying the problem and asking targeted follow-up questions
-- Provide clear, numbered step-by-step troubleshooting instructions
-- Use simple language while explaining technical concepts
-- Cover basics first: restart device, check airplane mode, check Wi‑Fi vs cellular, check SIM
-- Instruct how to check signal bars and network status on common devices
-- Suggest checking coverage or outage information when relevant
-- Help with common issues: dropped calls, slow data, no service, voicemail, SMS/MMS
-- Offer device-specific tips when the customer mentions iPhone/Android/other
-- Only suggest advanced settings (APN, network reset) after basic steps fail
-- Explain when an issue is likely on the network vs the device vs the account
-- Tell the customer what to try next if the first steps do not work
-- Recommend escalation to in‑store support or phone support for hardware damage or SIM replacement
-- Remain calm, patient, and empathetic to customer frustration""",
+    local = _retrieve_local_context(query)
+    if local is not None:
+        return local
+    return await context_cache.get_or_fetch(query, _fetch_context_async)
+
+
+async def _fetch_context_async(query: str) -> tuple:
+    """
+    Returns: (provider, context) where provider is perplexity, gemini, or None on failure
+    """
+    try:
+        if providers.get("perplexity") and perplexity_client.available():
+            try:
+                async with limits.slot("perplexity"):
+                    with metrics.upstream("perplexity", "context"):
+                        response = await perplexity_client.post_async(
+                            PERPLEXITY_API_URL, **_perplexity_request(query)
+                        )
+                        limits.check_status("perplexity", response.status_code)
+                if response.status_code == 200:
+                    result = response.json()
+                    context = _parse_perplexity(result)
+                    _meter_perplexity(query, result, context)
+                    logger.info("Context retrieved from Perplexity")
+                    return "perplexity", context[:500]
+                metrics.UPSTREAM_ERRORS.inc(provider="perplexity", operation="context")
+            except Exception as e:
+                logger.warning(f"Perplexity failed, falling back to Gemini: {e}")
+        if providers.get("perplexity"):
+            metrics.FALLBACKS.inc(stage="context", fallback="gemini")
         
-        "other": "You are a T-Mobile customer service agent. Help the customer efficiently and professionally."
-    }
-    
-    system_prompt = system_prompts.get(agent_type, system_prompts["other"])
+        # Fallback to Gemini
+        prompt = _gemini_context_prompt(query)
+        tier = model_router.route("context")
+        response = await _gemini_async(tier, "context", prompt)
+        _meter_gemini(tier, "context", prompt, response)
+        context = response.text
+        logger.info("Context retrieved from Gemini (fallback)")
+        return "gemini", context[:500]
     
+    except Exception as e:
+        logger.error(f"Context retrieval failed: {e}")
+        metrics.FALLBACKS.inc(stage="context", fallback="fallback_context")
+        return None, FALLBACK_CONTEXT
+
+
+def _response_call(tier: str, agent_type: str, customer_message: str, context: str, history: str = "") -> tuple:
+    """
+    Pick the model for tier and build the budgeted prompt for a response.
+    SDKs that accept a system instruction get a per-role model with the role
+    prompt bound to it, so only the request-specific part is sent each call;
+    older SDKs (and the benchmark stubs) get the role prompt inline.
+    Returns: (model, prompt)
+    """
+    template = prompt_registry.template(agent_type)
+    model_name = model_router.model_name(tier)
+    model = providers.role_model(template.role, template.system, model_name)
+    if model is not None:
+        return model, prompt_registry.render(agent_type, customer_message, context, history, include_system=False)
+    return providers.model(model_name), prompt_registry.render(agent_type, customer_message, context, history)
+
+
+def _generate(tier: str, agent_type: str, customer_message: str, context: str, history: str) -> str:
+    model, prompt = _response_call(tier, agent_type, customer_message, context, history)
+    with metrics.upstream("gemini", "generate"), model_router.timed(tier, "generate"):
+        response = model.generate_content(prompt)
+    _meter_gemini(tier, "generate", prompt, response)
+    return response.text
+
+
+async def _generate_async(tier: str, agent_type: str, customer_message: str, context: str, history: str) -> str:
+    model, prompt = _response_call(tier, agent_type, customer_message, context, history)
+    response = await _gemini_async(tier, "generate", prompt, model)
+    _meter_gemini(tier, "generate", prompt, response)
+    return response.text
+
+
+@metrics.timed("generate")
+def generate_response(agent_type: str, customer_message: str, context: str, history: str = "") -> str:
+    """
+    Generate agent response using Gemini, on the model tier chosen for the
+    agent and message. A weak first answer is asked again one tier up; if
+    that call fails, the first answer is kept.
+    agent_type: billing, sales, technical_support, or other
+    history: earlier turns of the conversation, if any
+    Raises limits.Overloaded if Gemini is rate limiting us, rather than
+    answering with the fallback apology.
+    """
+    tier = model_router.choose("generate", agent_type, customer_message)
     try:
-        response = gemini_model.generate_content(
-            f"{system_prompt}\n\n"
-            f"Customer context: {context}\n\n"
-            f"Customer message: {customer_message}\n\n"
-            f"Provide a helpful, professional response with clear steps."
-        )
-        logger.info(f"Generated response for {agent_type} agent")
-        return response.text
+        text = _generate(tier, agent_type, customer_message, context, history)
     except Exception as e:
+        if limits.is_throttle(e):
+            raise limits.Overloaded("gemini", "throttled", limits.limiters["gemini"].retry_after_s) from e
         logger.error(f"Response generation failed: {e}")
-        return "I apologize, I'm unable to process that request right now. Please try again later."
+        metrics.FALLBACKS.inc(stage="generate", fallback="fallback_response")
+        return FALLBACK_RESPONSE
+    problem = model_router.answer_problem(text)
+    higher = problem and model_router.escalate(tier, problem)
+    if higher:
+        try:
+            text = _generate(higher, agent_type, customer_message, context, history)
+        except Exception as e:
+            logger.warning(f"Escalated generation on {higher} failed, keeping the {tier} answer: {e}")
+    logger.info(f"Generated response for {agent_type} agent")
+    return text
+
+
+@metrics.timed("generate")
+async def generate_response_async(agent_type: str, customer_message: str, context: str,
+                                  history: str = "", deadline=None) -> str:
+    """
+    Async variant of generate_response.
+    agent_type: billing, sales, technical_support, or other
+    deadline: the request's deadline.Deadline, or None for no time limit; a
+    re-ask on a larger model is only kept if it finishes in time
+    Raises limits.Overloaded if the Gemini limiter sheds the call, and
+    DeadlineExceeded if no answer is ready within the deadline.
+    """
+    tier = model_router.choose("generate", agent_type, customer_message)
+    try:
+        text = await within(deadline, "generate",
+                            _generate_async(tier, agent_type, customer_message, context, history))
+    except (limits.Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Response generation failed: {e}")
+        metrics.FALLBACKS.inc(stage="generate", fallback="fallback_response")
+        return FALLBACK_RESPONSE
+    problem = model_router.answer_problem(text)
+    higher = problem and model_router.escalate(tier, problem)
+    if higher:
+        try:
+            text = await within(deadline, "generate_escalation",
+                                _generate_async(higher, agent_type, customer_message, context, history))
+        except Exception as e:
+            logger.warning(f"Escalated generation on {higher} failed, keeping the {tier} answer: {e}")
+    logger.info(f"Generated response for {agent_type} agent")
+    return text
+
+
+def _fused_call(tier: str, customer_message: str, context: str, history: str) -> tuple:
+    """
+    Pick the model for tier and build the fused prompt. SDKs with structured
+    output get a model bound to the JSON schema and the role prompts; older
+    SDKs (and the benchmark stubs) get the instructions inline.
+    Returns: (model, prompt)
+    """
+    model_name = model_router.model_name(tier)
+    model = providers.json_model("fused", fused_schema(VALID_INTENTS), prompt_registry.fused.system, model_name)
+    if model is not None:
+        return model, prompt_registry.render_fused(customer_message, context, history, include_system=False)
+    return providers.model(model_name), prompt_registry.render_fused(customer_message, context, history)
 
 
+def _parse_fused(text: str) -> tuple:
+    """
+    Returns: (reply, None) with reply a dict of intent, context_summary and
+    response, or (None, problem) where problem is invalid_json, invalid_intent
+    or empty_response
+    """
+    # Tolerate a Markdown code fence or a sentence around the object
+    start, end = text.find("{"), text.rfind("}")
+    try:
+        reply = json.loads(text[start:end + 1]) if start != -1 else None
+    except ValueError:
+        reply = None
+    if not isinstance(reply, dict):
+        return None, "invalid_json"
+    intent = reply.get("intent")
+    if not isinstance(intent, str) or not _is_intent(intent):
+        return None, "invalid_intent"
+    response = reply.get("response")
+    if not isinstance(response, str) or not response.strip():
+        return None, "empty_response"
+    summary = reply.get("context_summary")
+    return {
+        "intent": intent.strip().lower(),
+        "context_summary": summary.strip() if isinstance(summary, str) else "",
+        "response": response.strip(),
+    }, None
+
+
+async def _fused_async(tier: str, customer_message: str, context: str, history: str) -> tuple:
+    model, prompt = _fused_call(tier, customer_message, context, history)
+    response = await _gemini_async(tier, "fused", prompt, model)
+    _meter_gemini(tier, "fused", prompt, response)
+    return _parse_fused(response.text)
+
+
+@metrics.timed("fused")
+async def classify_and_respond_async(customer_message: str, history: str = "", deadline=None):
+    """
+    Fused mode: classify the message, summarize context and answer it in one
+    Gemini call carrying every agent's role prompt, grounded on the local
+    knowledge base when it has the answer. A weak answer is asked again one
+    tier up; if that call fails, the first answer is kept.
+    deadline: the request's deadline.Deadline, or None for no time limit
+    Raises limits.Overloaded if the Gemini limiter sheds the call, and
+    DeadlineExceeded if no answer is ready within the deadline.
+    Returns: {"intent", "context", "response"}, or None when the reply can't
+    be used (unparseable, invalid intent, failed call) and the multi-call
+    path should answer instead
+    """
+    local = _retrieve_local_context(customer_message)
+    tier = model_router.choose("fused", None, customer_message)
+    try:
+        reply, problem = await within(deadline, "fused", _fused_async(tier, customer_message, local or "", history))
+    except (limits.Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Fused classify-and-respond failed: {e}")
+        reply, problem = None, "error"
+    if reply is None:
+        logger.warning(f"Fused reply unusable ({problem}), falling back to separate calls")
+        metrics.FUSED_CALLS.inc(outcome=problem)
+        metrics.FALLBACKS.inc(stage="fused", fallback="multi_call")
+        return None
+    weakness = model_router.answer_problem(reply["response"])
+    higher = weakness and model_router.escalate(tier, weakness)
+    if higher:
+        try:
+            better, problem = await within(deadline, "fused_escalation",
+                                           _fused_async(higher, customer_message, local or "", history))
+            if better is not None:
+                reply = better
+        except Exception as e:
+            logger.warning(f"Escalated fused call on {higher} failed, keeping the {tier} answer: {e}")
+    metrics.FUSED_CALLS.inc(outcome="answered")
+    logger.info(f"Fused call classified as {reply['intent']} and answered")
+    return {
+        "intent": reply["intent"],
+        "context": local or reply["context_summary"] or FALLBACK_CONTEXT,
+        "response": reply["response"],
+    }
+
+
+@metrics.timed("generate")
+async def generate_response_stream(agent_type: str, customer_message: str, context: str, history: str = ""):
+    """
+    Streaming variant of generate_response: yields text chunks as Gemini produces them.
+    Chunks are already sent by the time the answer is complete, so the tier is
+    chosen from the message alone (no re-ask on a weak answer).
+    agent_type: billing, sales, technical_support, or other
+    """
+    streamed = False
+    tier = model_router.choose("generate", agent_type, customer_message)
+    model, prompt = _response_call(tier, agent_type, customer_message, context, history)
+    parts = []
+    try:
+        async with limits.slot("gemini"):
+            with metrics.upstream("gemini", "generate_stream"), model_router.timed(tier, "generate_stream"):
+                response = await model.generate_content_async(prompt, stream=True)
+                async for chunk in response:
+                    if chunk.text:
+                        streamed = True
+                        parts.append(chunk.text)
+                        yield chunk.text
+        _meter_gemini(tier, "generate", prompt, response, output_text="".join(parts))
+        logger.info(f"Streamed response for {agent_type} agent")
+    except Exception as e:
+        if isinstance(e, limits.Overloaded) and not streamed:
+            raise
+        logger.error(f"Response streaming failed: {e}")
+        if not streamed:
+            metrics.FALLBACKS.inc(stage="generate", fallback="fallback_response")
+            yield FALLBACK_RESPONSE
+
+
+def get_tts_client():
+    """
+    Return the shared ElevenLabs client, creating it on first use.
+    Returns: client, or None if ELEVENLABS_API_KEY is not configured
+    """
+    return providers.get("elevenlabs")
+
+
+@metrics.timed("tts")
 def text_to_speech(text: str) -> dict:
     """
     Convert text to speech using ElevenLabs.
-    Returns: {"success": bool, "message": str}
+    Audio already in the on-disk audio cache is returned without a call.
+    Returns: {"success": bool, "message": str, "audio": bytes and
+    "audio_key": cache key (on success)}
     """
+    key = audio_cache.key(text, ELEVENLABS_VOICE, ELEVENLABS_MODEL)
+    try:
+        return _cached_speech(key) or _synthesize(text, key)
+    except Exception as e:
+        return _no_audio(e)
+
+
+def _no_audio(error: Exception) -> dict:
+    logger.warning(f"Text-to-speech failed: {error}")
+    metrics.FALLBACKS.inc(stage="tts", fallback="no_audio")
+    return {"success": False, "message": str(error)}
+
+
+def _cached_speech(key: str):
+    audio = audio_cache.read(key)
+    if audio is None:
+        return None
+    logger.info("Text-to-speech served from the audio cache")
+    return {"success": True, "message": "Audio from cache", "audio": audio, "audio_key": key}
+
+
+def _synthesize(text: str, key: str) -> dict:
+    """Raises throttling errors (see limits.is_throttle) so the caller's limiter can back off"""
     try:
-        elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-        if not elevenlabs_api_key:
+        client = get_tts_client()
+        if client is None:
             logger.warning("ELEVENLABS_API_KEY not found, TTS unavailable")
             return {"success": False, "message": "API key not configured"}
         
-        from elevenlabs.client import ElevenLabs
-        client = ElevenLabs(api_key=elevenlabs_api_key)
-        audio = client.generate(
-            text=text,
-            voice="Rachel",
-            model="eleven_monolingual_v1"
-        )
+        with metrics.upstream("elevenlabs", "tts"):
+            audio = client.generate(
+                text=text,
+                voice=ELEVENLABS_VOICE,
+                model=ELEVENLABS_MODEL
+            )
+            if not isinstance(audio, bytes):
+                audio = b"".join(audio)
+        metering.record("elevenlabs", ELEVENLABS_MODEL, characters=len(text), stage="tts")
         logger.info("Text-to-speech conversion successful")
-        return {"success": True, "message": "Audio generated", "audio": audio}
     except Exception as e:
-        logger.warning(f"Text-to-speech failed: {e}")
+        if limits.is_throttle(e):
+            raise
+        return _no_audio(e)
+    try:
+        audio_cache.put(key, audio)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not cache synthesized audio: {e}")
+    return {"success": True, "message": "Audio generated", "audio": audio, "audio_key": key}
+
+
+@metrics.timed("tts")
+async def text_to_speech_async(text: str, deadline=None) -> dict:
+    """
+    Async variant of text_to_speech.
+    The ElevenLabs SDK is synchronous, so synthesis (and the audio cache's
+    disk IO) runs on a worker thread. Concurrent requests for the same uncached audio share one synthesis.
+    deadline: the request's deadline.Deadline; past it, the response goes
+    out without audio (the worker thread still finishes in the background)
+    Raises limits.Overloaded when ElevenLabs is at its concurrency limit.
+    Returns: {"success": bool, "message": str, "audio": bytes and
+    "audio_key": cache key (on success)}
+    """
+    key = audio_cache.key(text, ELEVENLABS_VOICE, ELEVENLABS_MODEL)
+    # The index lookup and file read are disk IO, so they stay off the event loop too
+    cached = await asyncio.to_thread(_cached_speech, key)
+    if cached is not None:
+        return cached
+    try:
+        return await within(deadline, "tts", audio_cache.coalesce(key, lambda: _synthesize_async(text, key)))
+    except DeadlineExceeded as e:
+        logger.warning(f"Text-to-speech skipped: {e}")
+        metrics.FALLBACKS.inc(stage="tts", fallback="no_audio")
         return {"success": False, "message": str(e)}
+
+
+async def _synthesize_async(text: str, key: str) -> dict:
+    try:
+        async with limits.slot("elevenlabs"):
+            return await asyncio.to_thread(_synthesize, text, key)
+    except limits.Overloaded as e:
+        if e.reason != "throttled":
+            raise
+        # The limiter has backed off; this answer goes out without audio
+        return _no_audio(e)
@@ -0,0 +1,226 @@
+# sessions.py
+# Per-customer conversation memory: recent turns, rolling digest, sticky routing
+#
+# Sessions are keyed by customer_id and kept in an LRU with an idle TTL.
+# Records use __slots__ so thousands of live sessions stay small. Turns beyond
+# SESSION_MAX_TURNS are folded into a short extractive digest, so the history
+# added to a prompt stays bounded however long the conversation runs.
+
+from collections import OrderedDict
+from intent_classifier import fast_classifier
+from cache import normalize_message, make_backend
+import shared_state
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+SESSION_TURN_CHARS = int(os.getenv("SESSION_TURN_CHARS", "400"))
+SESSION_DIGEST_CHARS = int(os.getenv("SESSION_DIGEST_CHARS", "600"))
+# Follow-up detection for sticky routing
+SESSION_FOLLOWUP_MAX_WORDS = int(os.getenv("SESSION_FOLLOWUP_MAX_WORDS", "6"))
+SESSION_TOPIC_OVERLAP = float(os.getenv("SESSION_TOPIC_OVERLAP", "0.25"))
+SESSION_TOPIC_TERMS = 32
+# Local confidence for another intent that makes a short message a topic change
+SESSION_SWITCH_CONFIDENCE = float(os.getenv("SESSION_SWITCH_CONFIDENCE", "0.5"))
+# customer_id logged for requests that don't send one; they never get a session
+ANONYMOUS_CUSTOMER = "demo_customer"
+
+# Sentence end, but not a list number like "1."
+_SENTENCE_RE = re.compile(r"(?<=[.!?])(?<!\b\d\.)\s")
+_STOPWORDS = frozenset(
+    "about after again also been before being could does doing from have having here just "
+    "like more most much only other over should some such than that their them then there "
+    "these they this those through very want what when where which while will with would "
+    "your yours it's that's don't can't i'm thank thanks okay please still sure great yeah right".split()
+)
+
+
+def _first_sentence(text: str, limit: int = 120) -> str:
+    sentence = _SENTENCE_RE.split(text.strip(), 1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rsplit(" ", 1)[0] + "..."
+
+
+def _topic_terms(text: str) -> set:
+    return {word for word in normalize_message(text).split() if len(word) > 3 and word not in _STOPWORDS}
+
+
+class Turn:
+    """One message in a conversation"""
+    __slots__ = ("role", "text", "intent", "at")
+
+    def __init__(self, role: str, text: str, intent: str = None):
+        self.role = role
+        self.text = text[:SESSION_TURN_CHARS]
+        self.intent = intent
+        self.at = time.time()
+
+
+class Session:
+    """A customer's recent turns, digest of older ones, and current agent"""
+    __slots__ = ("customer_id", "turns", "digest", "intent", "agent_name", "context", "topic", "last_seen")
+
+    def __init__(self, customer_id: str):
+        self.customer_id = customer_id
+        self.turns = []
+        self.digest = ""
+        self.intent = None
+        self.agent_name = None
+        self.context = None
+        self.topic = frozenset()
+        self.last_seen = time.monotonic()
+
+    def follow_up_intent(self, customer_message: str):
+        """
+        Sticky routing: the session's intent if this message continues the
+        same topic, so classification can be skipped.
+        Returns: intent, or None to classify normally
+        """
+        if self.intent is None:
+            return None
+        # A local signal for another intent (any keyword rule) is a topic change
+        label, confidence, source = fast_classifier.predict(customer_message)
+        if source != "none" and confidence >= SESSION_SWITCH_CONFIDENCE and label != self.intent:
+            return None
+        terms = _topic_terms(customer_message)
+        if terms and len(terms & self.topic) / len(terms) >= SESSION_TOPIC_OVERLAP:
+            return self.intent
+        if source != "none" and confidence >= SESSION_SWITCH_CONFIDENCE:
+            return self.intent
+        # A short message with no topic of its own ("and after that?") continues the conversation
+        if not terms and len(customer_message.split()) <= SESSION_FOLLOWUP_MAX_WORDS:
+            return self.intent
+        return None
+
+    def history(self) -> str:
+        """Digest plus recent turns, for the response prompt ("" for a new session)"""
+        lines = [f"Earlier: {self.digest}"] if self.digest else []
+        lines += [f"{turn.role.capitalize()}: {turn.text}" for turn in self.turns]
+        return "\n".join(lines)
+
+    def _compact(self):
+        """Fold turns beyond SESSION_MAX_TURNS into the rolling digest"""
+        overflow = len(self.turns) - SESSION_MAX_TURNS
+        if overflow <= 0:
+            return
+        folded = " ".join(f"{turn.role}: {_first_sentence(turn.text)}" for turn in self.turns[:overflow])
+        del self.turns[:overflow]
+        digest = f"{self.digest} {folded}".strip()
+        if len(digest) > SESSION_DIGEST_CHARS:
+            # Keep the most recent part, starting on a word boundary
+            digest = digest[-SESSION_DIGEST_CHARS:].split(" ", 1)[-1]
+        self.digest = digest
+
+
+class SessionStore:
+    """
+    LRU of sessions by customer_id; sessions idle longer than ttl_s are dropped.
+    With a backend (multi-worker mode) sessions are loaded from it on get() and
+    written back on record(), so a customer's turns follow them across workers.
+    """
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_s: float = SESSION_TTL_S, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "resumed": 0, "expired": 0, "evicted": 0, "sticky_routes": 0}
+
+    def _purge_idle(self, now: float):
+        # Least recently used first, so idle sessions sit at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen < self.ttl_s:
+                break
+            self._sessions.popitem(last=False)
+            self.counters["expired"] += 1
+
+    def get(self, customer_id: str) -> Session:
+        """Returns: the customer's live session, or a new empty one"""
+        if self.backend is not None:
+            return self._load(customer_id)
+        now = time.monotonic()
+        with self._lock:
+            self._purge_idle(now)
+            session = self._sessions.get(customer_id)
+            if session is None:
+                session = self._sessions[customer_id] = Session(customer_id)
+                self.counters["created"] += 1
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.counters["evicted"] += 1
+            else:
+                self._sessions.move_to_end(customer_id)
+                self.counters["resumed"] += 1
+            session.last_seen = now
+            return session
+
+    def for_customer(self, customer_id: str):
+        """
+        Returns: the customer's session, or None for an anonymous caller (no
+        customer_id, or ANONYMOUS_CUSTOMER) so unrelated callers never share one
+        """
+        if not customer_id or customer_id == ANONYMOUS_CUSTOMER:
+            return None
+        return self.get(customer_id)
+
+    def _load(self, customer_id: str) -> Session:
+        session = self.backend.get(customer_id)
+        with self._lock:
+            if session is None:
+                session = Session(customer_id)
+                self.counters["created"] += 1
+            else:
+                self.counters["resumed"] += 1
+        return session
+
+    def follow_up_intent(self, session: Session, customer_message: str):
+        """Session.follow_up_intent, counted for stats"""
+        intent = session.follow_up_intent(customer_message)
+        if intent is not None:
+            with self._lock:
+                self.counters["sticky_routes"] += 1
+            logger.info(f"Sticky routing for {session.customer_id}: {intent}")
+        return intent
+
+    def record(self, session: Session, customer_message: str, intent: str, agent_name: str,
+               response: str, context: str = None):
+        """Append one exchange and update the session's agent, topic and context"""
+        with self._lock:
+            session.turns.append(Turn("customer", customer_message, intent))
+            if response:
+                session.turns.append(Turn("agent", response, intent))
+            if intent != session.intent:
+                session.topic = frozenset()
+            session.intent = intent
+            session.agent_name = agent_name
+            if context:
+                session.context = context
+            # Newest terms first, so a long conversation keeps tracking where it is now
+            recent = _topic_terms(customer_message)
+            terms = list(recent) + [term for term in session.topic if term not in recent]
+            session.topic = frozenset(terms[:SESSION_TOPIC_TERMS])
+            session._compact()
+            session.last_seen = time.monotonic()
+        if self.backend is not None:
+            self.backend.set(session.customer_id, session, self.ttl_s)
+
+    def __len__(self) -> int:
+        return len(self.backend) if self.backend is not None else len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "sessions": len(self)}
+
+
+# Shared instance used by main.py; kept in the shared-state file in multi-worker mode
+session_store = SessionStore(
+    backend=make_backend("sessions", SESSION_MAX, SESSION_TTL_S) if shared_state.enabled() else None
+)
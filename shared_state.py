@@ -0,0 +1,193 @@
+# shared_state.py
+# State shared by every worker process in multi-worker mode, kept in one local SQLite file
+#
+# With WORKERS > 1 (or SHARED_STATE_PATH set) the response and context caches,
+# conversation sessions and upstream concurrency limits live in SHARED_STATE_PATH
+# instead of module globals, so each worker sees the same state. The
+# interaction log is already a SQLite file (LOG_DB_PATH) that every worker
+# writes to. Single-process deployments keep everything in memory.
+#
+# Writes go through one writer thread per process (see StateWriter), so the
+# event loop never waits on SQLite's write lock or its 5s busy timeout. Reads
+# stay on the request path, where callers are synchronous (cache lookups,
+# session loads). In WAL mode a reader does not wait for writers, and reads
+# use their own connection with a SHARED_STATE_READ_TIMEOUT_S busy timeout.
+# If the file is still locked (WAL recovery, a truncating checkpoint) the
+# read counts as a cache miss instead of blocking the loop.
+#
+#     WORKERS=4 python main.py
+#     SHARED_STATE_PATH=state.db gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH") or ("shared_state.db" if WORKERS > 1 else "")
+# How often a worker folds its limiter changes into the shared limit
+LIMIT_SYNC_S = float(os.getenv("LIMIT_SYNC_S", "0.5"))
+# Workers that haven't synced for this long no longer count towards the split
+WORKER_TTL_S = float(os.getenv("WORKER_TTL_S", "10"))
+# Longest a read on the request path waits for a lock before giving up
+SHARED_STATE_READ_TIMEOUT_S = float(os.getenv("SHARED_STATE_READ_TIMEOUT_S", "0.05"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache (namespace, accessed_at);
+CREATE TABLE IF NOT EXISTS limiter (
+    provider TEXT PRIMARY KEY,
+    cluster_limit REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return bool(SHARED_STATE_PATH)
+
+
+def connect() -> sqlite3.Connection:
+    """
+    This thread's connection to the shared state file, opened on first use.
+    Connections are per thread and per process, so they are never shared across a fork.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(SHARED_STATE_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def connect_reader() -> sqlite3.Connection:
+    """
+    This thread's read connection: short busy timeout, and no schema setup
+    (the writer thread creates the tables), so it never waits on a writer.
+    Queries on it raise sqlite3.OperationalError when the file is locked or
+    not yet initialized; callers treat that as a miss.
+    """
+    conn = getattr(_local, "reader", None)
+    if conn is None or _local.reader_pid != os.getpid():
+        conn = sqlite3.connect(SHARED_STATE_PATH, timeout=SHARED_STATE_READ_TIMEOUT_S, isolation_level=None,
+                               check_same_thread=False)
+        _local.reader, _local.reader_pid = conn, os.getpid()
+        writer.submit(connect)
+    return conn
+
+
+class StateWriter:
+    """
+    Runs shared-state writes on a background thread, one at a time, so a
+    worker's event loop never blocks while another process holds the write
+    lock. The thread starts on first submit() and again after a fork.
+    """
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, write, done=None):
+        """
+        Queue write() to run on the writer thread. done(result, error), if
+        given, is called on that thread afterwards; without it errors are logged.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="shared-state-writer",
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        self._queue.put((write, done))
+
+    def _run(self, jobs: queue.Queue):
+        while True:
+            write, done = jobs.get()
+            result, error = None, None
+            try:
+                result = write()
+            except Exception as e:
+                error = e
+                if done is None:
+                    logger.warning(f"Shared state write failed: {e}")
+            if done is not None:
+                try:
+                    done(result, error)
+                except Exception:
+                    logger.exception("Shared state write callback failed")
+            jobs.task_done()
+
+    def flush(self):
+        """Block until every queued write has run (tests and shutdown)"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+
+class LimitCoordinator:
+    """
+    Cluster-wide AIMD limit per provider. Each worker batches its increases
+    and backoffs, folds them in with sync(), and runs at an equal share of the
+    result, so LIMIT_* settings apply to the whole deployment. Limiters call
+    sync() through writer rather than from the event loop.
+    """
+    def sync(self, provider: str, increase: float, factor: float, initial: float,
+             min_limit: float, max_limit: float) -> tuple:
+        """
+        Apply cluster_limit = cluster_limit * factor + increase (clamped) and heartbeat this worker.
+        Returns: (cluster_limit, active_workers)
+        """
+        now = time.time()
+        conn = connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO limiter (provider, cluster_limit, updated_at) VALUES (?, ?, ?)",
+                (provider, initial, now),
+            )
+            conn.execute(
+                "UPDATE limiter SET cluster_limit = MIN(?, MAX(?, cluster_limit * ? + ?)), updated_at = ? "
+                "WHERE provider = ?",
+                (max_limit, min_limit, factor, increase, now, provider),
+            )
+            conn.execute("INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (os.getpid(), now))
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - WORKER_TTL_S,))
+            cluster_limit = conn.execute(
+                "SELECT cluster_limit FROM limiter WHERE provider = ?", (provider,)
+            ).fetchone()[0]
+            workers = conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cluster_limit, max(1, workers)
+
+    def workers(self) -> int:
+        """Returns: workers that have synced within WORKER_TTL_S"""
+        return connect().execute(
+            "SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?", (time.time() - WORKER_TTL_S,)
+        ).fetchone()[0]
+
+
+writer = StateWriter()
+# None in single-process mode, where each limiter keeps its limit locally
+limit_coordinator = LimitCoordinator() if enabled() else None
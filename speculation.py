@@ -0,0 +1,197 @@
+# speculation.py
+# Speculative agent generation: start the likely agent's response while intent classification runs
+#
+# When a message has to go to Gemini for classification, generation would
+# normally wait for it. With SPECULATIVE_ROUTING=1, AgentRouter.route predicts
+# the intent - the session's current agent for a returning customer, otherwise
+# the local classifier's best guess if it is at least SPECULATION_MIN_CONFIDENCE -
+# and starts that agent's response straight away. If classification agrees the
+# speculative response is used; if not it is cancelled and the right agent
+# answers as usual.
+#
+# A wrong guess costs a Gemini call, so speculation is limited to
+# SPECULATION_BUDGET of requests (token bucket), and skipped while the Gemini
+# limiter is already full or the response cache has the predicted answer.
+
+from intent_classifier import fast_classifier
+from cache import response_cache
+import asyncio
+import logging
+import os
+import threading
+import time
+import limits
+import metering
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "0") == "1"
+# Share of requests that may speculate; unused budget accrues up to SPECULATION_BURST
+SPECULATION_BUDGET = float(os.getenv("SPECULATION_BUDGET", "0.3"))
+SPECULATION_BURST = float(os.getenv("SPECULATION_BURST", "5"))
+# Local classifier confidence needed to speculate on a new conversation
+SPECULATION_MIN_CONFIDENCE = float(os.getenv("SPECULATION_MIN_CONFIDENCE", "0.5"))
+
+SPECULATIONS = metrics.Counter(
+    "agent_speculations_total", "Speculative generations by outcome (hit, miss, cached, abandoned, skipped_*)",
+    ("outcome",)
+)
+SPECULATION_SAVED = metrics.Counter(
+    "agent_speculation_saved_seconds_total", "Generation time overlapped with classification on hits"
+)
+SPECULATION_WASTED_TOKENS = metrics.Counter(
+    "agent_speculation_wasted_tokens_total", "Gemini tokens spent on discarded speculative generations"
+)
+
+
+class Speculation:
+    """One speculative generation in flight"""
+    __slots__ = ("intent", "task", "meter", "started", "finished")
+
+    def __init__(self, intent: str, meter: metering.Meter):
+        self.intent = intent
+        self.meter = meter
+        self.task = None
+        self.started = time.perf_counter()
+        self.finished = None
+
+
+class Speculator:
+    """Decides when to speculate, and settles speculations once the real intent is known"""
+    def __init__(self, enabled: bool = SPECULATIVE_ROUTING, budget: float = SPECULATION_BUDGET,
+                 burst: float = SPECULATION_BURST, min_confidence: float = SPECULATION_MIN_CONFIDENCE):
+        self.enabled = enabled
+        self.budget = budget
+        self.burst = burst
+        self.min_confidence = min_confidence
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self.counters = {
+            "started": 0, "hits": 0, "misses": 0, "cached": 0, "abandoned": 0,
+            "skipped_budget": 0, "skipped_busy": 0, "skipped_cached": 0,
+            "saved_s": 0.0, "wasted_tokens": 0, "wasted_cost": 0.0,
+        }
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def predict(self, pipeline):
+        """
+        Returns: the intent to speculate on, or None when classification will
+        be instant (local fast path) or there is no usable guess
+        """
+        label, confidence, source = fast_classifier.predict(pipeline.customer_message)
+        if source != "none" and confidence >= fast_classifier.threshold:
+            return None
+        if pipeline.session is not None and pipeline.session.intent is not None:
+            return pipeline.session.intent
+        if source != "none" and confidence >= self.min_confidence:
+            return label
+        return None
+
+    def _skip(self, reason: str):
+        self._count(f"skipped_{reason}")
+        SPECULATIONS.inc(outcome=f"skipped_{reason}")
+        return None
+
+    def start(self, router, pipeline):
+        """
+        Start generating the predicted agent's response, if worth it.
+        Returns: Speculation, or None
+        """
+        if not self.enabled or pipeline.intent is not None:
+            return None
+        intent = self.predict(pipeline)
+        if intent is None:
+            return None
+        if not pipeline.history and response_cache.contains(intent, pipeline.customer_message):
+            return self._skip("cached")
+        gemini = limits.limiters["gemini"]
+        if gemini.in_flight >= int(gemini.limit):
+            return self._skip("busy")
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+            if self._tokens < 1:
+                allowed = False
+            else:
+                self._tokens -= 1
+                allowed = True
+        if not allowed:
+            return self._skip("budget")
+
+        speculation = Speculation(intent, metering.Meter(pipeline.endpoint, pipeline.customer_id))
+        speculation.task = asyncio.ensure_future(self._generate(router.agent(intent), pipeline, speculation))
+        # A discarded speculation's error is of no interest
+        speculation.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._count("started")
+        logger.info(f"Speculating on {intent} for {pipeline.customer_id}")
+        return speculation
+
+    async def _generate(self, agent, pipeline, speculation: Speculation) -> str:
+        # Calls are metered separately until we know whether they were wasted
+        metering.bind(speculation.meter)
+        try:
+            context = await pipeline.retrieve_context()
+            return await agent.process(pipeline.customer_message, context, pipeline.history, pipeline.deadline)
+        finally:
+            speculation.finished = time.perf_counter()
+
+    async def commit(self, speculation: Speculation, pipeline) -> str:
+        """
+        Use a speculation whose intent was right.
+        Returns: its response (raises whatever the generation raised)
+        """
+        saved = (speculation.finished or time.perf_counter()) - speculation.started
+        try:
+            return await speculation.task
+        finally:
+            for call in speculation.meter.calls:
+                pipeline.meter.add(call)
+            self._count("hits")
+            self._count("saved_s", saved)
+            SPECULATIONS.inc(outcome="hit")
+            SPECULATION_SAVED.inc(saved)
+
+    async def discard(self, speculation: Speculation, pipeline, outcome: str = "miss"):
+        """
+        Cancel a speculation that is no longer needed; its spend still counts
+        towards the request, including the prompt of a Gemini call cut off
+        mid-generation.
+        outcome: miss (wrong intent), cached (right intent, but the response
+        cache answered) or abandoned (the request failed before settling it).
+        Only misses count against the hit rate.
+        """
+        if speculation is None:
+            return
+        if not speculation.task.done():
+            speculation.task.cancel()
+            # A cancelled Gemini call records its estimated prompt tokens as it unwinds
+            await asyncio.wait([speculation.task])
+        tokens = sum(call["input_tokens"] + call["output_tokens"] for call in speculation.meter.calls)
+        for call in speculation.meter.calls:
+            pipeline.meter.add(call)
+        self._count("misses" if outcome == "miss" else outcome)
+        self._count("wasted_tokens", tokens)
+        self._count("wasted_cost", speculation.meter.cost)
+        SPECULATIONS.inc(outcome=outcome)
+        SPECULATION_WASTED_TOKENS.inc(tokens)
+        logger.info(f"Discarded speculation on {speculation.intent} ({outcome}, {tokens} tokens spent)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        settled = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "enabled": self.enabled,
+            "saved_s": round(counters["saved_s"], 3),
+            "wasted_cost": round(counters["wasted_cost"], 6),
+            "hit_rate": round(counters["hits"] / settled, 4) if settled else 0.0,
+            "avg_saved_ms": round(counters["saved_s"] / counters["hits"] * 1000, 1) if counters["hits"] else 0.0,
+        }
+
+
+# Shared instance used by AgentRouter
+speculator = Speculator()
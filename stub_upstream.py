@@ -0,0 +1,293 @@
+# stub_upstream.py
+# Local stand-ins for Gemini, Perplexity and ElevenLabs, for benchmarks without network or spend
+#
+# Each stand-in samples its latency from a distribution and can fail a share of
+# calls, either as a rate limit (throttle_rate) or as a plain error (error_rate).
+# Latencies are given as seconds or as a spec string:
+#
+#     0.2                    fixed 200 ms
+#     uniform:0.1,0.3        uniform between 100 and 300 ms
+#     normal:0.2,0.05        mean 200 ms, sd 50 ms (never below 0)
+#     lognormal:0.2,0.5      median 200 ms, sigma 0.5 (long right tail, like real APIs)
+#
+# Serve the app with every upstream stubbed, for external load tools:
+#
+#     python stub_upstream.py --gemini-latency lognormal:0.3,0.4 --error-rate 0.02
+#     python stub_upstream.py --workers 4          # multi-worker mode, state in shared_state.db
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from providers import registry as providers
+import services
+import limits
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uvicorn
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Latency:
+    """Latency distribution in seconds, parsed from a number or a "kind:a,b" spec"""
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec="0.2", rng: random.Random = None):
+        self.spec = str(spec)
+        self.rng = rng or random.Random()
+        kind, _, params = self.spec.partition(":")
+        if not params:
+            kind, params = "fixed", kind
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r} (expected one of {self.KINDS})")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")]
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        a, b = self.params
+        if self.kind == "uniform":
+            return self.rng.uniform(a, b)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(a, b))
+        return a * math.exp(self.rng.gauss(0.0, b)) if a > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return self.spec
+
+
+class StubUpstreamError(Exception):
+    """Injected failure from a stand-in upstream"""
+
+
+class Faults:
+    """Decides, per call, whether a stand-in throttles, errors or succeeds"""
+    def __init__(self, name: str, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 rng: random.Random = None):
+        self.name = name
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = rng or random.Random()
+
+    def draw(self) -> str:
+        """Returns: "throttled", "error" or "ok" """
+        roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return "throttled"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return "ok"
+
+    def check(self):
+        """Raise the injected failure for this call, if any"""
+        outcome = self.draw()
+        if outcome == "throttled":
+            raise limits.Throttled(f"stub {self.name} throttled")
+        if outcome == "error":
+            raise StubUpstreamError(f"stub {self.name} failed")
+
+
+class StubResponse:
+    """Mimics the .text attribute of a Gemini response"""
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGeminiModel:
+    """
+    Drop-in replacement for the Gemini model provider.
+    Sleeps for a sampled latency, plus prefill_s_per_1k_tokens for each thousand
+    prompt tokens (0 by default), then returns a canned answer or an injected failure.
+    """
+    def __init__(self, latency_s=0.2, prefill_s_per_1k_tokens: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, chunk_delay_s: float = 0.005, rng: random.Random = None):
+        rng = rng or random.Random()
+        self.latency = latency_s if isinstance(latency_s, Latency) else Latency(latency_s, rng)
+        self.prefill_s_per_1k_tokens = prefill_s_per_1k_tokens
+        self.faults = Faults("gemini", error_rate, throttle_rate, rng)
+        self.chunk_delay_s = chunk_delay_s
+
+    def _latency(self, prompt: str) -> float:
+        return self.latency.sample() + self.prefill_s_per_1k_tokens * len(prompt) / 4 / 1000
+
+    def _answer(self, prompt: str) -> StubResponse:
+        batch = re.search(r"JSON array of (\d+) classifications", prompt)
+        if batch:
+            return StubResponse(json.dumps(["technical_support"] * int(batch.group(1))))
+        if prompt.startswith("Classify"):
+            return StubResponse("technical_support")
+        if "Reply with ONLY a JSON object" in prompt:
+            return StubResponse(json.dumps({
+                "intent": "technical_support",
+                "context_summary": "Dropped calls and slow data are usually caused by weak indoor signal "
+                                   "or outdated carrier settings.",
+                "response": "1. Restart your device. 2. Toggle airplane mode. "
+                            "3. Check for a carrier settings update.",
+            }))
+        return StubResponse(
+            "1. Restart your device. 2. Toggle airplane mode. "
+            "3. Check for a carrier settings update."
+        )
+
+    def generate_content(self, prompt: str, **kwargs) -> StubResponse:
+        time.sleep(self._latency(prompt))
+        self.faults.check()
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        await asyncio.sleep(self._latency(prompt))
+        self.faults.check()
+        answer = self._answer(prompt)
+        return StubStream(answer.text, self.chunk_delay_s) if stream else answer
+
+
+class StubStream:
+    """Async iterator of word-sized chunks, like a streamed Gemini response"""
+    def __init__(self, text: str, chunk_delay_s: float = 0.005):
+        self.words = text.split(" ")
+        self.chunk_delay_s = chunk_delay_s
+
+    async def __aiter__(self):
+        for i, word in enumerate(self.words):
+            await asyncio.sleep(self.chunk_delay_s)
+            yield StubResponse(word if i == 0 else f" {word}")
+
+
+class StubTTSClient:
+    """
+    Drop-in replacement for the ElevenLabs client.
+    Sleeps for a sampled latency, then returns fake audio bytes for the text.
+    """
+    def __init__(self, latency_s=0.2, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 rng: random.Random = None):
+        rng = rng or random.Random()
+        self.latency = latency_s if isinstance(latency_s, Latency) else Latency(latency_s, rng)
+        self.faults = Faults("elevenlabs", error_rate, throttle_rate, rng)
+
+    def generate(self, text: str, voice: str = None, model: str = None) -> bytes:
+        time.sleep(self.latency.sample())
+        self.faults.check()
+        return f"<audio:{text}>".encode()
+
+
+def create_perplexity_app(latency_s=0.2, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                          rng: random.Random = None) -> FastAPI:
+    """Build a local app that answers the Perplexity chat completions route"""
+    app = FastAPI(title="Perplexity stub")
+    rng = rng or random.Random()
+    latency = latency_s if isinstance(latency_s, Latency) else Latency(latency_s, rng)
+    app.state.faults = Faults("perplexity", error_rate, throttle_rate, rng)
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(body: dict):
+        await asyncio.sleep(latency.sample())
+        outcome = app.state.faults.draw()
+        if outcome == "throttled":
+            return JSONResponse({"error": "rate limited"}, status_code=429)
+        if outcome == "error":
+            return JSONResponse({"error": "stub failure"}, status_code=500)
+        return {
+            "choices": [
+                {"message": {"content": "Dropped calls are usually caused by weak signal or outdated carrier settings."}}
+            ]
+        }
+
+    return app
+
+
+class StubServer:
+    """Runs an ASGI app with uvicorn on a background thread"""
+    def __init__(self, app: FastAPI, port: int = 8765):
+        self.port = port
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        logger.info(f"Stub upstream listening on 127.0.0.1:{self.port}")
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def install(gemini_latency_s=0.2, perplexity_port: int = 8765, tts_latency_s=0.2,
+            error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = None):
+    """
+    Point services.py at the local stand-ins.
+    error_rate / throttle_rate apply to Gemini and ElevenLabs; pass the same
+    values to create_perplexity_app for the Perplexity stand-in.
+    Returns: (gemini stub, tts stub)
+    """
+    rng = random.Random(seed)
+    gemini = StubGeminiModel(gemini_latency_s, error_rate=error_rate, throttle_rate=throttle_rate, rng=rng)
+    tts = StubTTSClient(tts_latency_s, error_rate=error_rate, throttle_rate=throttle_rate, rng=rng)
+    providers.override("gemini", gemini)
+    providers.override("elevenlabs", tts)
+    providers.override("perplexity", "stub")
+    services.PERPLEXITY_API_URL = f"http://127.0.0.1:{perplexity_port}/openai/v1/chat/completions"
+    return gemini, tts
+
+
+def stubbed_app():
+    """
+    App factory for serving main.app against the stand-ins from worker
+    processes: each worker installs the stubs from STUB_* variables, which
+    the command line below sets before starting uvicorn.
+    """
+    seed = os.getenv("STUB_SEED")
+    install(
+        os.getenv("STUB_GEMINI_LATENCY", "0.2"),
+        int(os.getenv("STUB_PERPLEXITY_PORT", "8765")),
+        os.getenv("STUB_TTS_LATENCY", "0.2"),
+        float(os.getenv("STUB_ERROR_RATE", "0")),
+        float(os.getenv("STUB_THROTTLE_RATE", "0")),
+        int(seed) + os.getpid() if seed else None,
+    )
+    from main import app
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve main.app with every upstream stubbed")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--perplexity-port", type=int, default=8765)
+    parser.add_argument("--gemini-latency", default="0.2")
+    parser.add_argument("--perplexity-latency", default="0.2")
+    parser.add_argument("--tts-latency", default="0.2")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "STUB_GEMINI_LATENCY": args.gemini_latency,
+        "STUB_TTS_LATENCY": args.tts_latency,
+        "STUB_PERPLEXITY_PORT": str(args.perplexity_port),
+        "STUB_ERROR_RATE": str(args.error_rate),
+        "STUB_THROTTLE_RATE": str(args.throttle_rate),
+        "STUB_SEED": "" if args.seed is None else str(args.seed),
+        # Read by shared_state when each worker imports it
+        "WORKERS": str(args.workers),
+    })
+    StubServer(create_perplexity_app(args.perplexity_latency, args.error_rate, args.throttle_rate,
+                                     random.Random(args.seed)), args.perplexity_port).start()
+    if args.workers > 1:
+        uvicorn.run("stub_upstream:stubbed_app", factory=True, host="0.0.0.0", port=args.port,
+                    workers=args.workers, log_level="warning")
+    else:
+        uvicorn.run(stubbed_app(), host="0.0.0.0", port=args.port, log_level="warning")
@@ -0,0 +1,37 @@
+# test_fused_mode.py
+# Regression test: a fused classify-and-respond call that runs out of time
+#
+#     python -m pytest -q test_fused_mode.py
+#
+# _route_fused cancels context retrieval before the fused call, so when that
+# call hits the request deadline the pipeline has no context unless the
+# deadline branch supplies one. /chat used to fail with a 500 there.
+
+import os
+import tempfile
+
+os.environ.setdefault("LOG_DB_PATH", os.path.join(tempfile.mkdtemp(), "interactions.db"))
+
+from fastapi.testclient import TestClient
+import agents
+import main
+import stub_upstream
+from services import FALLBACK_CONTEXT, FALLBACK_RESPONSE
+
+
+def test_fused_call_past_deadline_returns_fallback(monkeypatch):
+    stub_upstream.install(gemini_latency_s=2.0, seed=1)
+    monkeypatch.setattr(agents, "FUSED_MODE", True)
+    monkeypatch.setenv("CHAT_DEADLINE_S", "0.5")
+    client = TestClient(main.app)
+
+    response = client.post("/chat", json={
+        "customer_id": "fused-timeout",
+        "message": "Something odd has been going on with my account lately, case fused-timeout",
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["response"] == FALLBACK_RESPONSE
+    assert body["agent_type"] == "other"
+    assert body["context_used"] == FALLBACK_CONTEXT[:200]
@@ -0,0 +1,92 @@
+# voice.py
+# Incremental voice pipeline: split streamed text into sentences, synthesize them concurrently, emit audio in order
+
+from services import text_to_speech_async
+from limits import Overloaded
+import asyncio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "3"))
+# Short sentences are merged with the next one so each TTS call carries enough text
+MIN_TTS_CHUNK_CHARS = int(os.getenv("MIN_TTS_CHUNK_CHARS", "20"))
+
+# Sentence end: terminal punctuation (not a list number like "1.") followed by whitespace, or a line break
+_SENTENCE_END_RE = re.compile(r"(?<!\b\d)[.!?]+[\"')\]]*\s+|\n+")
+
+
+class SentenceChunker:
+    """Accumulates streamed text and emits complete sentences"""
+    def __init__(self, min_chars: int = MIN_TTS_CHUNK_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> list:
+        """Add streamed text. Returns: sentences completed so far"""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> list:
+        """Returns: whatever text remains once the stream has ended"""
+        remainder, self.buffer = self.buffer.strip(), ""
+        return [remainder] if remainder else []
+
+
+async def synthesize_stream(tokens, concurrency: int = TTS_CONCURRENCY):
+    """
+    Turn an async iterator of text chunks into audio chunks.
+    Each sentence is synthesized as soon as it is complete, with up to
+    `concurrency` sentences in flight; audio is yielded in sentence order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = asyncio.Queue()
+
+    async def synthesize(sentence: str) -> dict:
+        async with semaphore:
+            try:
+                return await text_to_speech_async(sentence)
+            except Overloaded as e:
+                # Audio is already streaming, so a shed sentence is skipped rather than failing the response
+                return {"success": False, "message": str(e)}
+
+    async def produce():
+        chunker = SentenceChunker()
+        try:
+            async for token in tokens:
+                for sentence in chunker.feed(token):
+                    pending.put_nowait(asyncio.ensure_future(synthesize(sentence)))
+            for sentence in chunker.flush():
+                pending.put_nowait(asyncio.ensure_future(synthesize(sentence)))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            result = await task
+            if result["success"]:
+                yield result["audio"]
+            else:
+                logger.warning(f"Skipping sentence audio: {result['message']}")
+        # Surface any error from the text stream
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()